@@ -0,0 +1,485 @@
+import hashlib
+import math
+from datetime import date, datetime, time, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from flask import Blueprint, current_app, g, jsonify, request, url_for
+from werkzeug.exceptions import HTTPException
+
+from db_pool import run_write
+from instrumentation import span
+from inventory_batch import apply_batch
+from listing import ITEM_PAGER, RECIPE_PAGER, SQLITE_INT_MAX, SQLITE_INT_MIN
+from recipe_store import RECIPE_FIELDS, delete_recipe, get_recipe, insert_recipe, update_recipe
+
+# 在庫1件分として返す列
+ITEM_COLUMNS = ('id', 'name', 'quantity', 'category', 'expiry_date', 'updated_at')
+# PATCH /items/<id> で変更できる列
+ITEM_EDITABLE = ('name', 'quantity', 'category', 'expiry_date')
+
+ITEM_QUERY = f"SELECT {', '.join(ITEM_COLUMNS)} FROM items WHERE id = ?"
+# テーブルの更新回数と最終更新日時（migrations.py のトリガーで更新される）
+DATA_VERSIONS_QUERY = "SELECT name, version, updated_at FROM data_versions WHERE name IN ({})"
+# 推薦に使う在庫
+INVENTORY_QUERY = "SELECT name, quantity, expiry_date FROM items WHERE quantity > 0"
+
+# 1回の一括登録・一括増減で受け付ける件数の上限
+MAX_BATCH = 500
+# 献立の日数の上限
+MAX_MENU_DAYS = 14
+# 在庫の数量・1回の増減量として受け付ける上限（絶対値）
+MAX_QUANTITY = 10 ** 9
+
+
+class ApiError(Exception):
+    """JSON の {"error": ...} として返すエラー"""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def _json_body() -> Dict:
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise ApiError("JSONオブジェクトを送信してください")
+    return data
+
+
+def _int_arg(name: str, default: int, minimum: int, maximum: int) -> int:
+    """クエリパラメータの整数（範囲外は丸める）"""
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        raise ApiError(f"{name} は整数で指定してください")
+    return max(minimum, min(value, maximum))
+
+
+def _requested_fields() -> Optional[set]:
+    """?fields=recipe_id,title,score の指定（指定なしなら None = すべて）"""
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    return {field.strip() for field in fields.split(',') if field.strip()}
+
+
+def _select_fields(record: Optional[Dict], fields: Optional[set]) -> Optional[Dict]:
+    if record is None or fields is None:
+        return record
+    return {key: value for key, value in record.items() if key in fields}
+
+
+def _is_int(value, minimum: int = SQLITE_INT_MIN, maximum: int = SQLITE_INT_MAX) -> bool:
+    """bool 以外の整数で、範囲内か（既定は SQLite の INTEGER に入る範囲）"""
+    return isinstance(value, int) and not isinstance(value, bool) and minimum <= value <= maximum
+
+
+def _is_scalar(value) -> bool:
+    """そのまま列に保存できる値（文字列・整数・有限の小数・null）か"""
+    if value is None or isinstance(value, str):
+        return True
+    if isinstance(value, float):
+        return math.isfinite(value)
+    return _is_int(value)
+
+
+def _validate_item(data: Dict, partial: bool) -> Dict:
+    """在庫の入力値を確認して列 → 値の辞書にする"""
+    values = {column: data[column] for column in ITEM_EDITABLE if column in data}
+    if not partial and 'name' not in values:
+        raise ApiError("name は必須です")
+    if 'name' in values and (not isinstance(values['name'], str) or not values['name'].strip()):
+        raise ApiError("name は空でない文字列で指定してください")
+    if 'quantity' in values:
+        if not _is_int(values['quantity'], -MAX_QUANTITY, MAX_QUANTITY):
+            raise ApiError(f"quantity は絶対値が{MAX_QUANTITY}以下の整数で指定してください")
+    elif not partial:
+        values['quantity'] = 0
+    for column in ('category', 'expiry_date'):
+        if values.get(column) is not None and not isinstance(values[column], str):
+            raise ApiError(f"{column} は文字列か null で指定してください")
+    if values.get('expiry_date'):
+        try:
+            date.fromisoformat(values['expiry_date'])
+        except (TypeError, ValueError):
+            raise ApiError("expiry_date は YYYY-MM-DD で指定してください")
+    if not values:
+        raise ApiError(f"変更する項目を指定してください: {', '.join(ITEM_EDITABLE)}")
+    return values
+
+
+def _validate_adjustments(adjustments, required: bool) -> List[Tuple[int, int]]:
+    """数量の増減 [{id, delta}, ...] を (在庫ID, 増減量) のリストにする"""
+    if not isinstance(adjustments, list) or (required and not adjustments):
+        raise ApiError("adjustments に {id, delta} の配列を指定してください")
+    if len(adjustments) > MAX_BATCH:
+        raise ApiError(f"adjustments は{MAX_BATCH}件までです")
+    params = []
+    for adjustment in adjustments:
+        if not isinstance(adjustment, dict):
+            raise ApiError("adjustments の要素は {id, delta} で指定してください")
+        item_id, delta = adjustment.get('id'), adjustment.get('delta')
+        if not _is_int(item_id):
+            raise ApiError("id は整数で指定してください")
+        if not _is_int(delta, -MAX_QUANTITY, MAX_QUANTITY):
+            raise ApiError(f"delta は絶対値が{MAX_QUANTITY}以下の整数で指定してください")
+        params.append((item_id, delta))
+    return params
+
+
+def _validate_recipe(data: Dict):
+    """レシピの入力値を (RECIPE_FIELDS の辞書, 材料, 手順) にする"""
+    if not isinstance(data.get('title'), str) or not data['title'].strip():
+        raise ApiError("title は必須です")
+    ingredients = data.get('ingredients', [])
+    steps = data.get('steps', [])
+    if not isinstance(ingredients, list) or not all(isinstance(ing, dict) for ing in ingredients):
+        raise ApiError("ingredients はオブジェクトの配列で指定してください")
+    for ing in ingredients:
+        if not isinstance(ing.get('name'), str) or not ing['name'].strip():
+            raise ApiError("ingredients の name は空でない文字列で指定してください")
+        if any(ing.get(key) is not None and not isinstance(ing[key], str) for key in ('quantity', 'unit')):
+            raise ApiError("ingredients の quantity と unit は文字列か null で指定してください")
+        if 'is_essential' in ing and not isinstance(ing['is_essential'], int):
+            raise ApiError("ingredients の is_essential は真偽値で指定してください")
+    if not isinstance(steps, list) or not all(isinstance(step, str) for step in steps):
+        raise ApiError("steps は文字列の配列で指定してください")
+    recipe = {field: data.get(field) for field in RECIPE_FIELDS}
+    for field, value in recipe.items():
+        if not _is_scalar(value):
+            raise ApiError(f"{field} は文字列・数値・null のいずれかで指定してください")
+    return recipe, ingredients, steps
+
+
+def _recipe_json(stored: Dict) -> Dict:
+    recipe = dict(stored['recipe'])
+    recipe['ingredients'] = [
+        {'name': ing['name'], 'quantity': ing['quantity'], 'unit': ing['unit'], 'is_essential': bool(ing['is_essential'])}
+        for ing in stored['ingredients']
+    ]
+    recipe['steps'] = [step['description'] for step in stored['steps']]
+    return recipe
+
+
+def _parse_timestamp(value) -> Optional[datetime]:
+    """SQLite の CURRENT_TIMESTAMP（UTC）を datetime にする"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value)).replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+class ConditionalGet:
+    """
+    条件付きGET（ETag / Last-Modified）
+
+    ETag はテーブルの更新回数とURL（クエリ文字列を含む）から作るため、
+    データを読む前に 304 を返せる。更新回数はトリガーで数えているので
+    別の接続・プロセスからの変更でも変わる。
+    """
+
+    def __init__(self, conn, tables: Sequence[str], daily: bool = False):
+        """
+        Args:
+            conn: DB接続
+            tables: 応答の元になるテーブル（data_versions の name）
+            daily: 日付によって結果が変わるか（賞味期限を使う推薦など）
+        """
+        rows = conn.execute(DATA_VERSIONS_QUERY.format(', '.join('?' * len(tables))), tuple(tables)).fetchall()
+        versions = sorted((row['name'], row['version']) for row in rows)
+        modified = [ts for ts in (_parse_timestamp(row['updated_at']) for row in rows) if ts is not None]
+
+        key = [request.full_path, repr(versions)]
+        if daily:
+            today = date.today()
+            key.append(today.isoformat())
+            modified.append(datetime.combine(today, time()).astimezone(timezone.utc))
+        # 更新回数が取れない（マイグレーション前など）場合はキャッシュさせない
+        self.cacheable = len(rows) == len(tables)
+        self.etag = hashlib.sha1('|'.join(key).encode('utf-8')).hexdigest()[:16]
+        self.last_modified = max(modified) if modified else None
+
+    def not_modified(self) -> bool:
+        """クライアントのキャッシュが最新か"""
+        if not self.cacheable:
+            return False
+        if request.if_none_match:
+            return request.if_none_match.contains(self.etag)
+        if request.if_modified_since and self.last_modified:
+            return self.last_modified.replace(microsecond=0) <= request.if_modified_since
+        return False
+
+    def respond(self, payload=None):
+        """JSON の応答（キャッシュが最新なら本文なしの 304）"""
+        response = jsonify(payload) if payload is not None else current_app.response_class(status=304)
+        if self.cacheable:
+            response.set_etag(self.etag)
+            if self.last_modified:
+                response.last_modified = self.last_modified
+            response.cache_control.no_cache = True
+        return response
+
+
+def create_api_blueprint(get_db_connection, recommender_loader, refresh_recommender, list_page_size,
+                         recommendation_cache, profiler=None) -> Blueprint:
+    """
+    JSON API（/api/v1）の Blueprint を作る
+
+    Args:
+        get_db_connection: リクエスト中のDB接続を返す関数
+        recommender_loader: 推薦モデルの RecommenderLoader
+        refresh_recommender: レシピの変更を推薦モデルに反映する関数 (recipe_id, removed=False, versions=None)
+        list_page_size: 一覧の1ページの件数を返す関数
+        recommendation_cache: 推薦結果の RecommendationCache
+        profiler: 推薦処理をプロファイルする RequestProfiler（省略時はプロファイルしない）
+    """
+    api = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+    @api.errorhandler(ApiError)
+    def handle_api_error(e):
+        headers = {'Retry-After': '3'} if e.status == 503 else {}
+        return jsonify({'error': e.message}), e.status, headers
+
+    @api.errorhandler(HTTPException)
+    def handle_http_error(e):
+        return jsonify({'error': e.description}), e.code
+
+    def fetch_item(conn, item_id) -> Dict:
+        row = conn.execute(ITEM_QUERY, (item_id,)).fetchone()
+        if row is None:
+            raise ApiError("在庫が見つかりません", 404)
+        return dict(row)
+
+    def ready_recommender():
+        recommender_loader.sync(get_db_connection())
+        recommender = recommender_loader.get(timeout=current_app.config['RECOMMENDER_WAIT_SECONDS'])
+        if recommender is None:
+            if recommender_loader.state == recommender_loader.FAILED:
+                raise ApiError("レシピデータの読み込みに失敗しました", 500)
+            raise ApiError("レシピ推薦システムを準備中です", 503)
+        return recommender
+
+    def recommend(conn, inventory_items, label, key_params, compute):
+        """推薦結果（キャッシュから。プロファイルを指定されたリクエストはキャッシュを使わずに計算する）"""
+        mode = profiler.requested_mode(request) if profiler is not None else None
+        with span('recommend'):
+            if mode:
+                result, g.profile_name = profiler.run(mode, label, compute)
+                return result
+            cache_key = recommendation_cache.make_key(conn, inventory_items, *key_params)
+            return recommendation_cache.get_or_compute(cache_key, compute)
+
+    def inventory(conn) -> List[Dict]:
+        return [dict(row) for row in conn.execute(INVENTORY_QUERY)]
+
+    # --- 在庫 ---
+
+    @api.route('/items', methods=['GET'])
+    def list_items():
+        conn = get_db_connection()
+        cache = ConditionalGet(conn, ('items',))
+        if cache.not_modified():
+            return cache.respond()
+        page = ITEM_PAGER.page(conn, request.args.get('sort'), request.args.get('category', ''),
+                               request.args.get('cursor'), list_page_size())
+        return cache.respond({
+            'items': [dict(row) for row in page['rows']],
+            'next_cursor': page['next_cursor'],
+            'sort': page['sort'],
+        })
+
+    @api.route('/items/<int:item_id>', methods=['GET'])
+    def get_item(item_id):
+        conn = get_db_connection()
+        cache = ConditionalGet(conn, ('items',))
+        if cache.not_modified():
+            return cache.respond()
+        return cache.respond(fetch_item(conn, item_id))
+
+    @api.route('/items', methods=['POST'])
+    def create_item():
+        values = _validate_item(_json_body(), partial=False)
+        values['updated_at'] = datetime.now()
+        conn = get_db_connection()
+        item_id = run_write(conn, lambda db: db.execute(
+            f"INSERT INTO items ({', '.join(values)}) VALUES ({', '.join('?' * len(values))})",
+            tuple(values.values())
+        ).lastrowid)
+        response = jsonify(fetch_item(conn, item_id))
+        response.status_code = 201
+        response.headers['Location'] = url_for('.get_item', item_id=item_id)
+        return response
+
+    @api.route('/items/<int:item_id>', methods=['PATCH'])
+    def patch_item(item_id):
+        values = _validate_item(_json_body(), partial=True)
+        values['updated_at'] = datetime.now()
+        conn = get_db_connection()
+        updated = run_write(conn, lambda db: db.execute(
+            f"UPDATE items SET {', '.join(f'{column}=?' for column in values)} WHERE id=?",
+            tuple(values.values()) + (item_id,)
+        ).rowcount)
+        if not updated:
+            raise ApiError("在庫が見つかりません", 404)
+        return jsonify(fetch_item(conn, item_id))
+
+    @api.route('/items/<int:item_id>', methods=['DELETE'])
+    def remove_item(item_id):
+        deleted = run_write(get_db_connection(), lambda db: db.execute(
+            "DELETE FROM items WHERE id = ?", (item_id,)
+        ).rowcount)
+        if not deleted:
+            raise ApiError("在庫が見つかりません", 404)
+        return '', 204
+
+    def run_batch(inserts, adjustments):
+        missing, created, adjusted = run_write(get_db_connection(), lambda db: apply_batch(db, inserts, adjustments))
+        if missing:
+            raise ApiError(f"在庫が見つかりません: {', '.join(map(str, missing))}", 404)
+        return created, adjusted
+
+    @api.route('/items/adjust', methods=['POST'])
+    def adjust_items():
+        """
+        数量の一括増減 {"adjustments": [{"id": 1, "delta": -1}, ...]}
+
+        すべてを1つの書き込みトランザクションで行う。存在しない在庫が含まれる場合は何も変更しない。
+        """
+        adjustments = _validate_adjustments(_json_body().get('adjustments'), required=True)
+        _, adjusted = run_batch([], adjustments)
+        return jsonify({'items': adjusted})
+
+    @api.route('/items/batch', methods=['POST'])
+    def batch_items():
+        """
+        在庫の一括登録と数量の一括増減（買い物の登録など）
+
+        {"add": [{"name": "牛乳", "quantity": 2, ...}, ...], "adjustments": [{"id": 1, "delta": -3}, ...]}
+        登録・増減をそれぞれ executemany で行い、1回のコミットで確定する。
+        """
+        data = _json_body()
+        inserts = data.get('add', [])
+        if not isinstance(inserts, list) or not all(isinstance(item, dict) for item in inserts):
+            raise ApiError("add は在庫のオブジェクトの配列で指定してください")
+        inserts = [_validate_item(item, partial=False) for item in inserts]
+        adjustments = _validate_adjustments(data.get('adjustments', []), required=False)
+        if not inserts and not adjustments:
+            raise ApiError("add または adjustments を指定してください")
+        if len(inserts) + len(adjustments) > MAX_BATCH:
+            raise ApiError(f"add と adjustments は合わせて{MAX_BATCH}件までです")
+        created, adjusted = run_batch(inserts, adjustments)
+        status = 201 if created else 200
+        return jsonify({'created': created, 'adjusted': adjusted}), status
+
+    # --- レシピ ---
+
+    @api.route('/recipes', methods=['GET'])
+    def list_recipes():
+        conn = get_db_connection()
+        cache = ConditionalGet(conn, ('recipes',))
+        if cache.not_modified():
+            return cache.respond()
+        page = RECIPE_PAGER.page(conn, request.args.get('sort'), request.args.get('genre', ''),
+                                 request.args.get('cursor'), list_page_size())
+        return cache.respond({
+            'recipes': [dict(row) for row in page['rows']],
+            'next_cursor': page['next_cursor'],
+            'sort': page['sort'],
+        })
+
+    @api.route('/recipes/<int:recipe_id>', methods=['GET'])
+    def get_recipe_json(recipe_id):
+        conn = get_db_connection()
+        cache = ConditionalGet(conn, ('recipes',))
+        if cache.not_modified():
+            return cache.respond()
+        stored = get_recipe(conn, recipe_id)
+        if stored is None:
+            raise ApiError("レシピが見つかりません", 404)
+        return cache.respond(_select_fields(_recipe_json(stored), _requested_fields()))
+
+    @api.route('/recipes', methods=['POST'])
+    def create_recipe():
+        recipe, ingredients, steps = _validate_recipe(_json_body())
+        conn = get_db_connection()
+        recipe_id, versions = run_write(
+            conn, recommender_loader.versioned(lambda db: insert_recipe(db, recipe, ingredients, steps)))
+        refresh_recommender(recipe_id, versions=versions)
+        response = jsonify(_recipe_json(get_recipe(conn, recipe_id)))
+        response.status_code = 201
+        response.headers['Location'] = url_for('.get_recipe_json', recipe_id=recipe_id)
+        return response
+
+    @api.route('/recipes/<int:recipe_id>', methods=['PUT'])
+    def replace_recipe(recipe_id):
+        recipe, ingredients, steps = _validate_recipe(_json_body())
+        conn = get_db_connection()
+        updated, versions = run_write(
+            conn, recommender_loader.versioned(lambda db: update_recipe(db, recipe_id, recipe, ingredients, steps)))
+        if not updated:
+            raise ApiError("レシピが見つかりません", 404)
+        refresh_recommender(recipe_id, versions=versions)
+        return jsonify(_recipe_json(get_recipe(conn, recipe_id)))
+
+    @api.route('/recipes/<int:recipe_id>', methods=['DELETE'])
+    def remove_recipe(recipe_id):
+        deleted, versions = run_write(
+            get_db_connection(), recommender_loader.versioned(lambda db: delete_recipe(db, recipe_id)))
+        if not deleted:
+            raise ApiError("レシピが見つかりません", 404)
+        refresh_recommender(recipe_id, removed=True, versions=versions)
+        return '', 204
+
+    # --- 推薦 ---
+
+    @api.route('/recommendations', methods=['GET'])
+    def recommendations():
+        """在庫に合うレシピ（?top_n=5&fields=recipe_id,title,score）"""
+        conn = get_db_connection()
+        top_n = _int_arg('top_n', 5, 1, 50)
+        cache = ConditionalGet(conn, ('items', 'recipes', 'feedback'), daily=True)
+        if cache.not_modified():
+            return cache.respond()
+        recommender = ready_recommender()
+        fields = _requested_fields()
+        inventory_items = inventory(conn)
+        results = recommend(conn, inventory_items, 'api_recommendations', ('recipes', top_n),
+                            lambda: recommender.recommend_recipes(inventory_items, top_n=top_n))
+        return cache.respond({'recipes': [_select_fields(result, fields) for result in results]})
+
+    @api.route('/menus', methods=['GET'])
+    def menus():
+        """在庫を使い回す献立（?days=5&planner=greedy|beam&fields=...）"""
+        conn = get_db_connection()
+        days = _int_arg('days', 5, 1, MAX_MENU_DAYS)
+        planner = request.args.get('planner', current_app.config['MENU_PLANNER'])
+        if planner not in ('greedy', 'beam'):
+            raise ApiError("planner は greedy または beam で指定してください")
+        cache = ConditionalGet(conn, ('items', 'recipes', 'feedback'), daily=True)
+        if cache.not_modified():
+            return cache.respond()
+        recommender = ready_recommender()
+        fields = _requested_fields()
+        inventory_items = inventory(conn)
+        budget_ms = current_app.config['MENU_PLANNER_BUDGET_MS']
+        daily_menus = recommend(conn, inventory_items, 'api_menus', ('menu', days, planner, budget_ms),
+                                lambda: recommender.recommend_daily_menu(
+                                    inventory_items, days=days, strategy=planner, time_budget_ms=budget_ms))
+        return cache.respond({'menus': [
+            {
+                'day': menu['day'],
+                'main_dish': _select_fields(menu['main_dish'], fields),
+                'side_dish': _select_fields(menu['side_dish'], fields),
+            }
+            for menu in daily_menus
+        ]})
+
+    @api.route('/recommendations/cache', methods=['GET'])
+    def recommendation_cache_stats():
+        """推薦結果のキャッシュのヒット・ミスの回数"""
+        return jsonify(recommendation_cache.stats())
+
+    return api
@@ -1,17 +1,26 @@
-from flask import Flask, render_template, request, g, redirect, url_for
+from flask import Flask, Response, render_template, request, g, redirect, url_for
 import webbrowser
 from threading import Timer
-from flask_sqlalchemy import SQLAlchemy
 import sqlite3
 from datetime import datetime, timedelta #賞味期限の計算
 import os
-import socket
-from ml_recipe_recommender import MLRecipeRecommender
+from recommender_loader import RecommenderLoader
+from db_pool import ConnectionPool, run_write
+from migrations import apply_migrations
+from catalog_io import seed_catalog_if_empty
+from qr_service import AccessQRCode, get_local_ip
+from expiry_alerts import ExpiryAlerts
+from listing import ITEM_PAGER, RECIPE_PAGER
+from api import create_api_blueprint
+from recommendation_cache import RecommendationCache
+import instrumentation
+from instrumentation import span
+import request_profiler
+from request_profiler import RequestProfiler
+from recipe_store import RECIPE_FIELDS, get_recipe, insert_recipe, update_recipe, delete_recipe as delete_recipe_rows
 
 import sys
 import qrcode
-import io
-import base64
 
 # PyInstallerのリソースパス取得用関数
 def resource_path(relative_path):
@@ -35,34 +44,157 @@ else:
 
 # 読み込み専用リソース（Excel, SQLなど）は resource_path を使用
 # データベースは EXE_DIR に保存（永続化のため）
-DATABASE = os.path.join(EXE_DIR, "inventory.db")
+# FRIDGEMATE_DATABASE で別のファイルを指定できる（負荷試験など）
+DATABASE = os.environ.get('FRIDGEMATE_DATABASE', os.path.join(EXE_DIR, "inventory.db"))
 app = Flask(__name__)
 
 # レシピ推薦システムの初期化
 # データベース(inventory.db)を使用
-try:
-    recommender = MLRecipeRecommender(DATABASE)
-    print("機械学習レシピ推薦システムを初期化しました")
-except Exception as e:
-    print(f"レシピデータの読み込みエラー: {e}")
-    import traceback
-    traceback.print_exc()
-    recommender = None
+# pandas / scikit-learn の読み込みとモデル構築はバックグラウンドで行い、
+# 在庫一覧などのページは起動直後から表示できるようにする
+# FRIDGEMATE_RECOMMENDER_LOAD=lazy の場合は /recipes への最初のアクセス時に読み込む
+# preload の場合は import 時に読み込み終える（wsgi.py: ワーカーを fork する前に読み込んでメモリを共有する）
+app.config['RECOMMENDER_LOAD'] = os.environ.get('FRIDGEMATE_RECOMMENDER_LOAD', 'background')
+# 複数のワーカープロセスで動かす場合は、他のプロセスによるレシピ・フィードバックの変更を
+# 推薦の前に data_versions で確認して反映する（wsgi.py で有効になる）
+app.config['RECOMMENDER_SYNC'] = os.environ.get('FRIDGEMATE_RECOMMENDER_SYNC', '0') == '1'
+# 必須食材のマッチ率がこれ未満のレシピは推薦しない（0 なら必須食材が1つでも在庫にあれば対象）
+# 在庫の必須食材を使うレシピだけを逆引き索引で候補にしてスコアを計算するため、値を上げると計算も減る
+app.config['MIN_ESSENTIAL_COVERAGE'] = float(os.environ.get('FRIDGEMATE_MIN_ESSENTIAL_COVERAGE', '0'))
+# /recipes で準備完了を待つ最大秒数
+app.config['RECOMMENDER_WAIT_SECONDS'] = float(os.environ.get('FRIDGEMATE_RECOMMENDER_WAIT', '2'))
+
+# 献立の作成方法: greedy（日ごとに最善）/ beam（期間全体で期限の近い食材を使い切る）
+# /recipes?planner=beam でリクエストごとに切り替えられる
+app.config['MENU_PLANNER'] = os.environ.get('FRIDGEMATE_MENU_PLANNER', 'greedy')
+# beam の探索時間の上限（ミリ秒）
+app.config['MENU_PLANNER_BUDGET_MS'] = float(os.environ.get('FRIDGEMATE_MENU_PLANNER_BUDGET_MS', '300'))
+
+# 起動時にスキーマ（テーブル・インデックス）を最新のバージョンにする
+# （推薦モデルが読み込み時点のデータの更新回数を読めるよう、読み込みより前に行う）
+apply_migrations(DATABASE)
+
+# 初回起動時（レシピが1件もない場合）は同梱のレシピカタログを読み込む
+# カタログは python catalog_io.py export recipe_catalog.jsonl.gz で作成する
+seed_catalog_if_empty(DATABASE, resource_path("recipe_catalog.jsonl.gz"))
+
+# 推薦結果のキャッシュ（在庫の内容・レシピの更新回数・日付が同じなら計算し直さない）
+app.config['RECOMMENDATION_CACHE_SIZE'] = int(os.environ.get('FRIDGEMATE_RECOMMENDATION_CACHE_SIZE', '32'))
+app.config['RECOMMENDATION_CACHE_TTL'] = float(os.environ.get('FRIDGEMATE_RECOMMENDATION_CACHE_TTL', '600'))
+recommendation_cache = RecommendationCache(max_entries=app.config['RECOMMENDATION_CACHE_SIZE'],
+                                           ttl_seconds=app.config['RECOMMENDATION_CACHE_TTL'])
+
+recommender_loader = RecommenderLoader(DATABASE, sync_versions=app.config['RECOMMENDER_SYNC'],
+                                       on_reload=recommendation_cache.invalidate,
+                                       recommender_options={
+                                           'min_essential_coverage': app.config['MIN_ESSENTIAL_COVERAGE']
+                                       })
+if app.config['RECOMMENDER_LOAD'] == 'preload':
+    recommender_loader.load()
+elif app.config['RECOMMENDER_LOAD'] != 'lazy':
+    recommender_loader.start()
+
+def refresh_recommender(recipe_id, removed=False, versions=None):
+    """
+    レシピの追加・編集・削除を推薦モデルに反映（準備中なら読み込み完了後に反映）
+
+    versions: recommender_loader.versioned で書き込んだ場合の前後の更新回数
+              （反映済みとして記録し、他のワーカーと同じ読み込み直しをしない）
+    """
+    def update(recommender):
+        if removed:
+            recommender.remove_recipe(recipe_id)
+        else:
+            recommender.upsert_recipe(recipe_id)
+        recommender_loader.applied(versions)
+        # 反映前のモデルで計算した結果が残らないよう、反映後に消す
+        recommendation_cache.invalidate()
+    recommender_loader.when_ready(update)
+
+def refresh_feedback(recipe_id):
+    """フィードバックの集計を推薦モデルに反映（準備中なら読み込み時に集計ごと読まれる）"""
+    def update(recommender):
+        recommender.refresh_feedback(recipe_id)
+        recommendation_cache.invalidate()
+    try:
+        recipe_id = int(recipe_id)
+    except (TypeError, ValueError):
+        return
+    recommender_loader.when_ready(update)
+
+# 一覧ページの1ページあたりの件数（?limit= で変更可、上限あり）
+app.config['LIST_PAGE_SIZE'] = int(os.environ.get('FRIDGEMATE_LIST_PAGE_SIZE', '50'))
+LIST_PAGE_SIZE_MAX = 200
+
+def list_page_size():
+    """リクエストで指定された1ページの件数"""
+    try:
+        limit = int(request.args.get('limit', app.config['LIST_PAGE_SIZE']))
+    except ValueError:
+        limit = app.config['LIST_PAGE_SIZE']
+    return max(1, min(limit, LIST_PAGE_SIZE_MAX))
+
+# 賞味期限アラート（何日後までの期限を「近い」とするか）
+app.config['EXPIRY_ALERT_DAYS'] = int(os.environ.get('FRIDGEMATE_EXPIRY_ALERT_DAYS', '3'))
+expiry_alerts = ExpiryAlerts(horizon_days=app.config['EXPIRY_ALERT_DAYS'])
+
+# スマートフォンからのアクセス用URLとQRコード（ローカルIPの確認は60秒に1回）
+access_qr = AccessQRCode(port=5000)
+
+# DB接続プール（接続ごとにWALなどのPRAGMAを1回だけ設定して使い回す）
+# 複数のスマートフォンから同時に操作されても読み込みが書き込みを待たないよう既定はWAL
+# FRIDGEMATE_DB_JOURNAL_MODE=DELETE で従来のロールバックジャーナルに戻せる
+app.config['DB_JOURNAL_MODE'] = os.environ.get('FRIDGEMATE_DB_JOURNAL_MODE', 'WAL')
+# 書き込みロックの解除を待つ最大ミリ秒（超えた場合は run_write が再試行する）
+app.config['DB_BUSY_TIMEOUT_MS'] = int(os.environ.get('FRIDGEMATE_DB_BUSY_TIMEOUT_MS', '5000'))
+db_pool = ConnectionPool(DATABASE,
+                         journal_mode=app.config['DB_JOURNAL_MODE'],
+                         busy_timeout_ms=app.config['DB_BUSY_TIMEOUT_MS'])
 
 #DB接続 SQLiteに接続し、行データを辞書形式で扱えるように設定
+# 1リクエスト（アプリケーションコンテキスト）につき1接続をプールから借りて g に保持する
 def get_db_connection():
-    conn = sqlite3.connect('inventory.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    if "db_connection" not in g:
+        g.db_connection = db_pool.acquire()
+    return g.db_connection
 #DB接続の終了(データベースへの接続を常に適切に終了させる)
+# リクエスト終了時にプールへ返す（未コミットの変更はロールバックされる）
+@app.teardown_appcontext
 def close_db_connection(exception):
     db = g.pop("db_connection", None)
     if db is not None:
-        db.close()
+        db_pool.release(db)
+
+# JSON API（/api/v1）: スマートフォンの画面から1行ずつ更新できるようにする
+# 日本語をエスケープせず、空白なしで出力して応答を小さくする
+app.json.ensure_ascii = False
+app.json.compact = True
+# 推薦処理のプロファイル（ローカルホストから ?profile=cprofile|sample を付けたリクエスト、
+# または FRIDGEMATE_PROFILE_SAMPLE_EVERY 件に1件）。保存先は新しいものから FRIDGEMATE_PROFILE_MAX 件だけ残す
+app.config['PROFILE_DIR'] = os.environ.get('FRIDGEMATE_PROFILE_DIR', os.path.join(EXE_DIR, "profiles"))
+app.config['PROFILE_MAX'] = int(os.environ.get('FRIDGEMATE_PROFILE_MAX', '20'))
+app.config['PROFILE_SAMPLE_EVERY'] = int(os.environ.get('FRIDGEMATE_PROFILE_SAMPLE_EVERY', '0'))
+profiler = RequestProfiler(app.config['PROFILE_DIR'], max_profiles=app.config['PROFILE_MAX'],
+                           sample_every=app.config['PROFILE_SAMPLE_EVERY'])
+request_profiler.init_app(app, profiler)
+
+app.register_blueprint(create_api_blueprint(get_db_connection, recommender_loader, refresh_recommender, list_page_size,
+                                           recommendation_cache, profiler))
+
+# 処理の段階ごとの所要時間（Server-Timing ヘッダー）と /metrics（Prometheus 形式）
+# FRIDGEMATE_INSTRUMENTATION=0 で計測しない
+instrumentation.init_app(app)
+instrumentation.metrics.gauge('fridgemate_recommender_ready', "推薦システムの準備ができているか",
+                              lambda: 1 if recommender_loader.ready else 0)
+instrumentation.metrics.gauge('fridgemate_recommendation_cache_entries', "推薦結果のキャッシュの件数",
+                              lambda: recommendation_cache.stats()['entries'])
+instrumentation.metrics.gauge('fridgemate_recommendation_cache_hits_total', "推薦結果のキャッシュのヒット数",
+                              lambda: recommendation_cache.hits, kind='counter')
+instrumentation.metrics.gauge('fridgemate_recommendation_cache_misses_total', "推薦結果のキャッシュのミス数",
+                              lambda: recommendation_cache.misses, kind='counter')
 
 #DB初期化
 def init_db():
-    db = get_db_connection()
     db = get_db_connection()
     #スキーマファイルはリソースとしてバンドルされている
     schema_path = resource_path("schema.sql")
@@ -70,59 +202,43 @@ def init_db():
         db.executescript(f.read())
     db.commit()
 
-    db.commit()
-
-def generate_qr_base64(data):
-    """QRコードを生成してBase64文字列として返す"""
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(data)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    buffered = io.BytesIO()
-    img.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    return img_str
-
 #在庫一覧　在庫を取得して表示
 @app.route("/")
 def index():
     conn = get_db_connection()
-    items = conn.execute("SELECT * FROM items").fetchall()
-    conn.close()
-# アラーム判定用　期限切れ、または３日以内のものをアラートに追加
-    alerts = []
-    from datetime import date, timedelta
-    today = date.today()
-    for item in items:
-        if item["expiry_date"]:
-            exp_date = date.fromisoformat(item["expiry_date"])
-            if exp_date < today:
-                alerts.append(f"{item['name']} は賞味期限切れです！（{exp_date}）")
-            elif exp_date <= today + timedelta(days=3):
-                alerts.append(f"{item['name']} の賞味期限が近いです！（{exp_date}）")
-                alerts.append(f"{item['name']} の賞味期限が近いです！（{exp_date}）")
+    # 表示する列だけを1ページ分取得（並べ替え: name / expiry / updated、カテゴリで絞り込み）
+    category = request.args.get('category', '')
+    with span('db'):
+        page = ITEM_PAGER.page(conn, request.args.get('sort'), category, request.args.get('cursor'), list_page_size())
+        categories = ITEM_PAGER.filter_values(conn)
+    # アラーム判定用　期限切れ、または期限が近いもの（SQLで絞り込み、在庫が変わるか日付が変わるまでキャッシュ）
+    with span('alerts'):
+        alerts = expiry_alerts.get(conn)
     
-    # ローカルIPの取得とQRコード生成
-    local_ip = get_local_ip()
-    port = 5000
-    access_url = f"http://{local_ip}:{port}"
-    qr_code = generate_qr_base64(access_url)
+    # QRコード画像は /qr.png で配信する（URLにETagを付けてブラウザにキャッシュさせる）
+    with span('qr'):
+        _, qr_etag = access_qr.image()
     
-    return render_template("index.html", items=items, alerts=alerts, qr_code=qr_code, access_url=access_url)
+    with span('render'):
+        return render_template("index.html", items=page['rows'], alerts=alerts, qr_etag=qr_etag,
+                               access_url=access_qr.access_url, sort=page['sort'], category=category,
+                               categories=categories, next_cursor=page['next_cursor'],
+                               is_first_page=not request.args.get('cursor'))
+
+# スマートフォンからのアクセス用QRコード（IPが変わったときだけ作り直す）
+@app.route("/qr.png")
+def qr_png():
+    png, etag = access_qr.image()
+    response = Response(png, mimetype="image/png")
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response.make_conditional(request)
 
 # 在庫削除　　DBのCRUD処理
 @app.route("/delete/<int:item_id>", methods=["POST"])
 def delete_item(item_id):
-    db = get_db_connection()
-    db.execute("DELETE FROM items WHERE id = ?", (item_id,))
-    db.commit()
-    db.close()
+    run_write(get_db_connection(), lambda db: db.execute("DELETE FROM items WHERE id = ?", (item_id,)))
     return redirect(url_for("index"))
 
 # --- 商品追加 ---
@@ -132,40 +248,48 @@ def add_item():
     quantity = request.form["quantity"]
     category = request.form.get("category", "")
     expiry_date = request.form.get("expiry_date", None)
-    db = get_db_connection()
-    db.execute(
+    run_write(get_db_connection(), lambda db: db.execute(
         "INSERT INTO items (name, quantity, category, expiry_date, updated_at) VALUES (?, ?, ?, ?, ?)",
         (name, quantity, category, expiry_date, datetime.now())
-    )
-    db.commit()
+    ))
     return "追加しました！ <a href='/'>戻る</a>"
 
 # 在庫を増やす（入庫）　ボタンにて実行
 @app.route("/increase/<int:item_id>", methods=["POST"])
 def increase(item_id):
-    db = get_db_connection()
-    db.execute("UPDATE items SET quantity = quantity + 1, updated_at=? WHERE id=?", (datetime.now(), item_id))
-    db.commit()
+    # 数量の増減はSQL側で行う（同時に押されても更新が失われない）
+    run_write(get_db_connection(), lambda db: db.execute(
+        "UPDATE items SET quantity = quantity + 1, updated_at=? WHERE id=?", (datetime.now(), item_id)
+    ))
     return "在庫を1増やしました！ <a href='/'>戻る</a>"
 
 # 在庫を減らす（出庫）　ボタンにて実行
 @app.route("/decrease/<int:item_id>", methods=["POST"])
 def decrease(item_id):
-    db = get_db_connection()
-    db.execute("UPDATE items SET quantity = quantity - 1, updated_at=? WHERE id=?", (datetime.now(), item_id))
-    db.commit()
+    # 数量の増減はSQL側で行う（同時に押されても更新が失われない）
+    run_write(get_db_connection(), lambda db: db.execute(
+        "UPDATE items SET quantity = quantity - 1, updated_at=? WHERE id=?", (datetime.now(), item_id)
+    ))
     return "在庫を1減らしました！ <a href='/'>戻る</a>"
 
 # レシピ推薦機能
 @app.route("/recipes")
 def recipes():
     try:
+        recommender_loader.sync(get_db_connection())
+        recommender = recommender_loader.get(timeout=app.config['RECOMMENDER_WAIT_SECONDS'])
         if recommender is None:
-            return "レシピデータの読み込みに失敗しました。", 500
+            if recommender_loader.state == RecommenderLoader.FAILED:
+                return "レシピデータの読み込みに失敗しました。", 500
+            # 準備中: 数秒後に自動で再読み込みする
+            return (render_template("recipes.html",
+                                    daily_menus=[],
+                                    message="レシピ推薦システムを準備中です。しばらくお待ちください…"),
+                    503, {'Retry-After': '3', 'Refresh': '3'})
         
         conn = get_db_connection()
-        items = conn.execute("SELECT * FROM items WHERE quantity > 0").fetchall()
-        conn.close()
+        with span('db'):
+            items = conn.execute("SELECT * FROM items WHERE quantity > 0").fetchall()
         
         # 在庫アイテムを辞書のリストに変換
         inventory_items = [
@@ -185,19 +309,42 @@ def recipes():
                                  message="在庫に食材がありません。")
         
         # 5日分の献立を提案（在庫消費シミュレーション付き）
-        daily_menus = recommender.recommend_daily_menu(inventory_items, days=5)
+        planner = request.args.get('planner', app.config['MENU_PLANNER'])
+        if planner not in ('greedy', 'beam'):
+            planner = 'greedy'
+        budget_ms = app.config['MENU_PLANNER_BUDGET_MS']
+        compute = lambda: recommender.recommend_daily_menu(inventory_items, days=5, strategy=planner,
+                                                           time_budget_ms=budget_ms)
+        profile_mode = profiler.requested_mode(request)
+        with span('recommend'):
+            if profile_mode:
+                # プロファイルするリクエストはキャッシュを使わずに計算する
+                daily_menus, g.profile_name = profiler.run(profile_mode, 'recipes', compute)
+            else:
+                cache_key = recommendation_cache.make_key(conn, inventory_items, 'menu', 5, planner, budget_ms)
+                daily_menus = recommendation_cache.get_or_compute(cache_key, compute)
         
         if not daily_menus:
             return render_template("recipes.html", 
                                  daily_menus=[],
                                  message="在庫の食材にマッチするレシピが見つかりませんでした。")
         
-        return render_template("recipes.html", daily_menus=daily_menus)
+        with span('render'):
+            return render_template("recipes.html", daily_menus=daily_menus)
     except Exception as e:
         import traceback
         error_msg = f"<h2>エラーが発生しました</h2><p>{str(e)}</p><pre>{traceback.format_exc()}</pre><a href='/'>在庫一覧に戻る</a>"
         return error_msg, 500
 
+def form_ingredient(index):
+    """フォームの ingredients[index][...] から材料を取り出す"""
+    return {
+        'name': request.form.get(f"ingredients[{index}][name]"),
+        'quantity': request.form.get(f"ingredients[{index}][quantity]"),
+        'unit': request.form.get(f"ingredients[{index}][unit]"),
+        'is_essential': bool(request.form.get(f"ingredients[{index}][is_essential]")),
+    }
+
 # レシピ登録機能
 @app.route("/add_recipe", methods=["GET", "POST"])
 def add_recipe():
@@ -207,30 +354,12 @@ def add_recipe():
     try:
         # フォームからデータを取得
         title = request.form.get("title")
-        genre = request.form.get("genre")
-        servings = request.form.get("servings")
-        prep_time = request.form.get("prep_time")
-        cook_time = request.form.get("cook_time")
-        calorie = request.form.get("calorie")
         
         # 必須チェック
         if not title:
             return "レシピ名は必須です。", 400
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # 1. recipesテーブルに挿入
-        cursor.execute(
-            "INSERT INTO recipes (title, genre, prep_time, cook_time, servings, calorie, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (title, genre, prep_time, cook_time, servings, calorie, datetime.now())
-        )
-        recipe_id = cursor.lastrowid
-        
-        # 2. recipe_ingredientsテーブルに挿入
-        ingredients = []
-        # request.formのキーを解析して材料データを構築
-        # ingredients[0][name], ingredients[0][quantity] などの形式
+        # 材料: ingredients[0][name], ingredients[0][quantity] などの形式
         import re
         ingredient_keys = [k for k in request.form.keys() if k.startswith("ingredients[")]
         ingredient_indices = set()
@@ -238,30 +367,14 @@ def add_recipe():
             match = re.search(r"ingredients\[(\d+)\]", k)
             if match:
                 ingredient_indices.add(int(match.group(1)))
+        ingredients = [form_ingredient(i) for i in sorted(ingredient_indices)]
         
-        for i in sorted(ingredient_indices):
-            name = request.form.get(f"ingredients[{i}][name]")
-            if name: # 名前がある場合のみ登録
-                quantity = request.form.get(f"ingredients[{i}][quantity]")
-                unit = request.form.get(f"ingredients[{i}][unit]")
-                is_essential = 1 if request.form.get(f"ingredients[{i}][is_essential]") else 0
-                
-                cursor.execute(
-                    "INSERT INTO recipe_ingredients (recipe_id, name, quantity, unit, is_essential) VALUES (?, ?, ?, ?, ?)",
-                    (recipe_id, name, quantity, unit, is_essential)
-                )
-
-        # 3. recipe_stepsテーブルに挿入
+        recipe = {field: request.form.get(field) for field in RECIPE_FIELDS}
         steps = request.form.getlist("steps[]")
-        for index, description in enumerate(steps):
-            if description.strip(): # 空の手順はスキップ
-                cursor.execute(
-                    "INSERT INTO recipe_steps (recipe_id, step_number, description) VALUES (?, ?, ?)",
-                    (recipe_id, index + 1, description)
-                )
-        
-        conn.commit()
-        conn.close()
+        # recipes / recipe_ingredients / recipe_steps を1つの書き込みトランザクションで登録
+        recipe_id, versions = run_write(get_db_connection(), recommender_loader.versioned(
+            lambda conn: insert_recipe(conn, recipe, ingredients, steps)))
+        refresh_recommender(recipe_id, versions=versions)
         
         return redirect(url_for("recipes")) # 登録後はレシピ一覧へ（またはトップへ）
         
@@ -275,9 +388,12 @@ def add_recipe():
 def recipe_list():
     try:
         conn = get_db_connection()
-        recipes = conn.execute("SELECT * FROM recipes ORDER BY created_at DESC").fetchall()
-        conn.close()
-        return render_template("recipe_list.html", recipes=recipes)
+        # 表示する列だけを1ページ分取得（並べ替え: created / name、ジャンルで絞り込み）
+        genre = request.args.get('genre', '')
+        page = RECIPE_PAGER.page(conn, request.args.get('sort'), genre, request.args.get('cursor'), list_page_size())
+        return render_template("recipe_list.html", recipes=page['rows'],
+                               sort=page['sort'], genre=genre, genres=RECIPE_PAGER.filter_values(conn),
+                               next_cursor=page['next_cursor'], is_first_page=not request.args.get('cursor'))
     except Exception as e:
         return f"エラーが発生しました: {e}", 500
 
@@ -287,41 +403,19 @@ def edit_recipe(recipe_id):
     conn = get_db_connection()
     
     if request.method == "GET":
-        recipe = conn.execute("SELECT * FROM recipes WHERE id = ?", (recipe_id,)).fetchone()
-        if not recipe:
-            conn.close()
+        stored = get_recipe(conn, recipe_id)
+        if not stored:
             return "レシピが見つかりません", 404
-            
-        ingredients = conn.execute("SELECT * FROM recipe_ingredients WHERE recipe_id = ? ORDER BY id", (recipe_id,)).fetchall()
-        steps = conn.execute("SELECT * FROM recipe_steps WHERE recipe_id = ? ORDER BY step_number", (recipe_id,)).fetchall()
-        conn.close()
         
-        return render_template("edit_recipe.html", recipe=recipe, ingredients=ingredients, steps=steps)
+        return render_template("edit_recipe.html", **stored)
     
     # POST: 更新処理
     try:
         title = request.form.get("title")
-        genre = request.form.get("genre")
-        servings = request.form.get("servings")
-        prep_time = request.form.get("prep_time")
-        cook_time = request.form.get("cook_time")
-        calorie = request.form.get("calorie")
         
         if not title:
             return "レシピ名は必須です。", 400
 
-        cursor = conn.cursor()
-        
-        # 1. recipesテーブル更新
-        cursor.execute(
-            """UPDATE recipes SET title=?, genre=?, prep_time=?, cook_time=?, servings=?, calorie=? 
-               WHERE id=?""",
-            (title, genre, prep_time, cook_time, servings, calorie, recipe_id)
-        )
-        
-        # 2. recipe_ingredients更新 (一度削除して再登録が簡単)
-        cursor.execute("DELETE FROM recipe_ingredients WHERE recipe_id = ?", (recipe_id,))
-        
         import re
         ingredient_keys = [k for k in request.form.keys() if k.startswith("ingredients[")]
         ingredient_indices = set()
@@ -334,32 +428,14 @@ def edit_recipe(recipe_id):
                 if len(parts) >= 2:
                     idx = parts[1].split(']')[0]
                     ingredient_indices.add(idx)
+        ingredients = [form_ingredient(i) for i in ingredient_indices]
         
-        for i in ingredient_indices:
-            name = request.form.get(f"ingredients[{i}][name]")
-            if name: 
-                quantity = request.form.get(f"ingredients[{i}][quantity]")
-                unit = request.form.get(f"ingredients[{i}][unit]")
-                is_essential = 1 if request.form.get(f"ingredients[{i}][is_essential]") else 0
-                
-                cursor.execute(
-                    "INSERT INTO recipe_ingredients (recipe_id, name, quantity, unit, is_essential) VALUES (?, ?, ?, ?, ?)",
-                    (recipe_id, name, quantity, unit, is_essential)
-                )
-
-        # 3. recipe_steps更新 (一度削除して再登録)
-        cursor.execute("DELETE FROM recipe_steps WHERE recipe_id = ?", (recipe_id,))
-        
+        recipe = {field: request.form.get(field) for field in RECIPE_FIELDS}
         steps = request.form.getlist("steps[]")
-        for index, description in enumerate(steps):
-            if description.strip(): 
-                cursor.execute(
-                    "INSERT INTO recipe_steps (recipe_id, step_number, description) VALUES (?, ?, ?)",
-                    (recipe_id, index + 1, description)
-                )
-        
-        conn.commit()
-        conn.close()
+        # レシピ本体を更新し、材料・手順は一度削除して再登録（1つの書き込みトランザクション）
+        _, versions = run_write(conn, recommender_loader.versioned(
+            lambda conn: update_recipe(conn, recipe_id, recipe, ingredients, steps)))
+        refresh_recommender(recipe_id, versions=versions)
         return redirect(url_for("recipe_list"))
         
     except Exception as e:
@@ -371,16 +447,10 @@ def edit_recipe(recipe_id):
 @app.route("/delete_recipe/<int:recipe_id>", methods=["POST"])
 def delete_recipe(recipe_id):
     try:
-        conn = get_db_connection()
-        # カスケード削除が設定されていれば親だけで消えるが、念のため関連データも削除
-        # (SQLiteのデフォルト設定に依存しないように明示的に削除)
-        conn.execute("DELETE FROM recipe_ingredients WHERE recipe_id = ?", (recipe_id,))
-        conn.execute("DELETE FROM recipe_steps WHERE recipe_id = ?", (recipe_id,))
-        conn.execute("DELETE FROM recipe_feedback WHERE recipe_id = ?", (recipe_id,))
-        conn.execute("DELETE FROM recipes WHERE id = ?", (recipe_id,))
-        
-        conn.commit()
-        conn.close()
+        # 材料・手順・フィードバックも一緒に削除
+        _, versions = run_write(get_db_connection(), recommender_loader.versioned(
+            lambda conn: delete_recipe_rows(conn, recipe_id)))
+        refresh_recommender(recipe_id, removed=True, versions=versions)
         return redirect(url_for("recipe_list"))
     except Exception as e:
         return f"エラーが発生しました: {e}", 500
@@ -400,51 +470,31 @@ def save_feedback():
         db = get_db_connection()
         if feedback_type == 'made':
             # 「作った」フィードバック
-            db.execute(
+            run_write(db, lambda conn: conn.execute(
                 "INSERT INTO recipe_feedback (recipe_id, recipe_title, feedback_type, feedback_date) VALUES (?, ?, ?, ?)",
                 (recipe_id, recipe_title, 'made', datetime.now())
-            )
+            ))
         elif feedback_type == 'rating' and rating:
             # 評価フィードバック
             rating_int = int(rating)
             if 1 <= rating_int <= 5:
-                db.execute(
+                run_write(db, lambda conn: conn.execute(
                     "INSERT INTO recipe_feedback (recipe_id, recipe_title, feedback_type, rating, feedback_date) VALUES (?, ?, ?, ?, ?)",
                     (recipe_id, recipe_title, 'rating', rating_int, datetime.now())
-                )
+                ))
             else:
-                db.close()
                 return "評価は1-5の範囲で入力してください。", 400
         else:
-            db.close()
             return "無効なフィードバックタイプです。", 400
         
-        db.commit()
-        db.close()
+        # 集計（recipe_feedback_summary）はトリガーで更新済み。推薦モデルの好み補正に反映する
+        refresh_feedback(recipe_id)
         return redirect(url_for("recipes"))
     except Exception as e:
         import traceback
         error_msg = f"<h2>エラーが発生しました</h2><p>{str(e)}</p><pre>{traceback.format_exc()}</pre><a href='/recipes'>レシピ一覧に戻る</a>"
         return error_msg, 500
 
-def get_local_ip():
-    """ローカルネットワークのIPアドレスを取得"""
-    try:
-        # 外部サーバーに接続せずにローカルIPを取得（実際には接続しない）
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))  # 実際には接続しない、ローカルIPを取得するため
-        ip = s.getsockname()[0]
-        s.close()
-        return ip
-    except Exception:
-        try:
-            # フォールバック: ホスト名から取得
-            hostname = socket.gethostname()
-            ip = socket.gethostbyname(hostname)
-            return ip
-        except Exception:
-            return "127.0.0.1"
-
 #ブラウザ自動起動
 def open_browser():
     webbrowser.open("http://127.0.0.1:5000")
@@ -9,9 +9,7 @@ a = Analysis(
         ('templates', 'templates'), 
         ('static', 'static'),
         ('schema.sql', '.'),
-        ('レシピdb.xlsx', '.'),
-        ('分量・材料.xlsx', '.'),
-        ('調理手順.xlsx', '.')
+        ('recipe_catalog.jsonl.gz', '.')
     ],
     hiddenimports=['sklearn', 'sklearn.utils._cython_blas', 'sklearn.neighbors.typedefs', 'sklearn.neighbors.quad_tree', 'sklearn.tree._utils', 'pandas', 'numpy', 'openpyxl'],
     hookspath=[],
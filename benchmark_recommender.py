@@ -0,0 +1,369 @@
+"""
+レシピ推薦のベンチマーク
+
+一時ファイルのデータベースに合成したレシピ・材料・手順・在庫を作り、規模ごとに次の処理の時間を測る:
+    - MLRecipeRecommender の初期化（DBから構築 / スナップショットから読み込み）
+    - recommend_recipes / recommend_daily_menu（greedy / beam）
+    - Flask のテストクライアント経由の / と /recipes（/recipes は結果のキャッシュなし・ありの両方）
+
+結果は処理ごとの p50 / p95（ミリ秒）とピークメモリ（tracemalloc）を含むJSONで出力する。
+規模ごとに別プロセスで測るため、モジュールの読み込みやキャッシュが他の規模の結果に影響しない。
+--baseline に以前の結果を指定すると p50 を比べ、許容範囲を超えて遅くなった処理があれば FAILURE を表示する。
+
+使い方:
+    python benchmark_recommender.py [--scales small,medium,large] [--repeat 20] [--output bench.json]
+    python benchmark_recommender.py --recipes 5000 --items 100
+    python benchmark_recommender.py --output new.json --baseline bench.json [--tolerance 0.25]
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 規模の名前 → (レシピ数, 在庫の品目数)
+SCALES = {
+    'small': (100, 10),
+    'medium': (1000, 50),
+    'large': (10000, 200),
+    'xlarge': (100000, 1000),
+}
+DEFAULT_SCALES = 'small,medium,large'
+
+# 実在の食材名（合成した食材名と混ぜて、表記ゆれの照合も通るようにする）
+BASE_INGREDIENTS = [
+    '豚肉', '鶏肉', '牛肉', '豚ひき肉', '鶏もも肉', 'ベーコン', 'ハム', '鮭', 'さば', 'えび',
+    'キャベツ', '玉ねぎ', 'にんじん', 'じゃがいも', '大根', '白菜', 'ほうれん草', 'もやし', 'トマト', 'きゅうり',
+    'なす', 'ピーマン', 'ブロッコリー', 'レタス', 'ねぎ', '長ねぎ', 'しいたけ', 'えのき', 'にんにく', 'しょうが',
+    '卵', '牛乳', '豆腐', 'チーズ', 'バター', '米', 'しょうゆ', 'みそ', '砂糖', '塩',
+]
+GENRES = ['主菜', '副菜', '汁物', '主食', 'デザート']
+UNITS = ['g', '個', '本', '枚', '大さじ', '小さじ', 'ml', None]
+
+# 記録する結果の比較で、これより小さい差（ミリ秒）は誤差として扱う
+NOISE_FLOOR_MS = 1.0
+
+
+def _vocabulary(n_recipes: int):
+    """食材名の一覧と、よく使われる食材ほど大きい選択の重み（累積）"""
+    names = BASE_INGREDIENTS + [f"食材{k:04d}" for k in range(min(max(50, n_recipes // 10), 5000))]
+    cumulative, total = [], 0.0
+    for rank in range(len(names)):
+        total += 1.0 / (rank + 1) ** 0.8
+        cumulative.append(total)
+    return names, cumulative
+
+
+def generate_dataset(db_path: str, n_recipes: int, n_items: int, seed: int = 1) -> dict:
+    """
+    合成したレシピ・材料・手順・在庫でデータベースを作る
+
+    Args:
+        db_path: 作成するデータベースファイルのパス
+        n_recipes: レシピ数
+        n_items: 在庫の品目数
+        seed: 乱数の種（同じ値なら同じデータになる）
+
+    Returns:
+        作成した件数 {'recipes', 'ingredients', 'steps', 'items'}
+    """
+    from migrations import apply_migrations
+
+    apply_migrations(db_path, verbose=False)
+    rng = random.Random(seed)
+    names, cumulative = _vocabulary(n_recipes)
+    counts = {'recipes': n_recipes, 'ingredients': 0, 'steps': 0, 'items': n_items}
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("BEGIN")
+        for start in range(1, n_recipes + 1, 5000):
+            recipes, ingredients, steps = [], [], []
+            for recipe_id in range(start, min(start + 5000, n_recipes + 1)):
+                recipes.append((recipe_id, f"ベンチマーク料理{recipe_id}", rng.choice(GENRES), rng.randint(0, 30),
+                                rng.randint(0, 60), rng.randint(1, 4), rng.randint(100, 900)))
+                for name in set(rng.choices(names, cum_weights=cumulative, k=rng.randint(3, 12))):
+                    ingredients.append((recipe_id, name, str(rng.choice([1, 2, 100, 200])), rng.choice(UNITS),
+                                        1 if rng.random() < 0.6 else 0))
+                for step_number in range(1, rng.randint(2, 6) + 1):
+                    steps.append((recipe_id, step_number, f"手順{step_number}の説明"))
+            conn.executemany("INSERT INTO recipes (id, title, genre, prep_time, cook_time, servings, calorie) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)", recipes)
+            conn.executemany("INSERT INTO recipe_ingredients (recipe_id, name, quantity, unit, is_essential) "
+                             "VALUES (?, ?, ?, ?, ?)", ingredients)
+            conn.executemany("INSERT INTO recipe_steps (recipe_id, step_number, description) VALUES (?, ?, ?)", steps)
+            counts['ingredients'] += len(ingredients)
+            counts['steps'] += len(steps)
+
+        today = date.today()
+        items = []
+        for _ in range(n_items):
+            name = rng.choices(names, cum_weights=cumulative)[0]
+            # 在庫の名前は「国産豚肉」「玉ねぎ(小)」のように表記がゆれる
+            variant = rng.random()
+            if variant < 0.1:
+                name = '国産' + name
+            elif variant < 0.2:
+                name = name + '(小)'
+            expiry = None if rng.random() < 0.15 else (today + timedelta(days=rng.randint(-2, 20))).isoformat()
+            items.append((name, 0 if rng.random() < 0.05 else rng.randint(1, 5), None, expiry))
+        conn.executemany("INSERT INTO items (name, quantity, category, expiry_date) VALUES (?, ?, ?, ?)", items)
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return counts
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    """最近傍順位法のパーセンタイル（sorted_values は昇順）"""
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def measure(function, repeat: int, setup=None, warmup: int = 1) -> dict:
+    """
+    function の所要時間を repeat 回測り、最後に tracemalloc を有効にして1回だけピークメモリを測る
+
+    Args:
+        function: 測る処理（引数なし）
+        repeat: 計測回数
+        setup: 毎回の計測の直前に呼ぶ処理（計測に含めない。キャッシュを消すなど）
+        warmup: 計測前に実行する回数
+    """
+    for _ in range(warmup):
+        if setup:
+            setup()
+        function()
+
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'n': len(timings),
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'min_ms': round(timings[0], 3),
+        'max_ms': round(timings[-1], 3),
+        'peak_mb': round(peak / (1024 * 1024), 3),
+    }
+
+
+def max_rss_mb():
+    """プロセスの最大常駐メモリ（MB、取得できない環境では None）"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_scale(db_path: str, n_recipes: int, n_items: int, repeat: int, seed: int) -> dict:
+    """1つの規模のデータを作って各処理を測る（run_benchmarks から別プロセスで呼ばれる）"""
+    started = time.perf_counter()
+    counts = generate_dataset(db_path, n_recipes, n_items, seed)
+    result = dict(counts, generate_seconds=round(time.perf_counter() - started, 3), benchmarks={})
+    benchmarks = result['benchmarks']
+
+    def log(name):
+        print(f"  [{n_recipes}レシピ] {name}: p50 {benchmarks[name]['p50_ms']:.1f}ms / "
+              f"p95 {benchmarks[name]['p95_ms']:.1f}ms", file=sys.stderr)
+
+    from ml_recipe_recommender import MLRecipeRecommender
+
+    # 初期化は重いため回数を抑える
+    init_repeat = max(1, min(repeat, 3 if n_recipes >= 10000 else repeat))
+    benchmarks['init_build'] = measure(lambda: MLRecipeRecommender(db_path, use_snapshot=False),
+                                       init_repeat, warmup=0)
+    log('init_build')
+    MLRecipeRecommender(db_path)  # スナップショットを保存する
+    benchmarks['init_snapshot'] = measure(lambda: MLRecipeRecommender(db_path), init_repeat, warmup=0)
+    log('init_snapshot')
+
+    recommender = MLRecipeRecommender(db_path)
+    conn = sqlite3.connect(db_path)
+    inventory = [
+        {'name': name, 'quantity': quantity, 'expiry_date': expiry_date}
+        for name, quantity, expiry_date in conn.execute(
+            "SELECT name, quantity, expiry_date FROM items WHERE quantity > 0")
+    ]
+    conn.close()
+    result['inventory_items'] = len(inventory)
+
+    benchmarks['recommend_recipes'] = measure(lambda: recommender.recommend_recipes(inventory, top_n=5), repeat)
+    log('recommend_recipes')
+    benchmarks['daily_menu_greedy'] = measure(
+        lambda: recommender.recommend_daily_menu(inventory, days=5, strategy='greedy'), repeat)
+    log('daily_menu_greedy')
+    benchmarks['daily_menu_beam'] = measure(
+        lambda: recommender.recommend_daily_menu(inventory, days=5, strategy='beam'), repeat)
+    log('daily_menu_beam')
+
+    # app2 の読み込み前に一時DBと設定を指定する（推薦モデルは読み込み時に同期的に準備する）
+    os.environ['FRIDGEMATE_DATABASE'] = db_path
+    os.environ['FRIDGEMATE_RECOMMENDER_LOAD'] = 'preload'
+    import app2
+    client = app2.app.test_client()
+
+    def get(path):
+        def request():
+            response = client.get(path)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path}: {response.status_code}")
+        return request
+
+    benchmarks['route_index'] = measure(get('/'), repeat)
+    log('route_index')
+    benchmarks['route_recipes_uncached'] = measure(get('/recipes'), repeat, setup=app2.recommendation_cache.invalidate)
+    log('route_recipes_uncached')
+    benchmarks['route_recipes_cached'] = measure(get('/recipes'), repeat)
+    log('route_recipes_cached')
+    app2.db_pool.close_all()
+
+    result['max_rss_mb'] = max_rss_mb()
+    return result
+
+
+def run_benchmarks(scales, repeat: int, seed: int) -> dict:
+    """規模ごとに別プロセスで run_scale を実行して結果をまとめる"""
+    import numpy
+    import pandas
+    import sklearn
+
+    results = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': numpy.__version__,
+        'pandas': pandas.__version__,
+        'sklearn': sklearn.__version__,
+        'repeat': repeat,
+        'seed': seed,
+        'scales': {},
+    }
+    for name, (n_recipes, n_items) in scales:
+        print(f"{name}: レシピ {n_recipes}件 / 在庫 {n_items}品目", file=sys.stderr)
+        work_dir = tempfile.mkdtemp(prefix="fridgemate_bench_")
+        try:
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--worker', os.path.join(work_dir, 'inventory.db'),
+                 '--recipes', str(n_recipes), '--items', str(n_items), '--repeat', str(repeat), '--seed', str(seed)],
+                stdout=subprocess.PIPE, text=True, encoding='utf-8', check=True
+            )
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        results['scales'][name] = json.loads(completed.stdout)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    baseline より p50 が (1 + tolerance) 倍を超えて遅くなった処理
+
+    Returns:
+        [(規模, 処理, 以前のp50, 今回のp50), ...]
+    """
+    regressions = []
+    for scale, current in results['scales'].items():
+        previous = baseline.get('scales', {}).get(scale)
+        if previous is None:
+            continue
+        for name, stats in current['benchmarks'].items():
+            before = previous.get('benchmarks', {}).get(name)
+            if before is None:
+                continue
+            if (stats['p50_ms'] > before['p50_ms'] * (1 + tolerance)
+                    and stats['p50_ms'] - before['p50_ms'] > NOISE_FLOOR_MS):
+                regressions.append((scale, name, before['p50_ms'], stats['p50_ms']))
+    return regressions
+
+
+def parse_scales(args):
+    if args.recipes is not None:
+        return [(f"custom-{args.recipes}", (args.recipes, args.items))]
+    scales = []
+    for name in args.scales.split(','):
+        name = name.strip()
+        if name not in SCALES:
+            raise SystemExit(f"未知の規模です: {name}（{', '.join(SCALES)}）")
+        scales.append((name, SCALES[name]))
+    return scales
+
+
+def main():
+    parser = argparse.ArgumentParser(description="レシピ推薦のベンチマーク")
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help=f"測る規模（{', '.join(SCALES)} をカンマ区切り）")
+    parser.add_argument("--recipes", type=int, help="規模の代わりにレシピ数を指定する")
+    parser.add_argument("--items", type=int, default=50, help="--recipes を指定した場合の在庫の品目数")
+    parser.add_argument("--repeat", type=int, default=20, help="処理ごとの計測回数")
+    parser.add_argument("--seed", type=int, default=1, help="合成データの乱数の種")
+    parser.add_argument("--output", help="結果のJSONの保存先（省略時は標準出力）")
+    parser.add_argument("--baseline", help="比較する以前の結果のJSON")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="p50 がこの割合を超えて遅くなったら FAILURE")
+    parser.add_argument("--worker", metavar="DB_PATH", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    sys.path.insert(0, BASE_DIR)
+
+    if args.worker:
+        # 標準出力は結果のJSONだけにする（アプリ・推薦システムの表示は標準エラーへ）
+        with contextlib.redirect_stdout(sys.stderr):
+            result = run_scale(args.worker, args.recipes, args.items, args.repeat, args.seed)
+        json.dump(result, sys.stdout, ensure_ascii=False)
+        return 0
+
+    results = run_benchmarks(parse_scales(args), args.repeat, args.seed)
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        print(f"結果を保存しました: {args.output}")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for scale, name, before, after in regressions:
+            print(f"FAILURE: {scale} / {name}: p50 {before:.1f}ms → {after:.1f}ms")
+        if regressions:
+            return 1
+        print(f"SUCCESS: 以前の結果から {args.tolerance:.0%} を超えて遅くなった処理はありません。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,340 @@
+"""
+レシピカタログ（recipes / recipe_ingredients / recipe_steps）のエクスポート・インポート
+
+形式は gzip 圧縮した JSON Lines:
+    1行目: ヘッダー {"format": "fridgemate-catalog", "version": 1, "recipe_columns": [...], ...}
+    2行目以降: 1行1レシピ。材料・手順は列名をヘッダーに書き、値だけの配列で持つ
+    {"id": 1, "title": ..., "ingredients": [[name, quantity, unit, is_essential], ...], "steps": [[step_number, description], ...]}
+
+値は SQLite の値（整数・実数・文字列・NULL）のまま書くため、エクスポート → インポートで元の行に戻る。
+
+使い方:
+    python catalog_io.py export catalog.jsonl.gz [--db inventory.db]
+    python catalog_io.py import catalog.jsonl.gz [--db inventory.db] [--mode replace|upsert]
+"""
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import Dict, Iterator, List
+
+from migrations import apply_migrations
+
+CATALOG_FORMAT = "fridgemate-catalog"
+CATALOG_VERSION = 1
+
+RECIPE_COLUMNS = ('id', 'source_recipe_id', 'title', 'genre', 'prep_time', 'cook_time', 'servings', 'calorie', 'created_at')
+INGREDIENT_COLUMNS = ('name', 'quantity', 'unit', 'is_essential')
+STEP_COLUMNS = ('step_number', 'description')
+
+# レシピ順（主キー順）に読み、材料・手順も recipe_id 順のインデックスで読んで突き合わせる（レシピごとの問い合わせはしない）
+EXPORT_QUERIES = {
+    'recipes': f"SELECT {', '.join(RECIPE_COLUMNS)} FROM recipes ORDER BY id",
+    'ingredients': f"SELECT recipe_id, {', '.join(INGREDIENT_COLUMNS)} FROM recipe_ingredients ORDER BY recipe_id, id",
+    'steps': f"SELECT recipe_id, {', '.join(STEP_COLUMNS)} FROM recipe_steps ORDER BY recipe_id, step_number, id",
+}
+
+# 一括読み込み中だけの設定（1つのトランザクションで読み込むため、途中で失敗しても元に戻る）
+BULK_PRAGMAS = (
+    "PRAGMA synchronous = OFF",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",
+)
+
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def _grouped(cursor) -> Iterator:
+    """(recipe_id, 列...) の行を recipe_id ごとの (recipe_id, [列の配列, ...]) にまとめる"""
+    current_id, group = None, []
+    for row in cursor:
+        if row[0] != current_id:
+            if group:
+                yield current_id, group
+            current_id, group = row[0], []
+        group.append(list(row[1:]))
+    if group:
+        yield current_id, group
+
+
+def export_catalog(conn: sqlite3.Connection, path: str) -> Dict[str, int]:
+    """
+    カタログをファイルに書き出す
+
+    Args:
+        conn: DB接続
+        path: 出力先（.jsonl.gz）
+
+    Returns:
+        書き出した件数 {'recipes', 'ingredients', 'steps'}
+    """
+    counts = {'recipes': 0, 'ingredients': 0, 'steps': 0}
+    ingredients = _grouped(conn.execute(EXPORT_QUERIES['ingredients']))
+    steps = _grouped(conn.execute(EXPORT_QUERIES['steps']))
+    next_ingredients = next(ingredients, None)
+    next_steps = next(steps, None)
+
+    header = {
+        'format': CATALOG_FORMAT,
+        'version': CATALOG_VERSION,
+        'recipe_columns': RECIPE_COLUMNS,
+        'ingredient_columns': INGREDIENT_COLUMNS,
+        'step_columns': STEP_COLUMNS,
+    }
+    # 同じ内容なら同じバイト列になるよう、時刻などは書かない（gzip のヘッダーの時刻も 0）
+    with open(path, 'wb') as raw, gzip.GzipFile(filename='', fileobj=raw, mode='wb', mtime=0) as gz:
+        gz.write((json.dumps(header, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8'))
+        for row in conn.execute(EXPORT_QUERIES['recipes']):
+            recipe = dict(zip(RECIPE_COLUMNS, row))
+            recipe_id = recipe['id']
+            # 親のない材料・手順（削除済みレシピの残り）は読み飛ばす
+            while next_ingredients is not None and next_ingredients[0] < recipe_id:
+                next_ingredients = next(ingredients, None)
+            while next_steps is not None and next_steps[0] < recipe_id:
+                next_steps = next(steps, None)
+
+            recipe['ingredients'] = []
+            if next_ingredients is not None and next_ingredients[0] == recipe_id:
+                recipe['ingredients'] = next_ingredients[1]
+                next_ingredients = next(ingredients, None)
+            recipe['steps'] = []
+            if next_steps is not None and next_steps[0] == recipe_id:
+                recipe['steps'] = next_steps[1]
+                next_steps = next(steps, None)
+
+            gz.write((json.dumps(recipe, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8'))
+            counts['recipes'] += 1
+            counts['ingredients'] += len(recipe['ingredients'])
+            counts['steps'] += len(recipe['steps'])
+    return counts
+
+
+def read_catalog(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[List[Dict]]:
+    """カタログファイルをレシピのリスト（chunk_size 件ずつ）として読む"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline() or 'null')
+        if not isinstance(header, dict) or header.get('format') != CATALOG_FORMAT:
+            raise ValueError(f"カタログファイルではありません: {path}")
+        if header.get('version') != CATALOG_VERSION:
+            raise ValueError(f"対応していないカタログのバージョンです: {header.get('version')}")
+        if (tuple(header.get('ingredient_columns', ())) != INGREDIENT_COLUMNS
+                or tuple(header.get('step_columns', ())) != STEP_COLUMNS):
+            raise ValueError("材料・手順の列がこのバージョンと一致しません")
+
+        chunk = []
+        for line in f:
+            if not line.strip():
+                continue
+            chunk.append(json.loads(line))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def _insert_children(conn, chunk: List[Dict], recipe_ids: List[int], counts: Dict[str, int]):
+    ingredient_rows = [
+        (recipe_id, *ingredient)
+        for recipe, recipe_id in zip(chunk, recipe_ids) for ingredient in recipe.get('ingredients', [])
+    ]
+    step_rows = [
+        (recipe_id, *step)
+        for recipe, recipe_id in zip(chunk, recipe_ids) for step in recipe.get('steps', [])
+    ]
+    conn.executemany(
+        f"INSERT INTO recipe_ingredients (recipe_id, {', '.join(INGREDIENT_COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+        ingredient_rows
+    )
+    conn.executemany(
+        f"INSERT INTO recipe_steps (recipe_id, {', '.join(STEP_COLUMNS)}) VALUES (?, ?, ?)",
+        step_rows
+    )
+    counts['ingredients'] += len(ingredient_rows)
+    counts['steps'] += len(step_rows)
+
+
+def _import_replace(conn, chunks, counts):
+    """既存のカタログを消して、IDも含めてファイルの内容に置き換える"""
+    conn.execute("DELETE FROM recipe_ingredients")
+    conn.execute("DELETE FROM recipe_steps")
+    conn.execute("DELETE FROM recipes")
+    placeholders = ', '.join('?' * len(RECIPE_COLUMNS))
+    for chunk in chunks:
+        conn.executemany(
+            f"INSERT INTO recipes ({', '.join(RECIPE_COLUMNS)}) VALUES ({placeholders})",
+            [tuple(recipe.get(column) for column in RECIPE_COLUMNS) for recipe in chunk]
+        )
+        counts['recipes'] += len(chunk)
+        _insert_children(conn, chunk, [recipe['id'] for recipe in chunk], counts)
+
+
+def _select_in(conn, sql: str, values: List) -> List:
+    """IN (...) の問い合わせを変数の上限を超えないよう分けて実行する（sql の {} に ? を入れる）"""
+    rows = []
+    for start in range(0, len(values), 500):
+        part = values[start:start + 500]
+        rows.extend(conn.execute(sql.format(', '.join('?' * len(part))), part).fetchall())
+    return rows
+
+
+def _import_upsert(conn, chunks, counts):
+    """
+    既存のカタログに追加・更新する
+
+    source_recipe_id（Excelの Recipe_ID）があるレシピは同じ source_recipe_id のレシピを、
+    ないレシピ（画面から登録したもの・v7 より前のDBから書き出したもの）は同じ id のレシピを更新して
+    材料・手順を置き換える。該当するレシピがなければ追加する（id が空いていればファイルの id のまま）。
+    source_recipe_id のないレシピの id が source_recipe_id を持つ別のレシピに使われている場合は、
+    上書きせずにスキップする。
+    """
+    columns = [column for column in RECIPE_COLUMNS if column != 'id']
+    insert_sql = f"INSERT INTO recipes ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    insert_with_id_sql = f"INSERT INTO recipes ({', '.join(RECIPE_COLUMNS)}) VALUES ({', '.join('?' * len(RECIPE_COLUMNS))})"
+    updated_columns = [column for column in columns if column not in ('source_recipe_id', 'created_at')]
+    update_sql = f"UPDATE recipes SET {', '.join(f'{column} = ?' for column in updated_columns)} WHERE id = ?"
+    skipped = 0
+
+    for chunk in chunks:
+        id_by_source = dict(_select_in(
+            conn, "SELECT source_recipe_id, id FROM recipes WHERE source_recipe_id IN ({})",
+            [recipe['source_recipe_id'] for recipe in chunk if recipe.get('source_recipe_id') is not None]))
+        # 使われている id → その行の source_recipe_id
+        taken = dict(_select_in(
+            conn, "SELECT id, source_recipe_id FROM recipes WHERE id IN ({})",
+            [recipe['id'] for recipe in chunk if recipe.get('id') is not None]))
+
+        recipes, recipe_ids, updates = [], [], []
+        for recipe in chunk:
+            source_id = recipe.get('source_recipe_id')
+            file_id = recipe.get('id')
+            if source_id is not None and source_id in id_by_source:
+                recipe_id = id_by_source[source_id]
+                updates.append(recipe_id)
+            elif source_id is None and file_id in taken:
+                if taken[file_id] is not None:
+                    skipped += 1
+                    continue
+                recipe_id = file_id
+                updates.append(recipe_id)
+            elif file_id is not None and file_id not in taken:
+                conn.execute(insert_with_id_sql, tuple(recipe.get(column) for column in RECIPE_COLUMNS))
+                recipe_id = file_id
+            else:
+                recipe_id = conn.execute(insert_sql, tuple(recipe.get(column) for column in columns)).lastrowid
+            taken[recipe_id] = source_id
+            if source_id is not None:
+                id_by_source[source_id] = recipe_id
+            recipes.append(recipe)
+            recipe_ids.append(recipe_id)
+
+        updated = set(updates)
+        conn.executemany(update_sql, [
+            (*(recipe.get(column) for column in updated_columns), recipe_id)
+            for recipe, recipe_id in zip(recipes, recipe_ids) if recipe_id in updated
+        ])
+        conn.executemany("DELETE FROM recipe_ingredients WHERE recipe_id = ?", [(recipe_id,) for recipe_id in updates])
+        conn.executemany("DELETE FROM recipe_steps WHERE recipe_id = ?", [(recipe_id,) for recipe_id in updates])
+        counts['recipes'] += len(recipes)
+        _insert_children(conn, recipes, recipe_ids, counts)
+
+    if skipped:
+        print(f"同じIDの別のレシピ（source_recipe_id あり）があるため {skipped}件をスキップしました")
+
+
+def import_catalog(db_path: str, path: str, mode: str = 'replace', chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, int]:
+    """
+    カタログファイルを1つのトランザクションで読み込む
+
+    Args:
+        db_path: データベースファイルのパス
+        path: カタログファイル（.jsonl.gz）
+        mode: 'replace'（カタログを置き換える。IDも元のまま）または
+              'upsert'（source_recipe_id、なければ id が同じレシピを更新し、それ以外は追加）
+        chunk_size: executemany 1回あたりのレシピ数
+
+    Returns:
+        読み込んだ件数 {'recipes', 'ingredients', 'steps'}
+    """
+    if mode not in ('replace', 'upsert'):
+        raise ValueError(f"未知の読み込み方法です: {mode}")
+    apply_migrations(db_path, verbose=False)
+
+    counts = {'recipes': 0, 'ingredients': 0, 'steps': 0}
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        for pragma in BULK_PRAGMAS:
+            conn.execute(pragma)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            chunks = read_catalog(path, chunk_size)
+            if mode == 'replace':
+                _import_replace(conn, chunks, counts)
+            else:
+                _import_upsert(conn, chunks, counts)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return counts
+
+
+def seed_catalog_if_empty(db_path: str, path: str) -> bool:
+    """
+    レシピが1件もなければ同梱のカタログを読み込む（初回起動時）
+
+    Returns:
+        読み込んだか
+    """
+    if not os.path.exists(path):
+        return False
+    apply_migrations(db_path, verbose=False)
+    conn = sqlite3.connect(db_path)
+    try:
+        has_recipes = conn.execute("SELECT 1 FROM recipes LIMIT 1").fetchone() is not None
+    finally:
+        conn.close()
+    if has_recipes:
+        return False
+    started = time.perf_counter()
+    counts = import_catalog(db_path, path, mode='replace')
+    print(f"同梱のレシピカタログを読み込みました: レシピ {counts['recipes']}件（{time.perf_counter() - started:.2f}秒）")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="レシピカタログのエクスポート・インポート")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="カタログファイル（.jsonl.gz）")
+    parser.add_argument("--db", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "inventory.db"))
+    parser.add_argument("--mode", choices=["replace", "upsert"], default="replace",
+                        help="import: replace（置き換え、IDも元のまま）/ "
+                             "upsert（source_recipe_id、なければ id で照合して追加・更新）")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.command == "export":
+        conn = sqlite3.connect(args.db)
+        try:
+            counts = export_catalog(conn, args.path)
+        finally:
+            conn.close()
+        action = "書き出しました"
+    else:
+        counts = import_catalog(args.db, args.path, args.mode, args.chunk_size)
+        action = "読み込みました"
+    seconds = time.perf_counter() - started
+    total = sum(counts.values())
+    print(f"{action}: レシピ {counts['recipes']}件 / 材料 {counts['ingredients']}件 / 手順 {counts['steps']}件 "
+          f"（{seconds:.2f}秒、{total / seconds if seconds > 0 else 0:.0f}行/秒）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
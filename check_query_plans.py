@@ -0,0 +1,118 @@
+"""
+ルートで使うSQLの実行計画（EXPLAIN QUERY PLAN）の確認
+
+マイグレーションを適用したデータベースで、各クエリがインデックスを使うことを確認する。
+テーブル全体を読む（SCAN）または並べ替えに一時B木を使うクエリがあれば失敗（終了コード1）。
+一覧表示のように全件を読むことが目的のクエリは allow_scan=True としている。
+
+使い方:
+    python check_query_plans.py            # 一時データベースで確認
+    python check_query_plans.py inventory.db  # 既存のデータベース（のコピー）で確認
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+from api import DATA_VERSIONS_QUERY, INVENTORY_QUERY, ITEM_QUERY
+from expiry_alerts import ALERT_QUERY, ITEMS_VERSION_QUERY
+from listing import ITEM_PAGER, RECIPE_PAGER
+from migrations import apply_migrations
+from recommendation_cache import RECIPES_VERSION_QUERY
+
+# (ルート・用途, SQL, パラメータ, 全件走査を許可するか)
+ROUTE_QUERIES = [
+    ("/delete/<id>", "DELETE FROM items WHERE id = ?", (1,), False),
+    ("/increase/<id>", "UPDATE items SET quantity = quantity + 1, updated_at=? WHERE id=?", ("2024-01-01", 1), False),
+    ("/decrease/<id>", "UPDATE items SET quantity = quantity - 1, updated_at=? WHERE id=?", ("2024-01-01", 1), False),
+    ("/recipes 在庫", "SELECT * FROM items WHERE quantity > 0", (), False),
+    ("/ 期限アラート", ALERT_QUERY, ("2024-01-01",), False),
+    ("/ 在庫の更新回数", ITEMS_VERSION_QUERY, (), False),
+    ("/recipes 推薦結果キャッシュのレシピ更新回数", RECIPES_VERSION_QUERY, (), False),
+    ("/edit_recipe レシピ", "SELECT * FROM recipes WHERE id = ?", (1,), False),
+    ("/edit_recipe 材料", "SELECT * FROM recipe_ingredients WHERE recipe_id = ? ORDER BY id", (1,), False),
+    ("/edit_recipe 手順", "SELECT * FROM recipe_steps WHERE recipe_id = ? ORDER BY step_number", (1,), False),
+    ("/edit_recipe 材料の削除", "DELETE FROM recipe_ingredients WHERE recipe_id = ?", (1,), False),
+    ("/edit_recipe 手順の削除", "DELETE FROM recipe_steps WHERE recipe_id = ?", (1,), False),
+    ("/delete_recipe フィードバックの削除", "DELETE FROM recipe_feedback WHERE recipe_id = ?", (1,), False),
+    ("/delete_recipe レシピの削除", "DELETE FROM recipes WHERE id = ?", (1,), False),
+    ("推薦モデル 差分更新のレシピ", "SELECT * FROM recipes WHERE id = ?", (1,), False),
+    ("推薦モデル 差分更新の材料", "SELECT * FROM recipe_ingredients WHERE recipe_id = ?", (1,), False),
+    ("推薦モデル 差分更新の手順", "SELECT * FROM recipe_steps WHERE recipe_id = ?", (1,), False),
+    ("/api/v1 条件付きGETの更新回数", DATA_VERSIONS_QUERY.format("?, ?"), ("items", "recipes"), False),
+    ("/api/v1/items/<id>", ITEM_QUERY, (1,), False),
+    ("/api/v1/items/adjust 存在確認", "SELECT id FROM items WHERE id IN (?, ?)", (1, 2), False),
+    ("/api/v1/items/adjust 増減", "UPDATE items SET quantity = quantity + ?, updated_at = ? WHERE id = ?", (1, "2024-01-01", 1), False),
+    ("/api/v1/items/batch 登録", "INSERT INTO items (name, quantity, category, expiry_date, updated_at) VALUES (?, ?, ?, ?, ?)", ("牛乳", 1, None, None, "2024-01-01"), False),
+    ("/api/v1/items/batch 登録したID", "SELECT seq FROM sqlite_sequence WHERE name = 'items'", (), True),
+    ("/api/v1/items/batch 結果", "SELECT id, name, quantity, category, expiry_date, updated_at FROM items WHERE id IN (?, ?) ORDER BY id", (1, 2), False),
+    ("/api/v1/recommendations 在庫", INVENTORY_QUERY, (), False),
+    ("推薦モデル フィードバック集計の読み込み", "SELECT recipe_id, rating_count, rating_sum, made_count, last_made_at FROM recipe_feedback_summary", (), True),
+    ("/feedback 集計の読み直し", "SELECT recipe_id, rating_count, rating_sum, made_count, last_made_at FROM recipe_feedback_summary WHERE recipe_id = ?", (1,), False),
+    ("/feedback 集計のやり直し（トリガー）", "SELECT COUNT(*) FROM recipe_feedback WHERE recipe_id = ?", ("1",), False),
+    ("食材名でのレシピ検索", "SELECT recipe_id FROM recipe_ingredients WHERE lower(trim(name)) = ?", ("玉ねぎ",), False),
+]
+
+
+def pager_queries(route, pager):
+    """一覧ページの並べ替え・絞り込み・ページ位置の全組み合わせのクエリ"""
+    queries = []
+    for sort_name in pager.sorts:
+        for filtered in (False, True):
+            for after in (False, True):
+                for sql in pager.segment_queries(sort_name, filtered, after):
+                    params = (1,) * sql.count('?')
+                    label = f"{route} sort={sort_name}" + (" 絞り込み" if filtered else "") + (" 2ページ目以降" if after else "")
+                    queries.append((label, sql, params, False))
+    queries.append((f"{route} 絞り込みの選択肢", pager.filter_values_query(), (), True))
+    return queries
+
+
+ROUTE_QUERIES += pager_queries("/", ITEM_PAGER) + pager_queries("/recipe_list", RECIPE_PAGER)
+
+
+def plan_problems(conn, sql, params, allow_scan):
+    """実行計画の各行と、問題のある行のリスト"""
+    plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+    problems = []
+    for detail in plan:
+        # SCAN CONSTANT ROW は FROM のない SELECT（サブクエリだけの行）で、テーブルは読まない
+        if detail.startswith("SCAN") and not allow_scan and "USING" not in detail and detail != "SCAN CONSTANT ROW":
+            problems.append(detail)
+        elif "USE TEMP B-TREE" in detail:
+            problems.append(detail)
+    return plan, problems
+
+
+def main():
+    work_dir = tempfile.mkdtemp(prefix="fridgemate_plan_")
+    db_path = os.path.join(work_dir, "inventory.db")
+    try:
+        if len(sys.argv) > 1:
+            # 元のファイルは変更しない
+            shutil.copyfile(sys.argv[1], db_path)
+        apply_migrations(db_path, verbose=False)
+
+        conn = sqlite3.connect(db_path)
+        failures = 0
+        for label, sql, params, allow_scan in ROUTE_QUERIES:
+            plan, problems = plan_problems(conn, sql, params, allow_scan)
+            status = "NG" if problems else "OK"
+            print(f"[{status}] {label}: {sql}")
+            for detail in plan:
+                print(f"       {detail}")
+            failures += bool(problems)
+        conn.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if failures:
+        print(f"\nFAILURE: {failures}件のクエリがテーブル全体を走査しています。")
+        return 1
+    print("\nSUCCESS: すべてのクエリがインデックスを使っています。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
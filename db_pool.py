@@ -0,0 +1,135 @@
+import queue
+import sqlite3
+import threading
+import time
+
+# 接続ごとに1回だけ設定するPRAGMA（journal_mode と busy_timeout は ConnectionPool の引数で指定）
+DEFAULT_PRAGMAS = (
+    ('synchronous', 'NORMAL'),    # WALではNORMALでも破損しない（電源断時に直近のコミットが失われうるだけ）
+    ('cache_size', -8000),        # ページキャッシュ 約8MB（負の値はKB単位）
+    ('mmap_size', 67108864),      # 64MBまでメモリマップで読む
+    ('foreign_keys', 'ON'),
+)
+
+
+class ConnectionPool:
+    """
+    SQLite接続の小さなプール
+
+    接続は作成時にPRAGMAを設定し、返却されたものを使い回す。
+    返却時に未確定のトランザクションが残っていればロールバックする。
+    空きがなければ新しく接続を作り、max_idle を超えて返却された接続は閉じる。
+    """
+
+    def __init__(self, db_path: str, max_idle: int = 5, journal_mode: str = 'WAL',
+                 busy_timeout_ms: int = 5000, pragmas=DEFAULT_PRAGMAS):
+        """
+        Args:
+            db_path: データベースファイルのパス
+            max_idle: 保持しておく空き接続の最大数
+            journal_mode: ジャーナルモード（WAL なら読み込みが書き込みを待たない。DELETE で従来どおり）
+            busy_timeout_ms: ロック解除を待つ最大ミリ秒
+            pragmas: 接続作成時に設定する (PRAGMA名, 値) のリスト
+        """
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self.journal_mode = journal_mode
+        self.busy_timeout_ms = busy_timeout_ms
+        self.pragmas = pragmas
+        self.connect_retries = 5
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # プールの接続はリクエストを処理するスレッド間で受け渡すため check_same_thread=False
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        # ジャーナルモードの確認・切り替えにはロックが要るため、競合したら少し待って再試行する
+        for attempt in range(self.connect_retries + 1):
+            try:
+                if conn.execute("PRAGMA journal_mode").fetchone()[0].lower() != self.journal_mode.lower():
+                    conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+                break
+            except sqlite3.OperationalError as e:
+                if not is_locked_error(e) or attempt == self.connect_retries:
+                    conn.close()
+                    raise
+                time.sleep(0.05 * (2 ** attempt))
+        for name, value in self.pragmas:
+            conn.execute(f"PRAGMA {name}={value}")
+        with self._lock:
+            self.created += 1
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """接続を借りる（空きがなければ新しく作る）"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn: sqlite3.Connection):
+        """接続を返す"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # 壊れた接続は使い回さない
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        """空き接続をすべて閉じる"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def is_locked_error(error: Exception) -> bool:
+    """ロック競合によるエラーか（database is locked / busy）"""
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+
+def run_write(conn: sqlite3.Connection, work, retries: int = 5, backoff: float = 0.05):
+    """
+    短い書き込みトランザクションを実行する
+
+    BEGIN IMMEDIATE で最初に書き込みロックを取るため、読み込みから書き込みへの
+    昇格で競合することはない。busy_timeout を過ぎてもロックが取れなかった場合は
+    指数バックオフで再試行する。
+
+    Args:
+        conn: DB接続（トランザクション外であること）
+        work: 接続を受け取って書き込みを行う関数（コミットは呼び出し側で行わない）
+        retries: ロック競合時の再試行回数
+        backoff: 最初の再試行までの秒数（再試行ごとに2倍）
+
+    Returns:
+        work の戻り値
+    """
+    for attempt in range(retries + 1):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            result = work(conn)
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if not is_locked_error(e) or attempt == retries:
+                raise
+            time.sleep(backoff * (2 ** attempt))
+        except Exception:
+            # 制約違反など: 同じリクエストで次の書き込みができるようにトランザクションを終わらせる
+            if conn.in_transaction:
+                conn.rollback()
+            raise
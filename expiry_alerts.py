@@ -0,0 +1,62 @@
+import threading
+from datetime import date, timedelta
+from typing import List
+
+# 期限切れ・期限間近の在庫（expiry_date のインデックスで範囲検索する）
+# 日付として読めない値（空文字など）は除外する
+ALERT_QUERY = """
+    SELECT id, name, expiry_date FROM items
+    WHERE expiry_date <= ? AND date(expiry_date) = expiry_date
+    ORDER BY expiry_date
+"""
+
+# 在庫テーブルの更新回数（migrations.py のトリガーで更新される）
+ITEMS_VERSION_QUERY = "SELECT version FROM data_versions WHERE name = 'items'"
+
+
+class ExpiryAlerts:
+    """
+    賞味期限アラートの作成とキャッシュ
+
+    期限切れ・期限間近の在庫だけをSQLで取り出す。
+    結果は在庫テーブルが変更されるか日付が変わるまで使い回す。
+    """
+
+    def __init__(self, horizon_days: int = 3):
+        """
+        Args:
+            horizon_days: 何日後までの期限を「期限が近い」とするか
+        """
+        self.horizon_days = horizon_days
+        self._lock = threading.Lock()
+        # (日付, 在庫テーブルの更新回数) → アラートのリスト
+        self._key = None
+        self._alerts = None
+
+    def get(self, conn) -> List[str]:
+        """
+        アラートの文言リスト（期限の古い順）
+
+        Args:
+            conn: DB接続
+        """
+        today = date.today()
+        row = conn.execute(ITEMS_VERSION_QUERY).fetchone()
+        key = (today, row[0] if row else None)
+        with self._lock:
+            if key == self._key and key[1] is not None:
+                return self._alerts
+
+        alerts = []
+        horizon = (today + timedelta(days=self.horizon_days)).isoformat()
+        for item in conn.execute(ALERT_QUERY, (horizon,)):
+            exp_date = date.fromisoformat(item["expiry_date"])
+            if exp_date < today:
+                alerts.append(f"{item['name']} は賞味期限切れです！（{exp_date}）")
+            else:
+                alerts.append(f"{item['name']} の賞味期限が近いです！（{exp_date}）")
+
+        with self._lock:
+            self._key = key
+            self._alerts = alerts
+        return alerts
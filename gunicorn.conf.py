@@ -0,0 +1,25 @@
+"""
+gunicorn の設定（gunicorn -c gunicorn.conf.py wsgi:app、詳しくは wsgi.py）
+"""
+import gc
+import multiprocessing
+import os
+
+bind = os.environ.get('FRIDGEMATE_BIND', '0.0.0.0:5000')
+# 推薦・献立の計算は推薦モデルのロック（ml_recipe_recommender._synchronized）で1ワーカーにつき
+# 同時に1件しか走らない。/recipes などを並列に計算できる数はワーカー（プロセス）数で決まるため、
+# CPUコア数だけ起動する（モデルはコピーオンライトとメモリマップで共有されるので、メモリはほぼ増えない）
+workers = int(os.environ.get('FRIDGEMATE_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+# スレッドは推薦を並列にしない。在庫一覧・API など推薦を使わないリクエストと、
+# 推薦の計算待ちのリクエストを同じワーカーで受けるためのもの
+threads = int(os.environ.get('FRIDGEMATE_THREADS', '2'))
+# マスタープロセスでアプリ（推薦モデル）を読み込んでから fork する
+preload_app = True
+timeout = int(os.environ.get('FRIDGEMATE_WORKER_TIMEOUT', '60'))
+
+
+def when_ready(server):
+    # 読み込み済みのオブジェクトをGCの対象から外す（ワーカーのGCが共有ページに書き込んでコピーされないように）
+    gc.collect()
+    gc.freeze()
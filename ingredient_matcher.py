@@ -0,0 +1,138 @@
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class IngredientMatcher:
+    """
+    レシピ材料名と在庫名のマッチング（部分一致）を高速に判定する
+
+    マッチ条件は従来どおり「完全一致、または一方がもう一方を含む」。
+    材料語彙の全部分文字列を索引化しておき（接尾辞ベースの索引）、
+    在庫名ごとに辞書引きだけで一致する語彙IDを求める。
+    在庫名の集合ごとの一致関係はLRUキャッシュに保持する。
+    """
+
+    def __init__(self, vocabulary: Iterable[str], cache_size: int = 64):
+        """
+        Args:
+            vocabulary: 正規化済みの材料名リスト（リスト上の位置が語彙IDになる）
+            cache_size: 在庫名集合ごとの一致関係を保持する件数
+        """
+        self.vocabulary: List[str] = []
+        self.vocab_index: Dict[str, int] = {}
+        # 部分文字列 → その部分文字列を含む語彙IDのリスト
+        self._substring_index: Dict[str, List[int]] = {}
+        self._cache_size = cache_size
+        self._relation_cache: "OrderedDict[frozenset, Dict[str, Tuple[int, ...]]]" = OrderedDict()
+
+        for term in vocabulary:
+            self.add_term(term)
+
+    def __getstate__(self):
+        # 一致関係のキャッシュは保存しない（スナップショット用）
+        state = self.__dict__.copy()
+        state['_relation_cache'] = OrderedDict()
+        return state
+
+    @staticmethod
+    def _substrings(text: str) -> set:
+        """空文字列を含むすべての部分文字列"""
+        return {text[i:j] for i in range(len(text) + 1) for j in range(i, len(text) + 1)}
+
+    def add_term(self, term: str) -> int:
+        """語彙を追加して語彙IDを返す（登録済みなら既存のID）"""
+        if term in self.vocab_index:
+            return self.vocab_index[term]
+
+        vocab_id = len(self.vocabulary)
+        self.vocabulary.append(term)
+        self.vocab_index[term] = vocab_id
+        for substring in self._substrings(term):
+            self._substring_index.setdefault(substring, []).append(vocab_id)
+
+        # 既存の一致関係は新しい語彙を含まないため破棄する
+        self._relation_cache.clear()
+        return vocab_id
+
+    def match_name(self, inv_name: str) -> Tuple[int, ...]:
+        """在庫名に一致する語彙IDを昇順で返す"""
+        # 語彙が在庫名を含む
+        matched = set(self._substring_index.get(inv_name, ()))
+        # 在庫名が語彙を含む
+        for substring in self._substrings(inv_name):
+            vocab_id = self.vocab_index.get(substring)
+            if vocab_id is not None:
+                matched.add(vocab_id)
+        return tuple(sorted(matched))
+
+    def relation(self, inv_names: Iterable[str]) -> Dict[str, Tuple[int, ...]]:
+        """在庫名 → 一致する語彙IDの対応表（在庫名の集合ごとにキャッシュ）"""
+        key = frozenset(inv_names)
+        cached = self._relation_cache.get(key)
+        if cached is not None:
+            self._relation_cache.move_to_end(key)
+            return cached
+
+        relation = {name: self.match_name(name) for name in key}
+        self._relation_cache[key] = relation
+        if len(self._relation_cache) > self._cache_size:
+            self._relation_cache.popitem(last=False)
+        return relation
+
+    def resolve(self, ingredient_scores: Dict[str, float]) -> Tuple[Dict[int, Tuple[str, float]], Dict[int, Tuple[str, float]]]:
+        """
+        語彙ごとに対応する在庫を決める
+
+        必須食材: 完全一致を優先し、なければ部分一致の中で最もスコアの高い在庫（同点は先勝ち）
+        オプション食材: 在庫の並び順で最初に一致した在庫
+
+        Args:
+            ingredient_scores: 在庫食材名 → 期限スコア（並び順が優先順位）
+
+        Returns:
+            (必須用 {語彙ID: (在庫名, スコア)}, オプション用 {語彙ID: (在庫名, スコア)})
+        """
+        relation = self.relation(ingredient_scores.keys())
+        essential = {}
+        optional = {}
+        exact = set()
+
+        for inv_name, inv_score in ingredient_scores.items():
+            for vocab_id in relation[inv_name]:
+                if vocab_id not in optional:
+                    optional[vocab_id] = (inv_name, inv_score)
+                if vocab_id in exact:
+                    continue
+                if self.vocabulary[vocab_id] == inv_name:
+                    essential[vocab_id] = (inv_name, inv_score)
+                    exact.add(vocab_id)
+                elif vocab_id not in essential or inv_score > essential[vocab_id][1]:
+                    essential[vocab_id] = (inv_name, inv_score)
+
+        return essential, optional
+
+    def first_matches(self, inv_names: List[str]) -> Dict[int, int]:
+        """
+        語彙ごとに、リスト上で最初に一致する在庫の位置を返す
+
+        Args:
+            inv_names: 正規化済みの在庫名リスト（重複可）
+
+        Returns:
+            {語彙ID: inv_names上の位置}
+        """
+        relation = self.relation(inv_names)
+        first = {}
+        for position, inv_name in enumerate(inv_names):
+            for vocab_id in relation[inv_name]:
+                first.setdefault(vocab_id, position)
+        return first
+
+    @staticmethod
+    def is_match(ingredient_name: str, inv_name: str) -> bool:
+        """語彙に登録されていない名前同士のマッチ判定"""
+        return ingredient_name == inv_name or ingredient_name in inv_name or inv_name in ingredient_name
+
+    def lookup(self, ingredient_name: str) -> Optional[int]:
+        """材料名の語彙ID（未登録ならNone）"""
+        return self.vocab_index.get(ingredient_name)
@@ -0,0 +1,238 @@
+"""
+処理の段階ごとの所要時間の計測（Server-Timing ヘッダーと /metrics）
+
+    with span('db'):
+        rows = conn.execute(...).fetchall()
+
+    @timed('scoring')
+    def calculate_recipe_scores_batch(...): ...
+
+計測した時間は2か所に記録する:
+    - リクエスト中なら、そのリクエストの段階ごとの合計（after_request で Server-Timing ヘッダーにする）
+    - プロセス全体の段階ごとのヒストグラム（/metrics で Prometheus のテキスト形式で返す）
+
+リクエストごとの記録は contextvars に置くため、スレッドで並行に処理しても混ざらない。
+段階は入れ子にできる（'recommend' の中の 'scoring' など）。同じ段階を何度も通った場合は合計する。
+1回の計測は perf_counter 2回とロック1回なので、本番で常に有効にしておける。
+FRIDGEMATE_INSTRUMENTATION=0 で無効にすると、span() は何もしない。
+"""
+import contextvars
+import functools
+import os
+import threading
+import time
+from typing import Callable, Dict, Tuple
+
+# ヒストグラムのバケット（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 現在のリクエストの {段階名: 合計秒数}（リクエスト外では None）
+_request_stages = contextvars.ContextVar('fridgemate_request_stages', default=None)
+
+
+def _escape(value) -> str:
+    """ラベル値のエスケープ（Prometheus のテキスト形式）"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """カウンターとヒストグラム（スレッドセーフ）"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # (名前, ラベル) → 値
+        self._counters = {}
+        # (名前, ラベル) → [バケットごとの件数..., 合計秒数, 件数]
+        self._histograms = {}
+        # 名前 → (説明, 種類)
+        self._help = {}
+        # 名前 → 値を返す関数（/metrics を返すときに呼ぶ）
+        self._gauges = {}
+
+    def describe(self, name: str, help_text: str, kind: str):
+        self._help[name] = (help_text, kind)
+
+    def inc(self, name: str, labels: Tuple = (), amount: float = 1):
+        """カウンターを増やす（labels は (名前, 値) のタプル）"""
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, labels: Tuple = ()):
+        """ヒストグラムに1件記録する"""
+        key = (name, labels)
+        with self._lock:
+            values = self._histograms.get(key)
+            if values is None:
+                values = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    values[i] += 1
+                    break
+            values[-2] += seconds
+            values[-1] += 1
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], float], kind: str = 'gauge'):
+        """/metrics を返すときに read() の値を出す項目を登録する（他のクラスが数えているカウンターは kind='counter'）"""
+        self.describe(name, help_text, kind)
+        self._gauges[name] = read
+
+    @staticmethod
+    def _labels(labels: Tuple, extra: Tuple = ()) -> str:
+        pairs = tuple(labels) + tuple(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def render(self) -> str:
+        """Prometheus のテキスト形式"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(values)) for key, values in self._histograms.items())
+
+        lines = []
+        described = set()
+
+        def header(name, default_kind):
+            if name in described:
+                return
+            described.add(name)
+            help_text, kind = self._help.get(name, ('', default_kind))
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f"{name}{self._labels(labels)} {value}")
+
+        for (name, labels), values in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f"{name}_bucket{self._labels(labels, (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{self._labels(labels, (('le', '+Inf'),))} {values[-1]}")
+            lines.append(f"{name}_sum{self._labels(labels)} {values[-2]:.6f}")
+            lines.append(f"{name}_count{self._labels(labels)} {values[-1]}")
+
+        for name, read in sorted(self._gauges.items()):
+            try:
+                value = read()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            header(name, 'gauge')
+            lines.append(f"{name} {float(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+
+# プロセス全体の計測値
+metrics = Metrics()
+metrics.describe('fridgemate_stage_seconds', "処理の段階ごとの所要時間", 'histogram')
+metrics.describe('fridgemate_request_seconds', "リクエストの所要時間", 'histogram')
+metrics.describe('fridgemate_requests_total', "リクエスト数", 'counter')
+
+_enabled = os.environ.get('FRIDGEMATE_INSTRUMENTATION', '1') != '0'
+
+
+def set_enabled(enabled: bool):
+    global _enabled
+    _enabled = bool(enabled)
+
+
+class span:
+    """段階の所要時間を測るコンテキストマネージャー"""
+
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        if _enabled:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.started is None:
+            return False
+        elapsed = time.perf_counter() - self.started
+        stages = _request_stages.get()
+        if stages is not None:
+            stages[self.name] = stages.get(self.name, 0.0) + elapsed
+        metrics.observe('fridgemate_stage_seconds', elapsed, (('stage', self.name),))
+        return False
+
+
+def timed(name: str):
+    """関数全体を span(name) で測るデコレーター"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing(stages: Dict[str, float], total: float = None) -> str:
+    """Server-Timing ヘッダーの値（ミリ秒）"""
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ', '.join(entries)
+
+
+def init_app(app, metrics_path: str = '/metrics'):
+    """
+    Flask アプリにリクエストの計測・Server-Timing ヘッダー・/metrics を追加する
+
+    Args:
+        app: Flask アプリ
+        metrics_path: Prometheus 形式の計測値を返すURL
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_request_timing():
+        if not _enabled:
+            return
+        g.instrumentation = (time.perf_counter(), _request_stages.set({}))
+
+    @app.after_request
+    def finish_request_timing(response):
+        timing = g.pop('instrumentation', None)
+        if timing is None:
+            return response
+        started, token = timing
+        elapsed = time.perf_counter() - started
+        stages = _request_stages.get() or {}
+        _request_stages.reset(token)
+
+        # 登録されていないURLはラベルの種類が増えないよう1つにまとめる
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe('fridgemate_request_seconds', elapsed, (('route', route), ('method', request.method)))
+        metrics.inc('fridgemate_requests_total',
+                    (('route', route), ('method', request.method), ('status', str(response.status_code))))
+        if request.path != metrics_path:
+            response.headers['Server-Timing'] = server_timing(stages, elapsed)
+        return response
+
+    @app.teardown_request
+    def discard_request_timing(exception):
+        # after_request まで届かなかった（例外で中断した）リクエスト
+        timing = g.pop('instrumentation', None)
+        if timing is not None:
+            _request_stages.reset(timing[1])
+
+    def metrics_endpoint():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule(metrics_path, 'metrics', metrics_endpoint)
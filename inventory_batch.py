@@ -0,0 +1,70 @@
+from datetime import datetime
+from typing import Dict, List, Sequence, Tuple
+
+# 一括登録で受け付ける列（省略した列は NULL、数量は 0）
+ITEM_INSERT_COLUMNS = ('name', 'quantity', 'category', 'expiry_date')
+ITEM_RESULT_COLUMNS = 'id, name, quantity, category, expiry_date, updated_at'
+
+
+def _placeholders(count: int) -> str:
+    return ', '.join('?' * count)
+
+
+def _fetch_items(conn, ids: Sequence[int]) -> List[Dict]:
+    rows = []
+    # SQLite のパラメータ数の上限を超えないように分けて読む
+    for start in range(0, len(ids), 500):
+        chunk = list(ids[start:start + 500])
+        rows.extend(dict(row) for row in conn.execute(
+            f"SELECT {ITEM_RESULT_COLUMNS} FROM items WHERE id IN ({_placeholders(len(chunk))}) ORDER BY id", chunk))
+    return rows
+
+
+def missing_item_ids(conn, ids: Sequence[int]) -> List[int]:
+    """存在しない在庫のID"""
+    found = set()
+    for start in range(0, len(ids), 500):
+        chunk = list(ids[start:start + 500])
+        found.update(row[0] for row in conn.execute(
+            f"SELECT id FROM items WHERE id IN ({_placeholders(len(chunk))})", chunk))
+    return [item_id for item_id in ids if item_id not in found]
+
+
+def apply_batch(conn, inserts: List[Dict], adjustments: List[Tuple[int, int]]) -> Tuple[List[int], List[Dict], List[Dict]]:
+    """
+    在庫の一括登録と数量の一括増減（書き込みトランザクションの中で呼ぶ。コミットは呼び出し側で行う）
+
+    登録・増減はそれぞれ executemany の1回で行う。
+    増減の対象に存在しない在庫が含まれる場合は何も変更しない。
+
+    Args:
+        conn: DB接続（run_write の中）
+        inserts: 登録する在庫 {'name', 'quantity', 'category', 'expiry_date'} のリスト
+        adjustments: (在庫ID, 増減量) のリスト（同じIDが複数回あれば合計される）
+
+    Returns:
+        (存在しない在庫のID, 登録した在庫の行, 増減した在庫の行)
+    """
+    adjusted_ids = sorted({item_id for item_id, _ in adjustments})
+    missing = missing_item_ids(conn, adjusted_ids)
+    if missing:
+        return missing, [], []
+
+    now = datetime.now()
+    created_ids = []
+    if inserts:
+        # items は AUTOINCREMENT のため、書き込みロック中に登録した行のIDは sqlite_sequence の前後の値の間に連番で入る
+        before = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'items'").fetchone()
+        conn.executemany(
+            "INSERT INTO items (name, quantity, category, expiry_date, updated_at) VALUES (?, ?, ?, ?, ?)",
+            [tuple(item.get(column) for column in ITEM_INSERT_COLUMNS) + (now,) for item in inserts]
+        )
+        after = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'items'").fetchone()
+        created_ids = list(range((before[0] if before else 0) + 1, after[0] + 1))
+
+    if adjustments:
+        # 数量の増減はSQL側で行う（同時に操作されても更新が失われない）
+        conn.executemany("UPDATE items SET quantity = quantity + ?, updated_at = ? WHERE id = ?",
+                         [(delta, now, item_id) for item_id, delta in adjustments])
+
+    return [], _fetch_items(conn, created_ids), _fetch_items(conn, adjusted_ids)
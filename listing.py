@@ -0,0 +1,189 @@
+import base64
+import json
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# SQLite の INTEGER に入る範囲
+SQLITE_INT_MIN = -2 ** 63
+SQLITE_INT_MAX = 2 ** 63 - 1
+
+
+class KeysetPager:
+    """
+    一覧ページのキーセット（カーソル）方式のページング
+
+    OFFSET を使わず「前のページの最後の行の (並べ替え列, id) より後」を条件にするため、
+    何ページ目でもインデックスの範囲検索だけで読める。
+    NULL を含む列で並べ替える場合は、値のある行 → NULL の行の順に2回に分けて読む
+    （どちらもインデックスを使える形にするため）。
+    """
+
+    def __init__(self, table: str, columns: Sequence[str], sorts: Dict[str, Tuple[str, bool]],
+                 default_sort: str, filter_column: Optional[str] = None, nullable: Sequence[str] = ()):
+        """
+        Args:
+            table: テーブル名
+            columns: 取得する列（テンプレートで表示する列だけ）
+            sorts: 並べ替えの名前 → (列名, 降順か)
+            default_sort: 既定の並べ替えの名前
+            filter_column: 絞り込みに使う列（カテゴリ・ジャンル）
+            nullable: NULL を含みうる並べ替え列
+        """
+        self.table = table
+        self.columns = list(columns)
+        self.sorts = sorts
+        self.default_sort = default_sort
+        self.filter_column = filter_column
+        self.nullable = set(nullable)
+
+    @staticmethod
+    def encode_cursor(segment: int, value, row_id: int) -> str:
+        payload = json.dumps([segment, value, row_id], ensure_ascii=False, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor: Optional[str]):
+        """カーソルを (区間, 値, id) に戻す（不正な値なら None = 先頭から）"""
+        if not cursor:
+            return None
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            segment, value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+            segment, row_id = int(segment), int(row_id)
+            # SQLに渡せる値（文字列・SQLite の INTEGER に入る整数・有限の小数・NULL）だけを受け付ける
+            if not isinstance(value, (str, int, float, type(None))):
+                return None
+            if isinstance(value, float) and not math.isfinite(value):
+                return None
+            if any(isinstance(v, int) and not SQLITE_INT_MIN <= v <= SQLITE_INT_MAX for v in (value, row_id)):
+                return None
+            return segment, value, row_id
+        except (ValueError, TypeError, OverflowError):
+            return None
+
+    def _segments(self, column: str) -> List[bool]:
+        """読む区間（True: 値のある行、False: NULLの行）"""
+        return [True, False] if column in self.nullable else [True]
+
+    def segment_queries(self, sort_name: str, filtered: bool, after: bool) -> List[str]:
+        """
+        区間ごとのSQL（実行計画の確認用にも使う）
+
+        Args:
+            sort_name: 並べ替えの名前
+            filtered: 絞り込みをするか
+            after: カーソル以降を読むか
+        """
+        column, descending = self.sorts[sort_name]
+        direction = 'DESC' if descending else 'ASC'
+        operator = '<' if descending else '>'
+        select_columns = self.columns + ([column] if column not in self.columns else [])
+
+        queries = []
+        for has_value in self._segments(column):
+            conditions = []
+            if filtered:
+                conditions.append(f"{self.filter_column} = ?")
+            if has_value:
+                conditions.append(f"{column} IS NOT NULL")
+                if after:
+                    conditions.append(f"({column}, id) {operator} (?, ?)")
+                order = f"{column} {direction}, id {direction}"
+            else:
+                conditions.append(f"{column} IS NULL")
+                if after:
+                    conditions.append(f"id {operator} ?")
+                order = f"id {direction}"
+            queries.append(
+                f"SELECT {', '.join(select_columns)} FROM {self.table} "
+                f"WHERE {' AND '.join(conditions)} ORDER BY {order} LIMIT ?"
+            )
+        return queries
+
+    def page(self, conn, sort_name: str = None, filter_value: str = None,
+             cursor: str = None, limit: int = 50) -> Dict:
+        """
+        1ページ分の行を取得する
+
+        Args:
+            conn: DB接続
+            sort_name: 並べ替えの名前（未知の値なら既定）
+            filter_value: 絞り込みの値（None・空文字なら絞り込まない）
+            cursor: 前のページの next_cursor（None なら先頭ページ）
+            limit: 1ページの件数
+
+        Returns:
+            {'rows': 行のリスト, 'next_cursor': 次ページのカーソル（最後のページなら None）, 'sort': 並べ替えの名前}
+        """
+        if sort_name not in self.sorts:
+            sort_name = self.default_sort
+        column = self.sorts[sort_name][0]
+        filtered = bool(filter_value) and self.filter_column is not None
+        position = self.decode_cursor(cursor)
+        start_segment = position[0] if position else 0
+
+        fetched = []
+        for segment in range(start_segment, len(self._segments(column))):
+            remaining = limit + 1 - len(fetched)
+            if remaining <= 0:
+                break
+            after = position is not None and segment == start_segment
+            sql = self.segment_queries(sort_name, filtered, after)[segment]
+
+            params = [filter_value] if filtered else []
+            if after:
+                _, value, row_id = position
+                params += [value, row_id] if segment == 0 else [row_id]
+            params.append(remaining)
+            fetched.extend((segment, row) for row in conn.execute(sql, params).fetchall())
+
+        next_cursor = None
+        if len(fetched) > limit:
+            fetched = fetched[:limit]
+            segment, last = fetched[-1]
+            next_cursor = self.encode_cursor(segment, last[column], last['id'])
+
+        return {
+            'rows': [row for _, row in fetched],
+            'next_cursor': next_cursor,
+            'sort': sort_name,
+        }
+
+    def filter_values_query(self) -> str:
+        """絞り込みの選択肢を取得するSQL（インデックスだけで読める）"""
+        return (f"SELECT DISTINCT {self.filter_column} FROM {self.table} "
+                f"WHERE {self.filter_column} IS NOT NULL AND {self.filter_column} != '' ORDER BY {self.filter_column}")
+
+    def filter_values(self, conn) -> List[str]:
+        """絞り込みの選択肢"""
+        if self.filter_column is None:
+            return []
+        return [row[0] for row in conn.execute(self.filter_values_query())]
+
+
+# 在庫一覧（index.html が表示する列）
+ITEM_PAGER = KeysetPager(
+    table='items',
+    columns=['id', 'name', 'quantity', 'category', 'expiry_date'],
+    sorts={
+        'name': ('name', False),
+        'expiry': ('expiry_date', False),
+        'updated': ('updated_at', True),
+    },
+    default_sort='expiry',
+    filter_column='category',
+    nullable=['expiry_date', 'updated_at'],
+)
+
+# レシピ一覧（recipe_list.html が表示する列）
+RECIPE_PAGER = KeysetPager(
+    table='recipes',
+    columns=['id', 'title', 'genre', 'prep_time', 'cook_time', 'servings', 'created_at'],
+    sorts={
+        'created': ('created_at', True),
+        'name': ('title', False),
+    },
+    default_sort='created',
+    filter_column='genre',
+    nullable=['created_at'],
+)
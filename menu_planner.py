@@ -0,0 +1,466 @@
+import time
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from instrumentation import timed
+
+
+def is_main_genre(genre) -> bool:
+    """主菜のジャンルか（ExcelのGenre値: '主菜' など）"""
+    genre = str(genre if genre is not None else '').strip()
+    return genre.startswith('主') or genre == 'Main'
+
+
+def is_side_genre(genre) -> bool:
+    """副菜のジャンルか"""
+    genre = str(genre if genre is not None else '').strip()
+    return genre.startswith('副') or genre == 'Side'
+
+
+class IncrementalScorer:
+    """
+    在庫の変化に合わせて全レシピのスコアを差分更新する
+
+    初回は在庫の必須食材を使うレシピ（MLRecipeRecommender.candidate_rows）だけを計算し、
+    以降は在庫とのマッチ結果が変わった材料語彙を逆引き索引で引いて、その材料を使うレシピの
+    期限スコア・マッチ率だけを計算し直す。TF-IDF類似度は在庫の食材名の並びが変わったときに
+    候補の行だけ疎行列積1回で更新し、新たに候補になったレシピはその時点で求める。
+    値は MLRecipeRecommender.calculate_recipe_scores_batch と完全に一致する
+    （類似度は候補のレシピのみ。候補以外のスコアは0）。
+    """
+
+    def __init__(self, recommender):
+        """
+        Args:
+            recommender: MLRecipeRecommender（呼び出し側でロックを保持していること）
+        """
+        self.recommender = recommender
+        self.features = None
+        self.matches = None
+        self.scores = None
+        self.similarities = None
+        self._vocab_matches = None
+        self._expiry_scores = None
+        self._match_rates = None
+        # 類似度を計算済みの行
+        self._has_similarity = None
+
+    def _compute_similarities(self, text: str, rows: np.ndarray):
+        """rows の類似度を求めて計算済みにする"""
+        if len(rows):
+            self.similarities[rows] = self.recommender.tfidf_similarities(text, rows)
+            self._has_similarity[rows] = True
+
+    def _rescore(self, rows: np.ndarray, preference):
+        """rows の総合スコアを計算し直す"""
+        recommender = self.recommender
+        self.scores[rows] = recommender._combine_scores(
+            self.similarities[rows], self._expiry_scores[rows], self._match_rates[rows],
+            recommender._has_ingredients[rows], preference[rows] if preference is not None else None,
+            recommender.min_essential_coverage
+        )
+
+    @timed('scoring')
+    def update(self, inventory_items: List[Dict]) -> bool:
+        """
+        在庫に合わせてスコアを更新する
+
+        Returns:
+            推薦できる食材が在庫にあるか（False の場合スコアは使えない）
+        """
+        recommender = self.recommender
+        features = recommender.extract_inventory_features(inventory_items)
+        if not features['ingredient_scores']:
+            self.features = None
+            return False
+
+        matches = recommender.ingredient_matcher.resolve(features['ingredient_scores'])
+        vocab_matches = recommender._match_vocabulary(matches)
+        text = features['ingredient_text']
+
+        preference = recommender.preference_factors()
+        if self.features is None:
+            # 初回は候補のレシピだけを計算（候補以外はマッチ率が0なのでスコアも0）
+            count = len(recommender.recipe_ids)
+            rows = recommender.candidate_rows(vocab_matches[0])
+            self.scores = np.zeros(count)
+            self.similarities = np.zeros(count)
+            self._has_similarity = np.zeros(count, dtype=bool)
+            self._expiry_scores = np.zeros(count)
+            self._match_rates = np.zeros(count)
+            if len(rows):
+                self._compute_similarities(text, rows)
+                self._expiry_scores[rows], self._match_rates[rows] = recommender._slot_totals(vocab_matches, rows)
+                self._rescore(rows, preference)
+        else:
+            # マッチ結果が変わった材料語彙 → その材料を使うレシピだけ再計算
+            changed = np.zeros(len(vocab_matches[0]), dtype=bool)
+            for current, previous in zip(vocab_matches, self._vocab_matches):
+                changed |= current != previous
+            rows = np.unique(recommender.vocab_recipe_index()[np.flatnonzero(changed)].indices)
+
+            if len(rows):
+                self._expiry_scores[rows], self._match_rates[rows] = recommender._slot_totals(vocab_matches, rows)
+
+            if text != self.features['ingredient_text']:
+                # 食材名の並びが変わった → 現在の候補の類似度とスコアを計算し直す
+                candidates = recommender.candidate_rows(vocab_matches[0])
+                self.similarities[:] = 0.0
+                self._has_similarity[:] = False
+                self.scores[:] = 0.0
+                if len(candidates):
+                    self._compute_similarities(text, candidates)
+                    self._rescore(candidates, preference)
+            elif len(rows):
+                # 新たに候補になった（必須食材がマッチした）レシピの類似度を求める
+                rates = self._match_rates[rows]
+                missing = rows[(rates > 0) & (rates >= recommender.min_essential_coverage) & ~self._has_similarity[rows]]
+                self._compute_similarities(text, missing)
+                self._rescore(rows, preference)
+
+        self.features = features
+        self.matches = matches
+        self._vocab_matches = vocab_matches
+        return True
+
+    @timed('results')
+    def build_result(self, row: int) -> Dict:
+        """選ばれたレシピの表示用データ（recommend_recipes の要素と同じ形式）"""
+        recommender = self.recommender
+        recipe_id = recommender.recipe_ids[row]
+        score, details = recommender._score_recipe_details(
+            recommender.recipe_index[recipe_id], self.similarities[row], self.matches
+        )
+        return recommender._build_recipe_result(recipe_id, score, details)
+
+
+@timed('consumption')
+def consume_ingredients(recommender, inventory_items: List[Dict], recipe_rows: List[int]):
+    """
+    料理に使う食材を在庫から1単位ずつ減らす（在庫リストをその場で更新）
+
+    材料ごとに、名前がマッチする最初の在庫を1つ減らす（単位変換は難しいため1単位とする）。
+
+    Returns:
+        数量を減らした在庫の位置リスト
+    """
+    matcher = recommender.ingredient_matcher
+    inv_names = [recommender.normalize_ingredient_name(item['name']) for item in inventory_items]
+    first_matches = matcher.first_matches(inv_names)
+    consumed = []
+
+    for row in recipe_rows:
+        recipe = recommender.recipe_index[recommender.recipe_ids[row]]
+        for ing_name in recipe['ingredient_names']:
+            position = first_matches.get(matcher.lookup(ing_name))
+            if position is None:
+                continue
+
+            item = inventory_items[position]
+            # もし数量が数値でなければ無視
+            try:
+                qty = float(item['quantity'])
+                if qty > 0:
+                    item['quantity'] = qty - 1
+                    consumed.append(position)
+            except (ValueError, TypeError):
+                pass
+
+    return consumed
+
+
+class GreedyMenuPlanner:
+    """
+    日ごとにその時点で最もスコアの高い主菜・副菜を選ぶ献立プランナー
+
+    カタログのスコア計算は初日に1回だけ行い、以降は消費シミュレーションで
+    変化した食材に関係するレシピだけを再計算する。表示用データは選ばれた料理の分だけ作る。
+    """
+
+    def __init__(self, recommender, candidate_pool: int = 50):
+        """
+        Args:
+            recommender: MLRecipeRecommender
+            candidate_pool: 各日に候補とする上位レシピ数
+        """
+        self.recommender = recommender
+        self.candidate_pool = candidate_pool
+
+    def plan(self, inventory_items: List[Dict], days: int = 5) -> List[Dict]:
+        recommender = self.recommender
+        genres = [recommender.recipe_index[rid]['info'].get('Genre', '') for rid in recommender.recipe_ids]
+
+        # 在庫のシミュレーション用コピー（変更するのは数量だけ）
+        current_inventory = [dict(item) for item in inventory_items]
+        scorer = IncrementalScorer(recommender)
+        daily_menus = []
+        used_rows = set()
+
+        for day in range(1, days + 1):
+            # 現在の在庫でスコアを更新し、上位の候補から選ばれていないものを探す
+            if scorer.update(current_inventory):
+                ranked = recommender.rank_scores(scorer.scores, self.candidate_pool)
+                candidates = [row for row in ranked if row not in used_rows]
+            else:
+                candidates = []
+
+            main_row = next((row for row in candidates if is_main_genre(genres[row])), None)
+            if main_row is not None:
+                used_rows.add(main_row)
+            side_row = next((row for row in candidates if is_side_genre(genres[row]) and row not in used_rows), None)
+            if side_row is not None:
+                used_rows.add(side_row)
+
+            # メニューが決まらなかった場合のフォールバック（ジャンル不問でスコア高いもの）
+            if main_row is None:
+                main_row = next((row for row in candidates if row not in used_rows), None)
+                if main_row is None:
+                    continue
+                used_rows.add(main_row)
+
+            daily_menus.append({
+                'day': day,
+                'main_dish': scorer.build_result(main_row),
+                'side_dish': scorer.build_result(side_row) if side_row is not None else None
+            })
+
+            # 食材の消費シミュレーション
+            dishes_to_cook = [main_row] + ([side_row] if side_row is not None else [])
+            consume_ingredients(recommender, current_inventory, dishes_to_cook)
+
+            # 数量が0以下になった在庫は次の日の計算から外す
+            current_inventory = [item for item in current_inventory if item.get('quantity', 0) > 0]
+
+        return daily_menus
+
+
+class BeamMenuPlanner:
+    """
+    計画期間全体で、期限の近い食材をできるだけ使い切る献立をビームサーチで探す
+
+    目的関数は「各日に使う食材1単位ごとの期限スコア」の合計に、レシピの推薦スコアを
+    quality_weight 倍して加えたもの。期限スコアは extract_inventory_features と同じ
+    段階（期限切れ200 / 1日以内150 / 3日以内120 / 7日以内80 / それ以外30）を調理日時点の
+    残り日数で評価し、調理日までに期限が切れてしまう食材（計画開始時点では期限内）は 0 とする。
+
+    食材の消費は1材料につき1単位（GreedyMenuPlanner と同じ）とし、在庫数量を超えては使わない。
+    同じ材料に一致する在庫が複数ある場合は期限の近いものから使う。
+    候補は初期在庫での推薦上位 candidate_pool 件に限定し、同じレシピは期間中に1回だけ使う。
+
+    time_budget_ms を超えた時点でビーム幅を1に落とし（以降は貪欲法）、残りの日を埋める。
+    """
+
+    def __init__(self, recommender, candidate_pool: int = 100, beam_width: int = 4,
+                 main_branch: int = 4, side_branch: int = 2, quality_weight: float = 0.2,
+                 time_budget_ms: float = 300):
+        """
+        Args:
+            recommender: MLRecipeRecommender
+            candidate_pool: 候補とする上位レシピ数
+            beam_width: 各日に残す部分献立の数
+            main_branch: 部分献立ごとに試す主菜の数
+            side_branch: 主菜ごとに試す副菜の数
+            quality_weight: 推薦スコアの重み
+            time_budget_ms: 探索にかける時間の上限（ミリ秒）
+        """
+        self.recommender = recommender
+        self.candidate_pool = candidate_pool
+        self.beam_width = beam_width
+        self.main_branch = main_branch
+        self.side_branch = side_branch
+        self.quality_weight = quality_weight
+        self.time_budget_ms = time_budget_ms
+        # 直近の探索の統計（目的関数値、展開した状態数、時間切れしたか）
+        self.last_stats = None
+
+    def _prepare_inventory(self, inventory_items: List[Dict]) -> Tuple[np.ndarray, List[Optional[int]]]:
+        """在庫ごとの数量と期限までの日数（日付が読めない在庫はNone）"""
+        today = date.today()
+        quantities = np.zeros(len(inventory_items))
+        days_left = []
+        for position, item in enumerate(inventory_items):
+            try:
+                quantities[position] = max(float(item.get('quantity', 0)), 0.0)
+            except (ValueError, TypeError):
+                pass
+            try:
+                expiry_date = datetime.strptime(item.get('expiry_date'), '%Y-%m-%d').date()
+                days_left.append((expiry_date - today).days)
+            except (ValueError, TypeError):
+                days_left.append(None)
+        return quantities, days_left
+
+    def _ingredient_sources(self, inventory_items: List[Dict], days_left: List[Optional[int]],
+                            rows: List[int]) -> Dict[int, List[List[int]]]:
+        """候補レシピの材料ごとに、使える在庫の位置（期限の近い順）"""
+        recommender = self.recommender
+        matcher = recommender.ingredient_matcher
+        inv_names = [recommender.normalize_ingredient_name(item['name']) for item in inventory_items]
+        relation = matcher.relation(inv_names)
+
+        vocab_positions = {}
+        for position, inv_name in enumerate(inv_names):
+            for vocab_id in relation[inv_name]:
+                vocab_positions.setdefault(vocab_id, []).append(position)
+
+        def expiry_order(position):
+            return (days_left[position] is None, days_left[position] or 0, position)
+
+        sources = {}
+        for row in rows:
+            recipe = recommender.recipe_index[recommender.recipe_ids[row]]
+            ingredient_sources = []
+            for ing_name in recipe['ingredient_names']:
+                positions = vocab_positions.get(matcher.lookup(ing_name))
+                if positions:
+                    ingredient_sources.append(sorted(positions, key=expiry_order))
+            sources[row] = ingredient_sources
+        return sources
+
+    def _unit_value(self, days_left: Optional[int], day_offset: int) -> float:
+        """調理日（開始日から day_offset 日後）に1単位使ったときの期限スコア"""
+        if days_left is None:
+            return 0.0
+        if days_left < 0:
+            return self.recommender.expiry_tier_score(days_left)
+        if day_offset > days_left:
+            # 調理日より前に期限が切れている
+            return 0.0
+        return self.recommender.expiry_tier_score(days_left - day_offset)
+
+    @staticmethod
+    def _take(sources: List[List[int]], quantities: np.ndarray) -> List[int]:
+        """料理に使う在庫の位置（材料ごとに残量のある最初の在庫、同じ在庫は数量まで）"""
+        taken = []
+        remaining = {}
+        for positions in sources:
+            for position in positions:
+                left = remaining.get(position, quantities[position])
+                if left >= 1:
+                    remaining[position] = left - 1
+                    taken.append(position)
+                    break
+        return taken
+
+    def plan(self, inventory_items: List[Dict], days: int = 5) -> List[Dict]:
+        recommender = self.recommender
+        started = time.perf_counter()
+        deadline = started + self.time_budget_ms / 1000.0
+
+        scorer = IncrementalScorer(recommender)
+        if not scorer.update(inventory_items):
+            self.last_stats = {'objective': 0.0, 'expanded': 0, 'truncated': False,
+                               'seconds': time.perf_counter() - started}
+            return []
+
+        rows = [int(row) for row in recommender.rank_scores(scorer.scores, self.candidate_pool)]
+        quality = {row: float(scorer.scores[row]) * self.quality_weight for row in rows}
+        genres = {row: recommender.recipe_index[recommender.recipe_ids[row]]['info'].get('Genre', '') for row in rows}
+        mains = [row for row in rows if is_main_genre(genres[row])]
+        sides = [row for row in rows if is_side_genre(genres[row])]
+
+        quantities, days_left = self._prepare_inventory(inventory_items)
+        sources = self._ingredient_sources(inventory_items, days_left, rows)
+        unit_values = np.array([[self._unit_value(d, offset) for d in days_left] for offset in range(days)])
+        if unit_values.size == 0:
+            unit_values = np.zeros((days, 0))
+
+        def dish_gain(row, state_quantities, day_offset):
+            taken = self._take(sources[row], state_quantities)
+            return float(unit_values[day_offset, taken].sum()) + quality[row], taken
+
+        # 状態: (目的関数値, 在庫数量, 使用済みレシピ, 献立 [(日, 主菜, 副菜)])
+        beam = [(0.0, quantities, frozenset(), ())]
+        expanded = 0
+        truncated = False
+
+        for day_offset in range(days):
+            width = self.beam_width
+            if time.perf_counter() > deadline:
+                truncated = True
+                width = 1
+                beam = beam[:1]
+
+            children = []
+            for value, state_quantities, used, menus in beam:
+                main_pool = [row for row in mains if row not in used]
+                if not main_pool:
+                    # ジャンル不問のフォールバック
+                    main_pool = [row for row in rows if row not in used]
+                if not main_pool:
+                    children.append((value, state_quantities, used, menus))
+                    continue
+
+                main_options = sorted(
+                    ((dish_gain(row, state_quantities, day_offset), row) for row in main_pool),
+                    key=lambda option: -option[0][0]
+                )[:self.main_branch if width > 1 else 1]
+
+                for (main_gain, main_taken), main_row in main_options:
+                    after_main = state_quantities.copy()
+                    np.subtract.at(after_main, main_taken, 1)
+                    side_pool = [row for row in sides if row not in used and row != main_row]
+                    side_options = sorted(
+                        ((dish_gain(row, after_main, day_offset), row) for row in side_pool),
+                        key=lambda option: -option[0][0]
+                    )[:self.side_branch if width > 1 else 1]
+                    if not side_options:
+                        side_options = [((0.0, []), None)]
+
+                    for (side_gain, side_taken), side_row in side_options:
+                        child_quantities = after_main
+                        if side_taken:
+                            child_quantities = after_main.copy()
+                            np.subtract.at(child_quantities, side_taken, 1)
+                        child_used = used | {main_row} | ({side_row} if side_row is not None else set())
+                        children.append((
+                            value + main_gain + side_gain,
+                            child_quantities,
+                            child_used,
+                            menus + ((day_offset + 1, main_row, side_row),)
+                        ))
+                        expanded += 1
+
+            # 目的関数値の高い順（同点は先に生成した部分献立を優先）
+            children.sort(key=lambda child: -child[0])
+            beam = children[:width]
+
+        best_value, best_quantities, _, best_menus = beam[0]
+        self.last_stats = {
+            'objective': best_value,
+            'expanded': expanded,
+            'truncated': truncated,
+            'seconds': time.perf_counter() - started
+        }
+        return self._build_menus(inventory_items, best_menus, sources)
+
+    def _build_menus(self, inventory_items: List[Dict], menus, sources) -> List[Dict]:
+        """選んだ献立の表示用データ（スコア・マッチ情報はその日の在庫で計算し、選んだ料理の分だけ作る）"""
+        recommender = self.recommender
+        quantities, _ = self._prepare_inventory(inventory_items)
+        daily_menus = []
+
+        for day, main_row, side_row in menus:
+            dishes = [main_row] + ([side_row] if side_row is not None else [])
+            current_inventory = [dict(item, quantity=qty) for item, qty in zip(inventory_items, quantities) if qty > 0]
+            features = recommender.extract_inventory_features(current_inventory)
+            matches = recommender.ingredient_matcher.resolve(features['ingredient_scores'])
+            similarities = recommender.tfidf_similarities(features['ingredient_text'], np.array(dishes))
+
+            results = []
+            for row, similarity in zip(dishes, similarities):
+                recipe_id = recommender.recipe_ids[row]
+                score, details = recommender._score_recipe_details(recommender.recipe_index[recipe_id], similarity, matches)
+                results.append(recommender._build_recipe_result(recipe_id, score, details))
+
+            daily_menus.append({
+                'day': day,
+                'main_dish': results[0],
+                'side_dish': results[1] if side_row is not None else None
+            })
+            for row in dishes:
+                np.subtract.at(quantities, self._take(sources[row], quantities), 1)
+
+        return daily_menus
@@ -1,8 +1,13 @@
-import pandas as pd
-import sqlite3
+import argparse
 import os
+import sqlite3
+import time
 from datetime import datetime
 
+from openpyxl import load_workbook
+
+from migrations import apply_migrations
+
 # Paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 RECIPE_DB_PATH = os.path.join(BASE_DIR, "レシピdb.xlsx")
@@ -10,114 +15,278 @@ INGREDIENTS_PATH = os.path.join(BASE_DIR, "分量・材料.xlsx")
 STEPS_PATH = os.path.join(BASE_DIR, "調理手順.xlsx")
 DATABASE_PATH = os.path.join(BASE_DIR, "inventory.db")
 
-def migrate():
+# Rows per executemany call
+DEFAULT_CHUNK_SIZE = 2000
+
+# Print progress every this many rows
+PROGRESS_INTERVAL = 20000
+
+# Re-running the migration updates recipes that were already imported (matched by Recipe_ID)
+# and replaces their ingredients and steps. "skip" leaves them untouched instead.
+RECIPE_UPSERT_SQL = {
+    'upsert': """
+        INSERT INTO recipes (source_recipe_id, title, genre, prep_time, cook_time, servings, calorie, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (source_recipe_id) DO UPDATE SET
+            title = excluded.title, genre = excluded.genre, prep_time = excluded.prep_time,
+            cook_time = excluded.cook_time, servings = excluded.servings, calorie = excluded.calorie
+    """,
+    'skip': """
+        INSERT INTO recipes (source_recipe_id, title, genre, prep_time, cook_time, servings, calorie, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (source_recipe_id) DO NOTHING
+    """,
+}
+
+# Bulk-load settings for the migration connection only (the app's connections are not affected).
+# The whole migration is one transaction, so a crash leaves the database as it was before.
+BULK_PRAGMAS = (
+    "PRAGMA synchronous = OFF",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",
+)
+
+
+def iter_sheet_chunks(path, sheet_name, chunk_size):
+    """
+    Stream a worksheet as lists of {header: value} dicts without loading the whole workbook.
+
+    openpyxl's read_only mode reads rows lazily from the xlsx XML.
+    """
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [str(name).strip() if name is not None else None for name in header]
+        chunk = []
+        for values in rows:
+            if values is None or all(value is None for value in values):
+                continue
+            chunk.append(dict(zip(header, values)))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        workbook.close()
+
+
+def normalize_source_id(value):
+    """Recipe_ID as stored in recipes.source_recipe_id (1, 1.0 and "1" are the same recipe); None if not numeric."""
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        number = float(str(value).strip())
+    except ValueError:
+        return None
+    if number != number:  # NaN
+        return None
+    return str(int(number)) if number.is_integer() else str(number)
+
+
+def text(value):
+    return "" if value is None else str(value)
+
+
+def flag(value):
+    if isinstance(value, str):
+        return 1 if value.strip().lower() in ('1', 'true', 'yes', 'y', '○') else 0
+    return 1 if value else 0
+
+
+class Progress:
+    """Rows-per-second progress output for one table."""
+
+    def __init__(self, label):
+        self.label = label
+        self.count = 0
+        self.started = time.perf_counter()
+        self._next_report = PROGRESS_INTERVAL
+
+    def add(self, rows):
+        self.count += rows
+        if self.count >= self._next_report:
+            self._next_report += PROGRESS_INTERVAL
+            print(f"  {self.label}: {self.count} rows ({self.rate():.0f} rows/s)")
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def done(self, note=""):
+        print(f"Migrated {self.count} {self.label} in {time.perf_counter() - self.started:.2f}s "
+              f"({self.rate():.0f} rows/s){note}")
+
+
+def recipe_key(title, ingredient_names):
+    """Identity of a recipe imported before source_recipe_id existed: title plus its ingredient names."""
+    return text(title), tuple(sorted(ingredient_names))
+
+
+def adopt_legacy_recipes(conn, chunk_size):
+    """
+    Record source_recipe_id on recipes imported before migration v7 added the column.
+
+    Those rows have a NULL source_recipe_id, so the upsert would insert the whole catalog again.
+    A legacy row is matched to a workbook recipe by title plus ingredient names; when several rows
+    share the same key (the old script was run more than once) only the oldest one is adopted.
+    Rows that match nothing (recipes created in the app) are left alone.
+    """
+    legacy = conn.execute("SELECT id, title FROM recipes WHERE source_recipe_id IS NULL ORDER BY id").fetchall()
+    if not legacy:
+        return
+
+    started = time.perf_counter()
+    ingredient_names = {}
+    for recipe_id, name in conn.execute("""
+            SELECT i.recipe_id, i.name FROM recipe_ingredients i
+            JOIN recipes r ON r.id = i.recipe_id WHERE r.source_recipe_id IS NULL"""):
+        ingredient_names.setdefault(recipe_id, []).append(name)
+    legacy_ids = {}
+    for recipe_id, title in legacy:
+        legacy_ids.setdefault(recipe_key(title, ingredient_names.get(recipe_id, ())), recipe_id)
+
+    claimed = {row[0] for row in conn.execute(
+        "SELECT source_recipe_id FROM recipes WHERE source_recipe_id IS NOT NULL")}
+    titles = {}
+    for chunk in iter_sheet_chunks(RECIPE_DB_PATH, 'レシピdb', chunk_size):
+        for row in chunk:
+            source_id = normalize_source_id(row.get('Recipe_ID'))
+            if source_id is not None and source_id not in claimed:
+                titles.setdefault(source_id, row.get('Title'))
+    if not titles:
+        # Every workbook recipe is already keyed; the remaining rows were created in the app
+        return
+    source_names = {}
+    for chunk in iter_sheet_chunks(INGREDIENTS_PATH, '分量・材料', chunk_size):
+        for row in chunk:
+            source_id = normalize_source_id(row.get('Recipe_ID'))
+            if source_id in titles:
+                source_names.setdefault(source_id, []).append(text(row.get('Ingredient_Name_Normalized')))
+
+    adopted = []
+    for source_id, title in titles.items():
+        recipe_id = legacy_ids.pop(recipe_key(title, source_names.get(source_id, ())), None)
+        if recipe_id is not None:
+            adopted.append((source_id, recipe_id))
+    conn.executemany("UPDATE recipes SET source_recipe_id = ? WHERE id = ?", adopted)
+    print(f"Matched {len(adopted)} of {len(legacy)} recipes imported without Recipe_ID "
+          f"in {time.perf_counter() - started:.2f}s")
+
+
+def migrate_recipes(conn, mode, chunk_size):
+    """
+    Insert or update recipes and return {Recipe_ID: recipes.id} for the recipes whose children should be imported.
+    """
+    id_map = {}
+    skipped = 0
+    now = datetime.now()
+    progress = Progress("recipes")
+    for chunk in iter_sheet_chunks(RECIPE_DB_PATH, 'レシピdb', chunk_size):
+        params = []
+        for row in chunk:
+            source_id = normalize_source_id(row.get('Recipe_ID'))
+            if source_id is None:
+                continue
+            params.append((source_id, row.get('Title'), row.get('Genre'), row.get('Prep_Time_Min'),
+                           row.get('Cook_Time_Min'), row.get('Servings'), row.get('Calorie'), now))
+        if not params:
+            continue
+        source_ids = list({param[0] for param in params})
+        placeholders = ', '.join('?' * len(source_ids))
+
+        existing = set()
+        if mode == 'skip':
+            existing = {row[0] for row in conn.execute(
+                f"SELECT source_recipe_id FROM recipes WHERE source_recipe_id IN ({placeholders})", source_ids)}
+            skipped += len(existing)
+
+        conn.executemany(RECIPE_UPSERT_SQL[mode], params)
+        for recipe_id, source_id in conn.execute(
+                f"SELECT id, source_recipe_id FROM recipes WHERE source_recipe_id IN ({placeholders})", source_ids):
+            if source_id not in existing:
+                id_map[source_id] = recipe_id
+        progress.add(len(params) - len(existing))
+
+    progress.done(f", skipped {skipped} already imported" if skipped else "")
+
+    if mode == 'upsert':
+        # Updated recipes get their ingredients and steps replaced (new recipes have none)
+        recipe_ids = [(recipe_id,) for recipe_id in id_map.values()]
+        conn.executemany("DELETE FROM recipe_ingredients WHERE recipe_id = ?", recipe_ids)
+        conn.executemany("DELETE FROM recipe_steps WHERE recipe_id = ?", recipe_ids)
+    return id_map
+
+
+def migrate_children(conn, id_map, chunk_size):
+    progress = Progress("ingredients")
+    for chunk in iter_sheet_chunks(INGREDIENTS_PATH, '分量・材料', chunk_size):
+        params = []
+        for row in chunk:
+            # Only migrate if we have a parent recipe
+            recipe_id = id_map.get(normalize_source_id(row.get('Recipe_ID')))
+            if recipe_id is None:
+                continue
+            params.append((recipe_id, text(row.get('Ingredient_Name_Normalized')), text(row.get('Quantity_Amount')),
+                           text(row.get('Quantity_Unit')), flag(row.get('Is_Essential'))))
+        conn.executemany(
+            "INSERT INTO recipe_ingredients (recipe_id, name, quantity, unit, is_essential) VALUES (?, ?, ?, ?, ?)",
+            params
+        )
+        progress.add(len(params))
+    progress.done()
+
+    progress = Progress("steps")
+    for chunk in iter_sheet_chunks(STEPS_PATH, '調理手順', chunk_size):
+        params = []
+        for row in chunk:
+            recipe_id = id_map.get(normalize_source_id(row.get('Recipe_ID')))
+            if recipe_id is None:
+                continue
+            step_number = row.get('Step_Number')
+            try:
+                step_number = int(step_number)
+            except (TypeError, ValueError):
+                pass
+            params.append((recipe_id, step_number, text(row.get('Step_Description'))))
+        conn.executemany(
+            "INSERT INTO recipe_steps (recipe_id, step_number, description) VALUES (?, ?, ?)",
+            params
+        )
+        progress.add(len(params))
+    progress.done()
+
+
+def migrate(database_path=DATABASE_PATH, mode='upsert', chunk_size=DEFAULT_CHUNK_SIZE):
     print("Migration started...")
-    
+
     # Check if Excel files exist
     if not (os.path.exists(RECIPE_DB_PATH) and os.path.exists(INGREDIENTS_PATH) and os.path.exists(STEPS_PATH)):
         print("Excel files not found. Please ensure they are in the same directory.")
         return
 
-    # Connect to DB
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
+    # recipes.source_recipe_id (the upsert key) is added by migration v7
+    apply_migrations(database_path)
 
+    started = time.perf_counter()
+    conn = sqlite3.connect(database_path, timeout=30, isolation_level=None)
     try:
-        # Load Excel files
-        print("Loading Excel files...")
-        recipes_df = pd.read_excel(RECIPE_DB_PATH, sheet_name='レシピdb')
-        ingredients_df = pd.read_excel(INGREDIENTS_PATH, sheet_name='分量・材料')
-        steps_df = pd.read_excel(STEPS_PATH, sheet_name='調理手順')
-
-        # Clean IDs
-        recipes_df = recipes_df[pd.to_numeric(recipes_df['Recipe_ID'], errors='coerce').notnull()]
-        
-        migrated_count = 0
-        
-        # Determine starting ID for recipes to avoid conflicts if needed, 
-        # but we'll let AUTOINCREMENT handle it and map old IDs to new IDs
-        # Actually, for consistency with ML model training data (if it relied on IDs), 
-        # we might want to preserve IDs IF possible, but 'id' in DB is AUTOINCREMENT.
-        # However, the ML model in this app seems to rebuild features from data every time (__init__),
-        # so ID continuity might not be strictly required as long as relationships are preserved.
-        # We will create a mapping from Old_Recipe_ID -> New_Recipe_ID.
-        
-        id_map = {} # Old -> New
-
-        print("Migrating recipes...")
-        for _, row in recipes_df.iterrows():
-            old_id = row['Recipe_ID']
-            title = row['Title']
-            genre = row.get('Genre')
-            prep_time = row.get('Prep_Time_Min')
-            cook_time = row.get('Cook_Time_Min')
-            servings = row.get('Servings')
-            calorie = row.get('Calorie')
-            
-            # Simple check if this recipe might already be in DB (by title) to avoid duplicates on re-run
-            # But user said "Yes" to migration, assuming they want to import.
-            # We'll insert.
-            
-            cursor.execute(
-                "INSERT INTO recipes (title, genre, prep_time, cook_time, servings, calorie, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (title, genre, prep_time, cook_time, servings, calorie, datetime.now())
-            )
-            new_id = cursor.lastrowid
-            id_map[old_id] = new_id
-            migrated_count += 1
-
-        print(f"Migrated {migrated_count} recipes.")
-
-        print("Migrating ingredients...")
-        ing_count = 0
-        for _, row in ingredients_df.iterrows():
-            old_id = row['Recipe_ID']
-            # Only migrate if we have a parent recipe
-            if old_id not in id_map: 
-                continue
-            
-            new_rec_id = id_map[old_id]
-            name = row.get('Ingredient_Name_Normalized', '')
-            if pd.isna(name): name = ""
-            quantity = row.get('Quantity_Amount', '')
-            if pd.isna(quantity): quantity = ""
-            unit = row.get('Quantity_Unit', '')
-            if pd.isna(unit): unit = ""
-            is_essential = 1 if row.get('Is_Essential') else 0
-
-            cursor.execute(
-                "INSERT INTO recipe_ingredients (recipe_id, name, quantity, unit, is_essential) VALUES (?, ?, ?, ?, ?)",
-                (new_rec_id, name, str(quantity), str(unit), is_essential)
-            )
-            ing_count += 1
-            
-        print(f"Migrated {ing_count} ingredients.")
-
-        print("Migrating steps...")
-        step_count = 0
-        for _, row in steps_df.iterrows():
-            old_id = row['Recipe_ID']
-            if old_id not in id_map:
-                continue
-                
-            new_rec_id = id_map[old_id]
-            step_num = row.get('Step_Number')
-            desc = row.get('Step_Description', '')
-            if pd.isna(desc): desc = ""
-
-            cursor.execute(
-                "INSERT INTO recipe_steps (recipe_id, step_number, description) VALUES (?, ?, ?)",
-                (new_rec_id, step_num, desc)
-            )
-            step_count += 1
-            
-        print(f"Migrated {step_count} steps.")
-
-        conn.commit()
-        print("Migration completed successfully.")
-
+        for pragma in BULK_PRAGMAS:
+            conn.execute(pragma)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            adopt_legacy_recipes(conn, chunk_size)
+            id_map = migrate_recipes(conn, mode, chunk_size)
+            migrate_children(conn, id_map, chunk_size)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        print(f"Migration completed successfully in {time.perf_counter() - started:.2f}s.")
     except Exception as e:
-        conn.rollback()
         print(f"Migration failed: {e}")
         import traceback
         traceback.print_exc()
@@ -125,4 +294,10 @@ def migrate():
         conn.close()
 
 if __name__ == "__main__":
-    migrate()
+    parser = argparse.ArgumentParser(description="Import the recipe workbooks into the SQLite database")
+    parser.add_argument("--mode", choices=sorted(RECIPE_UPSERT_SQL), default='upsert',
+                        help="upsert: update recipes imported before (default), skip: leave them unchanged")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows per executemany call")
+    parser.add_argument("--db", default=DATABASE_PATH, help="database file")
+    args = parser.parse_args()
+    migrate(args.db, args.mode, args.chunk_size)
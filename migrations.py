@@ -0,0 +1,257 @@
+import sqlite3
+
+# データベースのスキーマ変更履歴
+# PRAGMA user_version に適用済みのバージョンを記録し、未適用のものだけを順に実行する。
+# 適用済みのマイグレーションは書き換えず、変更は新しいバージョンとして末尾に追加すること。
+MIGRATIONS = [
+    (1, "基本テーブル", [
+        """
+        CREATE TABLE IF NOT EXISTS items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            category TEXT,
+            expiry_date DATE,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS recipes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            genre TEXT,
+            prep_time INTEGER,
+            cook_time INTEGER,
+            servings INTEGER,
+            calorie INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS recipe_ingredients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipe_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            quantity TEXT,
+            unit TEXT,
+            is_essential BOOLEAN DEFAULT 0,
+            FOREIGN KEY (recipe_id) REFERENCES recipes (id) ON DELETE CASCADE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS recipe_steps (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipe_id INTEGER NOT NULL,
+            step_number INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            FOREIGN KEY (recipe_id) REFERENCES recipes (id) ON DELETE CASCADE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS recipe_feedback (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipe_id TEXT NOT NULL,
+            recipe_title TEXT NOT NULL,
+            feedback_type TEXT NOT NULL,
+            rating INTEGER,
+            feedback_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (2, "レシピの子テーブル・賞味期限・食材名のインデックス", [
+        # edit_recipe / delete_recipe / 推薦モデルの差分更新（recipe_id での検索・削除）
+        "CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_recipe_id ON recipe_ingredients (recipe_id)",
+        # 手順は番号順に取り出すため (recipe_id, step_number) で並べ替えなしで読める
+        "CREATE INDEX IF NOT EXISTS idx_recipe_steps_recipe_step ON recipe_steps (recipe_id, step_number)",
+        "CREATE INDEX IF NOT EXISTS idx_recipe_feedback_recipe_id ON recipe_feedback (recipe_id)",
+        # レシピ一覧（新しい順）
+        "CREATE INDEX IF NOT EXISTS idx_recipes_created_at ON recipes (created_at)",
+        # 期限アラート・推薦用の在庫（quantity > 0）
+        "CREATE INDEX IF NOT EXISTS idx_items_expiry_date ON items (expiry_date)",
+        "CREATE INDEX IF NOT EXISTS idx_items_quantity ON items (quantity)",
+        # 正規化した食材名（normalize_ingredient_name と同じ lower + trim）での検索
+        "CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_norm_name ON recipe_ingredients (lower(trim(name)))",
+    ]),
+    (3, "テーブルの更新回数（キャッシュの無効化用）", [
+        # 別のプロセス・接続からの変更も検知できるよう、トリガーで更新回数を数える
+        """
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        "INSERT OR IGNORE INTO data_versions (name, version) VALUES ('items', 0)",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_items_version_insert AFTER INSERT ON items
+        BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE name = 'items';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_items_version_update AFTER UPDATE ON items
+        BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE name = 'items';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_items_version_delete AFTER DELETE ON items
+        BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE name = 'items';
+        END
+        """,
+    ]),
+    (4, "一覧ページの並べ替え・絞り込み用インデックス", [
+        # 在庫一覧: 名前 / 賞味期限 / 更新日時の順、カテゴリでの絞り込み（listing.ITEM_PAGER）
+        "CREATE INDEX IF NOT EXISTS idx_items_name ON items (name)",
+        "CREATE INDEX IF NOT EXISTS idx_items_updated_at ON items (updated_at)",
+        "CREATE INDEX IF NOT EXISTS idx_items_category_name ON items (category, name)",
+        "CREATE INDEX IF NOT EXISTS idx_items_category_expiry_date ON items (category, expiry_date)",
+        "CREATE INDEX IF NOT EXISTS idx_items_category_updated_at ON items (category, updated_at)",
+        # レシピ一覧: 登録日 / レシピ名の順、ジャンルでの絞り込み（listing.RECIPE_PAGER）
+        "CREATE INDEX IF NOT EXISTS idx_recipes_title ON recipes (title)",
+        "CREATE INDEX IF NOT EXISTS idx_recipes_genre_title ON recipes (genre, title)",
+        "CREATE INDEX IF NOT EXISTS idx_recipes_genre_created_at ON recipes (genre, created_at)",
+    ]),
+    (5, "更新日時の記録・レシピの更新回数（JSON APIの条件付きGET用）", [
+        # ALTER TABLE では CURRENT_TIMESTAMP を既定値にできないため、既存の行はここで埋める
+        "ALTER TABLE data_versions ADD COLUMN updated_at TIMESTAMP",
+        "UPDATE data_versions SET updated_at = CURRENT_TIMESTAMP",
+        "INSERT OR IGNORE INTO data_versions (name, version, updated_at) VALUES ('recipes', 0, CURRENT_TIMESTAMP)",
+        # 在庫のトリガーを更新日時も記録するものに置き換える
+        "DROP TRIGGER IF EXISTS trg_items_version_insert",
+        "DROP TRIGGER IF EXISTS trg_items_version_update",
+        "DROP TRIGGER IF EXISTS trg_items_version_delete",
+    ] + [
+        # (テーブル, 操作) ごとのトリガー。レシピは材料・手順の変更もレシピの更新として数える
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()} AFTER {event} ON {table}
+        BEGIN
+            UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = '{name}';
+        END
+        """
+        for table, name in (('items', 'items'), ('recipes', 'recipes'),
+                            ('recipe_ingredients', 'recipes'), ('recipe_steps', 'recipes'))
+        for event in ('INSERT', 'UPDATE', 'DELETE')
+    ]),
+    (6, "レシピごとのフィードバック集計（推薦スコアの好み補正用）", [
+        # recipe_feedback（記録のログ）を読み直さずに済むよう、レシピごとの集計をトリガーで更新する
+        """
+        CREATE TABLE IF NOT EXISTS recipe_feedback_summary (
+            recipe_id INTEGER PRIMARY KEY,
+            rating_count INTEGER NOT NULL DEFAULT 0,
+            rating_sum INTEGER NOT NULL DEFAULT 0,
+            made_count INTEGER NOT NULL DEFAULT 0,
+            last_made_at TIMESTAMP
+        )
+        """,
+        """
+        INSERT OR REPLACE INTO recipe_feedback_summary (recipe_id, rating_count, rating_sum, made_count, last_made_at)
+        SELECT CAST(recipe_id AS INTEGER),
+               SUM(feedback_type = 'rating' AND rating IS NOT NULL),
+               COALESCE(SUM(CASE WHEN feedback_type = 'rating' THEN rating END), 0),
+               SUM(feedback_type = 'made'),
+               MAX(CASE WHEN feedback_type = 'made' THEN feedback_date END)
+        FROM recipe_feedback
+        GROUP BY CAST(recipe_id AS INTEGER)
+        """,
+        "INSERT OR IGNORE INTO data_versions (name, version, updated_at) VALUES ('feedback', 0, CURRENT_TIMESTAMP)",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_recipe_feedback_summary_insert AFTER INSERT ON recipe_feedback
+        BEGIN
+            INSERT INTO recipe_feedback_summary (recipe_id, rating_count, rating_sum, made_count, last_made_at)
+            VALUES (
+                CAST(NEW.recipe_id AS INTEGER),
+                NEW.feedback_type = 'rating' AND NEW.rating IS NOT NULL,
+                CASE WHEN NEW.feedback_type = 'rating' THEN COALESCE(NEW.rating, 0) ELSE 0 END,
+                NEW.feedback_type = 'made',
+                CASE WHEN NEW.feedback_type = 'made' THEN NEW.feedback_date END
+            )
+            ON CONFLICT (recipe_id) DO UPDATE SET
+                rating_count = rating_count + excluded.rating_count,
+                rating_sum = rating_sum + excluded.rating_sum,
+                made_count = made_count + excluded.made_count,
+                last_made_at = COALESCE(MAX(last_made_at, excluded.last_made_at), last_made_at, excluded.last_made_at);
+            UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'feedback';
+        END
+        """,
+        # レシピの削除などでフィードバックが消えた場合は、そのレシピの分だけ集計し直す
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_recipe_feedback_summary_delete AFTER DELETE ON recipe_feedback
+        BEGIN
+            DELETE FROM recipe_feedback_summary WHERE recipe_id = CAST(OLD.recipe_id AS INTEGER);
+            INSERT INTO recipe_feedback_summary (recipe_id, rating_count, rating_sum, made_count, last_made_at)
+            SELECT CAST(recipe_id AS INTEGER),
+                   SUM(feedback_type = 'rating' AND rating IS NOT NULL),
+                   COALESCE(SUM(CASE WHEN feedback_type = 'rating' THEN rating END), 0),
+                   SUM(feedback_type = 'made'),
+                   MAX(CASE WHEN feedback_type = 'made' THEN feedback_date END)
+            FROM recipe_feedback
+            WHERE recipe_id = OLD.recipe_id
+            GROUP BY CAST(recipe_id AS INTEGER);
+            UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'feedback';
+        END
+        """,
+    ]),
+    (7, "Excelから移行したレシピの元のID（再実行時の重複防止用）", [
+        # migrate_excel_to_db.py が Recipe_ID を記録し、再実行時は同じレシピを更新（またはスキップ）する
+        # 画面から登録したレシピは NULL（UNIQUE インデックスでも NULL は重複してよい）
+        "ALTER TABLE recipes ADD COLUMN source_recipe_id TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_recipes_source_recipe_id ON recipes (source_recipe_id)",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    """適用済みのスキーマバージョン"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(db_path: str, verbose: bool = True) -> int:
+    """
+    未適用のマイグレーションを1つのトランザクションで適用する
+
+    複数のプロセスが同時に起動しても二重に適用しないよう、
+    書き込みロックを取ってからバージョンを確認する。
+
+    Args:
+        db_path: データベースファイルのパス
+        verbose: 適用したマイグレーションを表示するか
+
+    Returns:
+        適用後のスキーマバージョン
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        if get_version(conn) >= LATEST_VERSION:
+            return get_version(conn)
+
+        conn.isolation_level = None
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = get_version(conn)
+            for migration_version, description, statements in MIGRATIONS:
+                if migration_version <= version:
+                    continue
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {migration_version}")
+                version = migration_version
+                if verbose:
+                    print(f"マイグレーションを適用しました: v{migration_version} {description}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return version
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    db_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "inventory.db")
+    print(f"{db_path}: スキーマバージョン v{apply_migrations(db_path)}")
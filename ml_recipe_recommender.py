@@ -2,123 +2,904 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, date, timedelta
 from typing import List, Dict, Tuple
+import contextlib
+import functools
+import hashlib
+import json
 import os
+import pickle
+import shutil
+import sqlite3
+import threading
+import time
+import sklearn
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import StandardScaler
+from sklearn.preprocessing import StandardScaler, normalize
+import scipy.sparse as sp
 import warnings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from ingredient_matcher import IngredientMatcher
+from instrumentation import span, timed
+from menu_planner import BeamMenuPlanner, GreedyMenuPlanner
 warnings.filterwarnings('ignore')
 
+# スナップショットの形式のバージョン（保存内容を変えたら上げる）
+SNAPSHOT_VERSION = 2
+
+# スナップショットが最新かを判定するためのレシピの更新回数（migrations.py のトリガーで更新される）
+# レシピ・材料・手順のどの行が変わっても増えるため、内容の変更は長さが同じでも検出できる
+_CATALOG_VERSION_QUERY = "SELECT version, updated_at FROM data_versions WHERE name = 'recipes'"
+
+# 更新回数と合わせて指紋に含める行数・最大ID（DBファイルを別のものに置き換えた場合の保険）
+_CATALOG_SIZE_QUERIES = {
+    table: f"SELECT COUNT(*), MAX(id) FROM {table}"
+    for table in ('recipes', 'recipe_ingredients', 'recipe_steps')
+}
+
+# data_versions がない（マイグレーション前の）DBでは全行の内容から指紋を求める
+_CATALOG_CONTENT_QUERIES = {
+    table: f"SELECT * FROM {table} ORDER BY id"
+    for table in ('recipes', 'recipe_ingredients', 'recipe_steps')
+}
+
+# スナップショットに .npy として保存する配列（属性名 → ファイル名）
+_SNAPSHOT_ARRAYS = {
+    '_slot_vocab': 'slot_vocab.npy',
+    '_slot_essential': 'slot_essential.npy',
+    '_slot_optional': 'slot_optional.npy',
+    '_essential_counts': 'essential_counts.npy',
+    '_has_ingredients': 'has_ingredients.npy',
+}
+
+
+# フィードバックによる好み補正の既定の重み
+# 総合スコアに (1 + 評価の補正 - 最近作った料理の補正) を掛ける（フィードバックのないレシピは1倍）
+DEFAULT_PREFERENCE_WEIGHTS = {
+    # 平均評価5（1）で +rating（-rating）倍。評価が少ないうちは rating_prior 件分の「評価3」で割り引く
+    'rating': 0.2,
+    'rating_prior': 2,
+    # 今日作った料理は -recency 倍、recency_days 日かけて補正なしに戻る
+    'recency': 0.5,
+    'recency_days': 7,
+}
+
+# レシピごとのフィードバック集計（migrations.py のトリガーで更新される）
+FEEDBACK_SUMMARY_QUERY = "SELECT recipe_id, rating_count, rating_sum, made_count, last_made_at FROM recipe_feedback_summary"
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_expiry_date(expiry_date_str: str) -> date:
+    """賞味期限の文字列を日付に変換（献立シミュレーションで同じ文字列を何度も解析するためキャッシュ）"""
+    return datetime.strptime(expiry_date_str, '%Y-%m-%d').date()
+
+
+def default_snapshot_dir(db_path: str) -> str:
+    """DBファイルの隣に置くスナップショットのディレクトリ（inventory.db → inventory_model/）"""
+    return os.path.splitext(db_path)[0] + '_model'
+
+
+def _synchronized(method):
+    """
+    索引の更新中に推薦処理が走らないようにインスタンスのロックを取る
+    
+    推薦処理どうしも直列になるため、1プロセス内のスレッドでは並列に計算しない
+    （gunicorn ではワーカー数で並列度を決める。gunicorn.conf.py）。
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class MLRecipeRecommender:
     """機械学習ベースのレシピ推薦システム - 特徴量から学習されたモデルを使用"""
     
-    def __init__(self, db_path: str):
+    # 接続行列の空きスロットの語彙ID（どの語彙にも対応しない番兵。マッチ結果配列の末尾を指す）
+    _slot_sentinel = -1
+    # 候補がレシピ全体のこの割合を超えたら、行を抜き出さずに全レシピを計算する（そのほうが速い）
+    _dense_candidate_ratio = 0.5
+    
+    def __init__(self, db_path: str, refit_threshold: float = 0.1,
+                 snapshot_dir: str = None, use_snapshot: bool = True, preference_weights: Dict = None,
+                 min_essential_coverage: float = 0.0):
         """
         レシピデータを読み込んで機械学習モデルを構築
         
+        有効なスナップショットがあればそれを読み込み、DBの読み込みと学習を省略する。
+        
         Args:
             db_path: データベース(inventory.db)のパス
+            refit_threshold: 前回の学習以降に変更されたレシピの割合がこれを超えたら
+                             TF-IDFの語彙を学習し直す（upsert_recipe / remove_recipe 用）
+            snapshot_dir: スナップショットの保存先（省略時はDBの隣）
+            use_snapshot: Falseならスナップショットを読み書きしない
+            preference_weights: フィードバックによる好み補正の重み（DEFAULT_PREFERENCE_WEIGHTS を上書き）
+            min_essential_coverage: 必須食材のマッチ率がこれ未満のレシピは推薦しない
+                                    （0 なら必須食材が1つでも在庫にあれば対象。候補の絞り込みにも使う）
         """
+        started = time.perf_counter()
         self.db_path = db_path
+        self.refit_threshold = refit_threshold
+        self.snapshot_dir = snapshot_dir or default_snapshot_dir(db_path)
+        # 索引・特徴量の更新と参照を直列化する
+        self._lock = threading.RLock()
+        # (特徴量行列, 行を正規化した特徴量行列)
+        self._normalized_features = None
+        self.preference_weights = dict(DEFAULT_PREFERENCE_WEIGHTS, **(preference_weights or {}))
+        self.min_essential_coverage = min_essential_coverage
+        # レシピID → フィードバック集計
+        self.feedback_summary = {}
+        # (日付, レシピ行ごとの好み補正の倍率)
+        self._preference_factors = None
         
-        # データベースからデータを読み込む
-        import sqlite3
+        # データベースからデータを読み込む（有効なスナップショットがあればそれを使う）
+        if not self._load_catalog(started, use_snapshot, build=not use_snapshot):
+            # スナップショットが古い: 他のプロセス（gunicorn のワーカー）が同じ版を構築中なら
+            # 終わるのを待って保存されたものを読み込み、なければこのプロセスが構築して保存する
+            with self._snapshot_lock():
+                self._load_catalog(started, use_snapshot, build=True)
+    
+    def _load_catalog(self, started: float, use_snapshot: bool, build: bool) -> bool:
+        """
+        DBのレシピを読み込んで索引・特徴量を作る
+        
+        Args:
+            started: 初期化を始めた時刻（load_stats 用）
+            use_snapshot: 有効なスナップショットがあれば使い、構築した場合は保存する
+            build: スナップショットが使えない場合にDBから構築するか
+        
+        Returns:
+            読み込んだか（build=False でスナップショットが使えなかった場合は False）
+        """
         conn = sqlite3.connect(self.db_path)
         
         try:
-            # テーブルからデータをDataFrameとして読み込む
-            # Excelの構造に合わせて列名を調整する（後方互換性のため）
-            
-            # レシピデータ
-            self.recipes_df = pd.read_sql("SELECT * FROM recipes", conn)
-            # カラム名をMLモデルが期待する形式にリネーム
-            self.recipes_df = self.recipes_df.rename(columns={
-                'id': 'Recipe_ID',
-                'title': 'Title',
-                'genre': 'Genre',
-                'prep_time': 'Prep_Time_Min',
-                'cook_time': 'Cook_Time_Min',
-                'servings': 'Servings',
-                'calorie': 'Calorie'
-                # method is not in DB schema yet? let's check schema.sql. 
-                # schema.sql has no 'method' or 'description' in 'recipes' table.
-                # However, there is 'recipe_steps' table.
-                # The original Excel had 'Method_Main'. 
-                # The 'recipe_steps' table has 'description'.
-            })
-            
-            # 材料データ
-            self.ingredients_df = pd.read_sql("SELECT * FROM recipe_ingredients", conn)
-            self.ingredients_df = self.ingredients_df.rename(columns={
-                'recipe_id': 'Recipe_ID',
-                'name': 'Ingredient_Name_Normalized',
-                'quantity': 'Quantity_Amount',
-                'unit': 'Quantity_Unit',
-                'is_essential': 'Is_Essential'
-            })
-            
-            # 手順データ
-            self.steps_df = pd.read_sql("SELECT * FROM recipe_steps", conn)
-            self.steps_df = self.steps_df.rename(columns={
-                'recipe_id': 'Recipe_ID',
-                'step_number': 'Step_Number',
-                'description': 'Step_Description'
-            })
-            
+            # 指紋とレシピのテーブルを同じ時点の内容で読む（途中で変更されても食い違わないように）
+            conn.execute("BEGIN")
+            # フィードバックはカタログと別に毎回読む（スナップショットには含めない）
+            self.feedback_summary = self._read_feedback_summary(conn)
+            fingerprint = self._catalog_fingerprint(conn)
+            loaded = use_snapshot and self._load_snapshot(fingerprint)
+            if not loaded:
+                if not build:
+                    return False
+                self.recipes_df, self.ingredients_df, self.steps_df = self._read_recipe_tables(conn)
         finally:
             conn.close()
         
+        if loaded:
+            # 学習時の生データは保持しない（索引が正となる）
+            self.recipes_df = self.ingredients_df = self.steps_df = None
+            # 候補の絞り込み用の逆引き索引（プロセス間で共有できるよう読み込み時に作る）
+            self.essential_recipe_index()
+            self.load_stats = {
+                'source': 'snapshot',
+                'seconds': time.perf_counter() - started,
+                'build_seconds': loaded.get('build_seconds'),
+            }
+            return True
+        
         # データの前処理
         self._preprocess_data()
         
+        # レシピIDをキーにした索引（材料・手順・メタ情報）
+        self._build_recipe_index()
+        
         # 特徴量エンジニアリング
         self._build_feature_vectors()
+        
+        # 一括スコア計算用のレシピ×材料接続行列
+        self._build_incidence_matrix()
+        # 候補の絞り込み用の逆引き索引（必須食材 → レシピ）
+        self.essential_recipe_index()
+        
+        build_seconds = time.perf_counter() - started
+        self.load_stats = {'source': 'database', 'seconds': build_seconds, 'build_seconds': build_seconds}
+        if use_snapshot:
+            try:
+                self._write_snapshot(fingerprint, build_seconds)
+            except OSError as e:
+                print(f"スナップショットを保存できませんでした: {e}")
+        return True
+
+    @contextlib.contextmanager
+    def _snapshot_lock(self, wait: bool = True):
+        """
+        スナップショットの構築・保存・無効化をプロセス間で直列化する（snapshot_dir の隣の .lock）
+        
+        同じプロセスの中で入れ子にしないこと。fcntl のない環境（Windows の単一プロセス）では排他しない。
+        
+        Args:
+            wait: 他のプロセスが使用中なら待つか（False なら待たずに取れなかったことを返す）
+        
+        Yields:
+            ロックを取れたか
+        """
+        if fcntl is None:
+            yield True
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.snapshot_dir)), exist_ok=True)
+            lock_file = open(self.snapshot_dir + '.lock', 'a')
+        except OSError:
+            # 保存先に書き込めない場合は排他しない（スナップショットの保存も失敗し、構築だけ行う）
+            yield True
+            return
+        with lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _catalog_fingerprint(conn) -> str:
+        """
+        レシピ関連テーブルの指紋（内容が変わればスナップショットは無効）
+        
+        data_versions のレシピの更新回数があればそれと行数から求め、
+        なければ全行の内容のハッシュにする。
+        """
+        try:
+            version = conn.execute(_CATALOG_VERSION_QUERY).fetchone()
+        except sqlite3.OperationalError:
+            version = None
+        
+        digest = hashlib.sha1()
+        if version is not None:
+            values = {table: list(conn.execute(query).fetchone()) for table, query in _CATALOG_SIZE_QUERIES.items()}
+            values['version'] = list(version)
+            digest.update(json.dumps(values, sort_keys=True).encode('utf-8'))
+        else:
+            for table, query in _CATALOG_CONTENT_QUERIES.items():
+                digest.update(table.encode('utf-8'))
+                for row in conn.execute(query):
+                    digest.update(repr(row).encode('utf-8'))
+        return digest.hexdigest()
+    
+    def discard_snapshot(self):
+        """
+        スナップショットがDBの現在の内容と違えば無効にする（DBのレシピを変更した後に呼ぶ）
+        
+        meta.json を消すだけなので、読み込み済みのメモリマップはそのまま使える。
+        他のプロセスが変更後の内容で保存し直したものは残す。他のプロセスが構築中なら待たない
+        （指紋はレシピの更新回数を含むため、変更前の内容で保存されたものは次の読み込みで使われない）。
+        """
+        try:
+            with self._snapshot_lock(wait=False) as locked:
+                if not locked:
+                    return
+                meta_path = os.path.join(self.snapshot_dir, 'meta.json')
+                try:
+                    with open(meta_path, encoding='utf-8') as f:
+                        saved = json.load(f).get('fingerprint')
+                except (OSError, ValueError):
+                    return
+                conn = sqlite3.connect(self.db_path)
+                try:
+                    current = self._catalog_fingerprint(conn)
+                finally:
+                    conn.close()
+                if saved != current:
+                    os.remove(meta_path)
+        except OSError as e:
+            print(f"スナップショットを無効にできませんでした: {e}")
+    
+    def save_snapshot(self, fingerprint: str = None, build_seconds: float = None):
+        """
+        学習済みの状態をスナップショットとして保存する
+        
+        語彙・IDF重み（TfidfVectorizer）・疎な特徴量行列・レシピ索引・IDの対応表・
+        接続行列を snapshot_dir に書き出す。配列は .npy なのでメモリマップで読める。
+        
+        Args:
+            fingerprint: 保存時点のテーブルの指紋（省略時はDBから求める）
+            build_seconds: 構築にかかった秒数（起動時の比較表示用）
+        """
+        if fingerprint is None:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                fingerprint = self._catalog_fingerprint(conn)
+            finally:
+                conn.close()
+        with self._snapshot_lock():
+            self._write_snapshot(fingerprint, build_seconds)
+    
+    def _write_snapshot(self, fingerprint: str, build_seconds: float = None):
+        """save_snapshot の本体（_snapshot_lock を取った状態で呼ぶ）"""
+        with self._lock:
+            # 書き込み途中の状態を読まれないよう、一時ディレクトリに書いてから置き換える
+            tmp_dir = f"{self.snapshot_dir}.tmp-{os.getpid()}"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            
+            features = self.ingredient_features.tocsr()
+            np.save(os.path.join(tmp_dir, 'features_data.npy'), features.data)
+            np.save(os.path.join(tmp_dir, 'features_indices.npy'), features.indices)
+            np.save(os.path.join(tmp_dir, 'features_indptr.npy'), features.indptr)
+            for attr, filename in _SNAPSHOT_ARRAYS.items():
+                np.save(os.path.join(tmp_dir, filename), getattr(self, attr))
+            
+            with open(os.path.join(tmp_dir, 'state.pkl'), 'wb') as f:
+                pickle.dump({
+                    'tfidf_vectorizer': self.tfidf_vectorizer,
+                    'recipe_ids': self.recipe_ids,
+                    'recipe_index': self.recipe_index,
+                    'ingredient_matcher': self.ingredient_matcher,
+                    'changes_since_fit': self._changes_since_fit,
+                }, f, protocol=pickle.HIGHEST_PROTOCOL)
+            
+            # meta.json は最後に書く（これが揃っていることが完全なスナップショットの条件）
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump({
+                    'version': SNAPSHOT_VERSION,
+                    'sklearn_version': sklearn.__version__,
+                    'fingerprint': fingerprint,
+                    'features_shape': list(features.shape),
+                    'recipe_count': len(self.recipe_ids),
+                    'build_seconds': build_seconds,
+                    'created_at': datetime.now().isoformat(),
+                }, f)
+            
+            shutil.rmtree(self.snapshot_dir, ignore_errors=True)
+            os.replace(tmp_dir, self.snapshot_dir)
+    
+    def _load_snapshot(self, fingerprint: str):
+        """
+        スナップショットが有効なら読み込む
+        
+        Returns:
+            読み込んだスナップショットのメタ情報（無効・存在しない場合はNone）
+        """
+        meta_path = os.path.join(self.snapshot_dir, 'meta.json')
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        if (meta.get('version') != SNAPSHOT_VERSION
+                or meta.get('sklearn_version') != sklearn.__version__
+                or meta.get('fingerprint') != fingerprint):
+            return None
+        
+        try:
+            with open(os.path.join(self.snapshot_dir, 'state.pkl'), 'rb') as f:
+                state = pickle.load(f)
+            
+            features = sp.csr_matrix(
+                (
+                    np.load(os.path.join(self.snapshot_dir, 'features_data.npy'), mmap_mode='r'),
+                    np.load(os.path.join(self.snapshot_dir, 'features_indices.npy'), mmap_mode='r'),
+                    np.load(os.path.join(self.snapshot_dir, 'features_indptr.npy'), mmap_mode='r'),
+                ),
+                shape=tuple(meta['features_shape'])
+            )
+            # 接続行列などはコピーオンライトのメモリマップで読む（複数のワーカーでページキャッシュを共有し、
+            # upsert_recipe で書き換えた行だけがそのプロセスのメモリになる）
+            arrays = {
+                attr: np.load(os.path.join(self.snapshot_dir, filename), mmap_mode='c')
+                for attr, filename in _SNAPSHOT_ARRAYS.items()
+            }
+        except Exception as e:
+            print(f"スナップショットの読み込みに失敗しました（再構築します）: {e}")
+            return None
+        
+        self.tfidf_vectorizer = state['tfidf_vectorizer']
+        self.recipe_ids = state['recipe_ids']
+        self.recipe_index = state['recipe_index']
+        self.ingredient_matcher = state['ingredient_matcher']
+        self.ingredient_vocabulary = self.ingredient_matcher.vocabulary
+        self.ingredient_vocab_index = self.ingredient_matcher.vocab_index
+        self._changes_since_fit = state['changes_since_fit']
+        self.ingredient_features = features
+        for attr, array in arrays.items():
+            setattr(self, attr, array)
+        self._reverse_index = None
+        self._essential_index = None
+        self._rebuild_id_maps()
+        return meta
+
+    def _read_recipe_tables(self, conn, recipe_id: int = None) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        """
+        レシピ関連の3テーブルをDataFrameとして読み込む
+        
+        Args:
+            conn: SQLite接続
+            recipe_id: 指定した場合はそのレシピの行だけを読み込む
+        
+        Returns:
+            (レシピ, 材料, 手順) のDataFrame
+        """
+        if recipe_id is None:
+            recipe_filter, child_filter, params = "", "", None
+        else:
+            recipe_filter, child_filter, params = " WHERE id = ?", " WHERE recipe_id = ?", (int(recipe_id),)
+        
+        # テーブルからデータをDataFrameとして読み込む
+        # Excelの構造に合わせて列名を調整する（後方互換性のため）
+        
+        # レシピデータ
+        recipes_df = pd.read_sql("SELECT * FROM recipes" + recipe_filter, conn, params=params)
+        # カラム名をMLモデルが期待する形式にリネーム
+        recipes_df = recipes_df.rename(columns={
+            'id': 'Recipe_ID',
+            'title': 'Title',
+            'genre': 'Genre',
+            'prep_time': 'Prep_Time_Min',
+            'cook_time': 'Cook_Time_Min',
+            'servings': 'Servings',
+            'calorie': 'Calorie'
+            # method is not in DB schema yet? let's check schema.sql. 
+            # schema.sql has no 'method' or 'description' in 'recipes' table.
+            # However, there is 'recipe_steps' table.
+            # The original Excel had 'Method_Main'. 
+            # The 'recipe_steps' table has 'description'.
+        })
+        
+        # 材料データ
+        ingredients_df = pd.read_sql("SELECT * FROM recipe_ingredients" + child_filter, conn, params=params)
+        ingredients_df = ingredients_df.rename(columns={
+            'recipe_id': 'Recipe_ID',
+            'name': 'Ingredient_Name_Normalized',
+            'quantity': 'Quantity_Amount',
+            'unit': 'Quantity_Unit',
+            'is_essential': 'Is_Essential'
+        })
+        
+        # 手順データ
+        steps_df = pd.read_sql("SELECT * FROM recipe_steps" + child_filter, conn, params=params)
+        steps_df = steps_df.rename(columns={
+            'recipe_id': 'Recipe_ID',
+            'step_number': 'Step_Number',
+            'description': 'Step_Description'
+        })
+        
+        return recipes_df, ingredients_df, steps_df
 
     def _preprocess_data(self):
         """データの前処理"""
+        self.recipes_df, self.ingredients_df, self.steps_df = self._clean_frames(
+            self.recipes_df, self.ingredients_df, self.steps_df
+        )
+    
+    @staticmethod
+    def _clean_frames(recipes_df: pd.DataFrame, ingredients_df: pd.DataFrame,
+                      steps_df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        """型変換とNaN行の削除"""
         # DBからは適切な型で取得できるため、Excel特有の文字列クリーニングは不要だが
         # 念のため型変換とNaN処理は残しておく
         
         # Recipe_IDを数値型に変換
-        self.ingredients_df['Recipe_ID'] = pd.to_numeric(self.ingredients_df['Recipe_ID'], errors='coerce')
-        self.steps_df['Recipe_ID'] = pd.to_numeric(self.steps_df['Recipe_ID'], errors='coerce')
-        self.recipes_df['Recipe_ID'] = pd.to_numeric(self.recipes_df['Recipe_ID'], errors='coerce')
+        ingredients_df['Recipe_ID'] = pd.to_numeric(ingredients_df['Recipe_ID'], errors='coerce')
+        steps_df['Recipe_ID'] = pd.to_numeric(steps_df['Recipe_ID'], errors='coerce')
+        recipes_df['Recipe_ID'] = pd.to_numeric(recipes_df['Recipe_ID'], errors='coerce')
         
         # NaN行を削除
-        self.ingredients_df = self.ingredients_df.dropna(subset=['Recipe_ID'])
-        self.steps_df = self.steps_df.dropna(subset=['Recipe_ID'])
-        self.recipes_df = self.recipes_df.dropna(subset=['Recipe_ID'])
+        ingredients_df = ingredients_df.dropna(subset=['Recipe_ID'])
+        steps_df = steps_df.dropna(subset=['Recipe_ID'])
+        recipes_df = recipes_df.dropna(subset=['Recipe_ID'])
         
         # 材料名の正規化
-        if 'Ingredient_Name_Normalized' in self.ingredients_df.columns:
-            self.ingredients_df['Ingredient_Normalized'] = (
-                self.ingredients_df['Ingredient_Name_Normalized']
+        if 'Ingredient_Name_Normalized' in ingredients_df.columns:
+            ingredients_df['Ingredient_Normalized'] = (
+                ingredients_df['Ingredient_Name_Normalized']
                 .astype(str)
                 .str.strip()
                 .str.lower()
             )
+        
+        return recipes_df, ingredients_df, steps_df
+    
+    def _build_recipe_index(self):
+        """
+        レシピIDをキーにした索引を構築
+        
+        材料・手順・メタ情報をここで一度だけグループ化しておき、
+        スコア計算や結果の組み立てではDataFrameを走査せずに参照する。
+        """
+        self.recipe_ids, self.recipe_index = self._group_recipes(
+            self.recipes_df, self.ingredients_df, self.steps_df
+        )
+    
+    def _group_recipes(self, recipes_df: pd.DataFrame, ingredients_df: pd.DataFrame,
+                       steps_df: pd.DataFrame) -> Tuple[List, Dict]:
+        """
+        3つのDataFrameをレシピIDごとの索引エントリにまとめる
+        
+        Returns:
+            (レシピIDの並び, {レシピID: 索引エントリ})
+        """
+        # レシピの並び順（推薦時の同点順位もこの順序に従う）
+        recipe_ids = list(recipes_df['Recipe_ID'].unique())
+        
+        # 材料をレシピごとにまとめる
+        has_essential_column = 'Is_Essential' in ingredients_df.columns
+        if has_essential_column:
+            essential_flags = (ingredients_df['Is_Essential'] == True).tolist()
+            optional_flags = (ingredients_df['Is_Essential'] == False).tolist()
+        else:
+            essential_flags = [True] * len(ingredients_df)
+            optional_flags = [False] * len(ingredients_df)
+        
+        ingredient_groups = {}
+        for row, essential, optional in zip(
+            ingredients_df.to_dict('records'), essential_flags, optional_flags
+        ):
+            group = ingredient_groups.setdefault(row['Recipe_ID'], ([], [], [], []))
+            group[0].append(self.normalize_ingredient_name(row.get('Ingredient_Name_Normalized', '')))
+            group[1].append(essential)
+            group[2].append(optional)
+            group[3].append({
+                'name': row.get('Ingredient_Name_Normalized', ''),
+                'quantity': '' if pd.isna(row.get('Quantity_Amount', '')) else str(row.get('Quantity_Amount', '')),
+                'unit': '' if pd.isna(row.get('Quantity_Unit', '')) else str(row.get('Quantity_Unit', '')),
+                'is_essential': row.get('Is_Essential', False)
+            })
+        
+        # 手順をレシピごとにまとめて手順番号順に並べる
+        step_groups = {}
+        for row in steps_df.to_dict('records'):
+            step_groups.setdefault(row['Recipe_ID'], []).append({
+                'step_number': int(row['Step_Number']),
+                'description': str(row['Step_Description'])
+            })
+        
+        # レシピごとの索引（同じIDが複数行ある場合は先頭行のメタ情報を使う）
+        recipe_infos = {}
+        for info in recipes_df.to_dict('records'):
+            recipe_infos.setdefault(info['Recipe_ID'], info)
+        
+        recipe_index = {}
+        for recipe_id in recipe_ids:
+            names, essential, optional, ingredients = ingredient_groups.get(recipe_id, ([], [], [], []))
+            recipe_index[recipe_id] = {
+                'info': recipe_infos[recipe_id],
+                'ingredient_names': tuple(names),
+                'is_essential': tuple(essential),
+                'is_optional': tuple(optional),
+                'essential_count': sum(essential),
+                'ingredients': ingredients,
+                'steps': sorted(step_groups.get(recipe_id, []), key=lambda step: step['step_number'])
+            }
+        
+        return recipe_ids, recipe_index
     
     def _build_feature_vectors(self):
         """レシピの特徴量ベクトルを構築"""
         # 各レシピの材料リストを作成（TF-IDF用）
-        recipe_ingredients = {}
-        for recipe_id in self.recipes_df['Recipe_ID'].unique():
-            ingredients = self.ingredients_df[
-                self.ingredients_df['Recipe_ID'] == recipe_id
-            ]['Ingredient_Name_Normalized'].astype(str).tolist()
-            recipe_ingredients[recipe_id] = ' '.join(ingredients)
+        ingredient_texts = [self._ingredient_text(self.recipe_index[rid]) for rid in self.recipe_ids]
         
         # TF-IDFベクトル化（材料ベースの特徴量）
-        ingredient_texts = [recipe_ingredients.get(rid, '') for rid in self.recipes_df['Recipe_ID'].unique()]
-        self.tfidf_vectorizer = TfidfVectorizer(max_features=100, stop_words=None)
-        self.ingredient_features = self.tfidf_vectorizer.fit_transform(ingredient_texts)
+        vectorizer = TfidfVectorizer(max_features=100, stop_words=None)
+        self.ingredient_features = vectorizer.fit_transform(ingredient_texts)
+        self.tfidf_vectorizer = vectorizer
+        # 語彙の学習以降に変更されたレシピ数
+        self._changes_since_fit = 0
         
         # レシピIDとインデックスのマッピング
+        self._rebuild_id_maps()
+    
+    @staticmethod
+    def _ingredient_text(recipe: Dict) -> str:
+        """TF-IDF用の材料テキスト"""
+        return ' '.join(str(ing['name']) for ing in recipe['ingredients'])
+    
+    def _rebuild_id_maps(self):
+        """レシピIDとインデックスのマッピング"""
         self.recipe_id_to_index = {
-            rid: idx for idx, rid in enumerate(self.recipes_df['Recipe_ID'].unique())
+            rid: idx for idx, rid in enumerate(self.recipe_ids)
         }
         self.index_to_recipe_id = {v: k for k, v in self.recipe_id_to_index.items()}
     
+    def _build_incidence_matrix(self):
+        """
+        レシピ×材料の接続行列を構築（一括スコア計算用）
+        
+        材料名ごとに語彙IDを振り、各レシピの必須・オプション材料を
+        calculate_recipe_score_with_ml と同じ評価順で固定幅の行に並べる（ELL形式の疎行列）。
+        行内の加算順序が逐次計算と一致するため、一括計算でもスコアは完全に同じ値になる。
+        """
+        # 材料語彙は在庫とのマッチング索引と共有する
+        self.ingredient_matcher = IngredientMatcher(
+            name for rid in self.recipe_ids for name in self.recipe_index[rid]['ingredient_names']
+        )
+        self.ingredient_vocabulary = self.ingredient_matcher.vocabulary
+        self.ingredient_vocab_index = self.ingredient_matcher.vocab_index
+        
+        recipe_slots = [self._recipe_slots(self.recipe_index[rid]) for rid in self.recipe_ids]
+        
+        n_recipes = len(recipe_slots)
+        width = max((len(slots) for slots in recipe_slots), default=0)
+        
+        self._slot_vocab = np.full((n_recipes, width), self._slot_sentinel, dtype=np.int32)
+        self._slot_essential = np.zeros((n_recipes, width), dtype=bool)
+        self._slot_optional = np.zeros((n_recipes, width), dtype=bool)
+        for row, slots in enumerate(recipe_slots):
+            self._write_slot_row(row, slots)
+        
+        self._essential_counts = np.array(
+            [self.recipe_index[rid]['essential_count'] for rid in self.recipe_ids], dtype=np.int64
+        )
+        self._has_ingredients = np.array(
+            [bool(self.recipe_index[rid]['ingredient_names']) for rid in self.recipe_ids], dtype=bool
+        )
+        self._reverse_index = None
+        self._essential_index = None
+    
+    def _recipe_slots(self, recipe: Dict) -> List[Tuple[int, bool]]:
+        """レシピのスロット列 [(語彙ID, 必須か)]（必須食材 → オプション食材の順）"""
+        names = recipe['ingredient_names']
+        for name in names:
+            self.ingredient_matcher.add_term(name)
+        
+        # スコア計算のループ順と同じ並び
+        slots = [(self.ingredient_vocab_index[name], True)
+                 for name, flag in zip(names, recipe['is_essential']) if flag]
+        slots += [(self.ingredient_vocab_index[name], False)
+                  for name, flag in zip(names, recipe['is_optional']) if flag]
+        return slots
+    
+    def _write_slot_row(self, row: int, slots: List[Tuple[int, bool]]):
+        """接続行列の1行を書き換える（幅が足りなければ広げる）"""
+        width = self._slot_vocab.shape[1]
+        if len(slots) > width:
+            extra = ((0, 0), (0, len(slots) - width))
+            self._slot_vocab = np.pad(self._slot_vocab, extra, constant_values=self._slot_sentinel)
+            self._slot_essential = np.pad(self._slot_essential, extra)
+            self._slot_optional = np.pad(self._slot_optional, extra)
+        
+        self._slot_vocab[row] = self._slot_sentinel
+        self._slot_essential[row] = False
+        self._slot_optional[row] = False
+        for col, (vocab_id, essential) in enumerate(slots):
+            self._slot_vocab[row, col] = vocab_id
+            self._slot_essential[row, col] = essential
+            self._slot_optional[row, col] = not essential
+    
+    def upsert_recipe(self, recipe_id: int):
+        """
+        1件のレシピをDBから読み直して推薦モデルに反映する（追加・更新の両方）
+        
+        索引・TF-IDF特徴量の行・接続行列の行だけを差し替える。
+        TF-IDFの語彙は、新しい材料語が語彙に入るはずの場合か、
+        変更件数が refit_threshold を超えた場合にだけ学習し直す。
+        
+        Args:
+            recipe_id: recipes.id
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            frames = self._read_recipe_tables(conn, recipe_id)
+        finally:
+            conn.close()
+        
+        recipe_ids, entries = self._group_recipes(*self._clean_frames(*frames))
+        if not recipe_ids:
+            # DBに存在しない（削除済み）
+            self.remove_recipe(recipe_id)
+            return
+        
+        recipe_id = recipe_ids[0]
+        recipe = entries[recipe_id]
+        self.discard_snapshot()
+        
+        with self._lock:
+            row_features = self.tfidf_vectorizer.transform([self._ingredient_text(recipe)])
+            idx = self.recipe_id_to_index.get(recipe_id)
+            
+            if idx is None:
+                # 新規レシピは末尾に追加
+                idx = len(self.recipe_ids)
+                self.recipe_ids.append(recipe_id)
+                self.ingredient_features = sp.vstack(
+                    [self.ingredient_features, row_features], format='csr'
+                )
+                self._slot_vocab = np.vstack([
+                    self._slot_vocab,
+                    np.full((1, self._slot_vocab.shape[1]), self._slot_sentinel, dtype=np.int32)
+                ])
+                self._slot_essential = np.vstack([self._slot_essential, np.zeros((1, self._slot_essential.shape[1]), dtype=bool)])
+                self._slot_optional = np.vstack([self._slot_optional, np.zeros((1, self._slot_optional.shape[1]), dtype=bool)])
+                self._essential_counts = np.append(self._essential_counts, 0)
+                self._has_ingredients = np.append(self._has_ingredients, False)
+                self.recipe_id_to_index[recipe_id] = idx
+                self.index_to_recipe_id[idx] = recipe_id
+            else:
+                self.ingredient_features = sp.vstack(
+                    [self.ingredient_features[:idx], row_features, self.ingredient_features[idx + 1:]],
+                    format='csr'
+                )
+            
+            self.recipe_index[recipe_id] = recipe
+            self._write_slot_row(idx, self._recipe_slots(recipe))
+            self._essential_counts[idx] = recipe['essential_count']
+            self._has_ingredients[idx] = bool(recipe['ingredient_names'])
+            self._reverse_index = None
+            self._essential_index = None
+            self._preference_factors = None
+            
+            self._changes_since_fit += 1
+            if self._vocabulary_outdated(recipe):
+                self._refit_feature_vectors()
+    
+    def remove_recipe(self, recipe_id: int):
+        """
+        レシピを推薦モデルから取り除く
+        
+        Args:
+            recipe_id: recipes.id
+        """
+        self.discard_snapshot()
+        with self._lock:
+            idx = self.recipe_id_to_index.get(recipe_id)
+            if idx is None:
+                return
+            
+            keep = np.ones(len(self.recipe_ids), dtype=bool)
+            keep[idx] = False
+            
+            del self.recipe_index[self.recipe_ids[idx]]
+            del self.recipe_ids[idx]
+            self.ingredient_features = self.ingredient_features[keep]
+            self._slot_vocab = self._slot_vocab[keep]
+            self._slot_essential = self._slot_essential[keep]
+            self._slot_optional = self._slot_optional[keep]
+            self._essential_counts = self._essential_counts[keep]
+            self._has_ingredients = self._has_ingredients[keep]
+            self._reverse_index = None
+            self._essential_index = None
+            self._preference_factors = None
+            self._rebuild_id_maps()
+            
+            self._changes_since_fit += 1
+            if self._vocabulary_outdated():
+                self._refit_feature_vectors()
+    
+    def _refit_feature_vectors(self):
+        """現在の索引からTF-IDFの語彙と特徴量を学習し直す（DBは読まない）"""
+        try:
+            self._build_feature_vectors()
+        except ValueError:
+            # 材料語が1つも残らない場合は既存の語彙のまま使う
+            self._changes_since_fit = 0
+    
+    def _vocabulary_outdated(self, recipe: Dict = None) -> bool:
+        """TF-IDFの語彙を学習し直すべきか"""
+        if self._changes_since_fit > self.refit_threshold * max(len(self.recipe_ids), 1):
+            return True
+        
+        # 語彙に空きがあるのに未知の材料語が入ってきた場合は、学習し直せば語彙が変わる
+        if recipe is not None:
+            vocabulary = self.tfidf_vectorizer.vocabulary_
+            if len(vocabulary) < self.tfidf_vectorizer.max_features:
+                analyzer = self.tfidf_vectorizer.build_analyzer()
+                return any(token not in vocabulary for token in analyzer(self._ingredient_text(recipe)))
+        
+        return False
+    
+    @staticmethod
+    def _read_feedback_summary(conn, recipe_id: int = None) -> Dict:
+        """
+        フィードバック集計を読み込む（集計テーブルがない古いDBでは空）
+        
+        Returns:
+            {レシピID: {'rating_count', 'rating_mean', 'made_count', 'last_made'}}
+        """
+        query = FEEDBACK_SUMMARY_QUERY
+        params = ()
+        if recipe_id is not None:
+            query += " WHERE recipe_id = ?"
+            params = (recipe_id,)
+        try:
+            rows = conn.execute(query, params).fetchall()
+        except sqlite3.OperationalError:
+            return {}
+        
+        summary = {}
+        for recipe_id, rating_count, rating_sum, made_count, last_made_at in rows:
+            try:
+                last_made = datetime.fromisoformat(str(last_made_at)).date() if last_made_at else None
+            except ValueError:
+                last_made = None
+            summary[recipe_id] = {
+                'rating_count': rating_count,
+                'rating_mean': rating_sum / rating_count if rating_count else None,
+                'made_count': made_count,
+                'last_made': last_made,
+            }
+        return summary
+    
+    def refresh_feedback(self, recipe_id: int = None):
+        """
+        フィードバック集計をDBから読み直す（/feedback で記録した後に呼ぶ）
+        
+        Args:
+            recipe_id: recipes.id（省略時は全レシピ分。他のプロセスが記録した場合）
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            summary = self._read_feedback_summary(conn, None if recipe_id is None else int(recipe_id))
+        finally:
+            conn.close()
+        
+        with self._lock:
+            if recipe_id is None:
+                self.feedback_summary = summary
+            else:
+                self.feedback_summary.pop(int(recipe_id), None)
+                self.feedback_summary.update(summary)
+            self._preference_factors = None
+    
+    def preference_factor(self, recipe_id, today: date = None) -> float:
+        """
+        フィードバックによる好み補正の倍率（フィードバックがなければ1）
+        
+        評価の平均が高いほど上げ、最近「作った」料理ほど下げる（同じ料理が続かないように）。
+        """
+        summary = self.feedback_summary.get(recipe_id)
+        if summary is None:
+            return 1.0
+        weights = self.preference_weights
+        factor = 1.0
+        
+        if summary['rating_count']:
+            confidence = summary['rating_count'] / (summary['rating_count'] + weights['rating_prior'])
+            factor += weights['rating'] * (summary['rating_mean'] - 3.0) / 2.0 * confidence
+        
+        if summary['last_made'] is not None and weights['recency_days'] > 0:
+            days_since = ((today or date.today()) - summary['last_made']).days
+            if days_since < weights['recency_days']:
+                factor -= weights['recency'] * (1.0 - max(days_since, 0) / weights['recency_days'])
+        
+        return max(factor, 0.0)
+    
+    def preference_factors(self):
+        """
+        レシピ行ごとの好み補正の倍率（self.recipe_ids の順、フィードバックが1件もなければ None）
+        
+        日付とフィードバック・カタログが変わるまで使い回す。
+        """
+        if not self.feedback_summary:
+            return None
+        today = date.today()
+        cached = self._preference_factors
+        if cached is not None and cached[0] == today:
+            return cached[1]
+        
+        factors = np.ones(len(self.recipe_ids))
+        for recipe_id in self.feedback_summary:
+            row = self.recipe_id_to_index.get(recipe_id)
+            if row is not None:
+                factors[row] = self.preference_factor(recipe_id, today)
+        self._preference_factors = (today, factors)
+        return factors
+    
+    @staticmethod
+    def expiry_tier_score(days_until_expiry: int) -> float:
+        """賞味期限までの日数に応じた基本スコア（期限切れ・間近ほど高い）"""
+        if days_until_expiry < 0:
+            return 200.0
+        elif days_until_expiry <= 1:
+            return 150.0
+        elif days_until_expiry <= 3:
+            return 120.0
+        elif days_until_expiry <= 7:
+            return 80.0
+        return 30.0
+    
+    @timed('inventory_features')
     def extract_inventory_features(self, inventory_items: List[Dict]) -> Dict:
         """
         在庫アイテムから特徴量を抽出
@@ -141,23 +922,13 @@ class MLRecipeRecommender:
                 continue
             
             try:
-                expiry_date = datetime.strptime(expiry_date_str, '%Y-%m-%d').date()
+                expiry_date = _parse_expiry_date(expiry_date_str)
                 days_until_expiry = (expiry_date - today).days
                 
                 # 期限に基づくスコア
-                if days_until_expiry < 0:
-                    score = 200.0
+                score = self.expiry_tier_score(days_until_expiry)
+                if days_until_expiry <= 3:
                     expiring_count += 1
-                elif days_until_expiry <= 1:
-                    score = 150.0
-                    expiring_count += 1
-                elif days_until_expiry <= 3:
-                    score = 120.0
-                    expiring_count += 1
-                elif days_until_expiry <= 7:
-                    score = 80.0
-                else:
-                    score = 30.0
                 
                 score *= (1 + min(quantity / 10, 1))
                 
@@ -186,6 +957,7 @@ class MLRecipeRecommender:
             return ""
         return str(name).strip().lower()
     
+    @_synchronized
     def calculate_recipe_score_with_ml(self, recipe_id: int, inventory_features: Dict) -> Tuple[float, Dict]:
         """
         機械学習ベースのスコア計算
@@ -197,15 +969,12 @@ class MLRecipeRecommender:
         Returns:
             (総合スコア, 詳細情報)
         """
-        recipe_ingredients = self.ingredients_df[
-            self.ingredients_df['Recipe_ID'] == recipe_id
-        ]
+        recipe = self.recipe_index.get(recipe_id)
         
-        if recipe_ingredients.empty:
+        if recipe is None or not recipe['ingredient_names']:
             return 0.0, {}
         
         # 特徴量1: 食材のTF-IDF類似度
-        recipe_text = ' '.join(recipe_ingredients['Ingredient_Name_Normalized'].astype(str).tolist())
         inventory_text = inventory_features['ingredient_text']
         
         if recipe_id in self.recipe_id_to_index:
@@ -220,73 +989,56 @@ class MLRecipeRecommender:
         else:
             similarity = 0.0
         
+        matches = self.ingredient_matcher.resolve(inventory_features['ingredient_scores'])
+        return self._score_recipe_details(recipe, similarity, matches)
+    
+    def _score_recipe_details(self, recipe: Dict, similarity: float, matches: Tuple[Dict, Dict]) -> Tuple[float, Dict]:
+        """
+        1レシピ分の食材マッチングを行い、総合スコアと詳細情報を返す
+        
+        Args:
+            recipe: recipe_index のエントリ
+            similarity: レシピと在庫のTF-IDF類似度
+            matches: IngredientMatcher.resolve の結果（必須用, オプション用）
+        """
         # 特徴量2: 期限が近い食材のマッチングスコア
-        ingredient_scores = inventory_features['ingredient_scores']
+        essential_matches, optional_matches = matches
         matched_essential = []
         matched_optional = []
         expiry_score = 0.0
         
-        if 'Is_Essential' in recipe_ingredients.columns:
-            essential_ingredients = recipe_ingredients[
-                recipe_ingredients['Is_Essential'] == True
-            ]
-            optional_ingredients = recipe_ingredients[
-                recipe_ingredients['Is_Essential'] == False
-            ]
-        else:
-            essential_ingredients = recipe_ingredients
-            optional_ingredients = pd.DataFrame()
+        names = recipe['ingredient_names']
+        essential_names = [name for name, flag in zip(names, recipe['is_essential']) if flag]
+        optional_names = [name for name, flag in zip(names, recipe['is_optional']) if flag]
         
         # 必須食材のチェック
-        for _, row in essential_ingredients.iterrows():
-            ingredient_name = self.normalize_ingredient_name(
-                row.get('Ingredient_Name_Normalized', '')
-            )
-            
-            matched = False
-            matched_score = 0.0
-            best_match = None
-            
-            for inv_name, inv_score in ingredient_scores.items():
-                if ingredient_name == inv_name:
-                    matched = True
-                    matched_score = inv_score
-                    best_match = inv_name
-                    break
-                elif ingredient_name in inv_name or inv_name in ingredient_name:
-                    if not matched or inv_score > matched_score:
-                        matched = True
-                        matched_score = inv_score
-                        best_match = inv_name
-            
-            if matched and best_match:
+        for ingredient_name in essential_names:
+            match = essential_matches.get(self.ingredient_vocab_index[ingredient_name])
+            if match:
+                inv_name, inv_score = match
                 matched_essential.append({
                     'name': ingredient_name,
-                    'inventory_name': best_match,
-                    'score': matched_score
+                    'inventory_name': inv_name,
+                    'score': inv_score
                 })
-                expiry_score += matched_score * 2.0
+                expiry_score += inv_score * 2.0
             else:
                 expiry_score -= 50.0
         
         # オプション食材のチェック
-        for _, row in optional_ingredients.iterrows():
-            ingredient_name = self.normalize_ingredient_name(
-                row.get('Ingredient_Name_Normalized', '')
-            )
-            
-            for inv_name, inv_score in ingredient_scores.items():
-                if ingredient_name == inv_name or ingredient_name in inv_name or inv_name in ingredient_name:
-                    matched_optional.append({
-                        'name': ingredient_name,
-                        'inventory_name': inv_name,
-                        'score': inv_score
-                    })
-                    expiry_score += inv_score * 0.5
-                    break
+        for ingredient_name in optional_names:
+            match = optional_matches.get(self.ingredient_vocab_index[ingredient_name])
+            if match:
+                inv_name, inv_score = match
+                matched_optional.append({
+                    'name': ingredient_name,
+                    'inventory_name': inv_name,
+                    'score': inv_score
+                })
+                expiry_score += inv_score * 0.5
         
         # 特徴量3: 必須食材のマッチ率(充足率計算)
-        essential_match_rate = len(matched_essential) / max(len(essential_ingredients), 1)
+        essential_match_rate = len(matched_essential) / max(recipe['essential_count'], 1)
         
         # 総合スコア計算（特徴量の重み付け）
         # TF-IDF類似度: 40%、期限スコア: 50%、マッチ率: 10%
@@ -298,6 +1050,13 @@ class MLRecipeRecommender:
         
         # マッチ率で最終調整
         final_score *= essential_match_rate
+        if essential_match_rate < self.min_essential_coverage:
+            final_score = 0.0
+        
+        # 特徴量4: フィードバックによる好み補正（評価・最近作ったか）
+        preference = self.preference_factor(recipe['info'].get('Recipe_ID'))
+        if preference != 1.0:
+            final_score *= preference
         
         return final_score, {
             'similarity': similarity,
@@ -306,10 +1065,12 @@ class MLRecipeRecommender:
             'essential_match_rate': essential_match_rate,  # テンプレート互換性のため
             'matched_essential': matched_essential,
             'matched_optional': matched_optional,
-            'total_ingredients': len(recipe_ingredients),
-            'matched_count': len(matched_essential) + len(matched_optional)
+            'total_ingredients': len(names),
+            'matched_count': len(matched_essential) + len(matched_optional),
+            'preference': preference
         }
     
+    @_synchronized
     def recommend_recipes(self, inventory_items: List[Dict], top_n: int = 5) -> List[Dict]:
         """
         機械学習ベースのレシピ推薦
@@ -327,160 +1088,285 @@ class MLRecipeRecommender:
         if not inventory_features['ingredient_scores']:
             return []
         
-        # 各レシピのスコアを計算
+        # 全レシピのスコアを一括計算
+        matches = self.ingredient_matcher.resolve(inventory_features['ingredient_scores'])
+        scores, similarities = self.calculate_recipe_scores_batch(inventory_features, matches)
+        
+        # 上位のレシピだけ詳細情報を組み立てる
         recipe_scores = []
+        with span('results'):
+            for idx in self.rank_scores(scores, top_n):
+                recipe_id = self.recipe_ids[idx]
+                score, details = self._score_recipe_details(self.recipe_index[recipe_id], similarities[idx], matches)
+                recipe_scores.append(self._build_recipe_result(recipe_id, score, details))
         
-        for recipe_id in self.recipes_df['Recipe_ID'].unique():
-            score, details = self.calculate_recipe_score_with_ml(recipe_id, inventory_features)
-            
-            if score > 0:
-                recipe_info = self.recipes_df[
-                    self.recipes_df['Recipe_ID'] == recipe_id
-                ].iloc[0].to_dict()
-                
-                # 調理手順を取得
-                steps = self.steps_df[
-                    self.steps_df['Recipe_ID'] == recipe_id
-                ].sort_values('Step_Number')
-                
-                # 材料を取得
-                ingredients = self.ingredients_df[
-                    self.ingredients_df['Recipe_ID'] == recipe_id
-                ]
-                
-                recipe_scores.append({
-                    'recipe_id': int(recipe_id),
-                    'title': recipe_info.get('Title', ''),
-                    'genre': recipe_info.get('Genre', ''),
-                    'prep_time': recipe_info.get('Prep_Time_Min', ''),
-                    'cook_time': recipe_info.get('Cook_Time_Min', ''),
-                    'total_time': recipe_info.get('Total_Time_Min', ''),
-                    'servings': recipe_info.get('Servings', ''),
-                    'calorie': recipe_info.get('Calorie', ''),
-                    'method': recipe_info.get('Method_Main', ''),
-                    'score': score,
-                    'match_details': details,
-                    'steps': [
-                        {
-                            'step_number': int(row['Step_Number']),
-                            'description': str(row['Step_Description'])
-                        }
-                        for _, row in steps.iterrows()
-                    ],
-                    'ingredients': [
-                        {
-                            'name': row.get('Ingredient_Name_Normalized', ''),
-                            'quantity': '' if pd.isna(row.get('Quantity_Amount', '')) else str(row.get('Quantity_Amount', '')),
-                            'unit': '' if pd.isna(row.get('Quantity_Unit', '')) else str(row.get('Quantity_Unit', '')),
-                            'is_essential': row.get('Is_Essential', False)
-                        }
-                        for _, row in ingredients.iterrows()
-                    ]
-                })
+        return recipe_scores
+    
+    @_synchronized
+    @timed('scoring')
+    def calculate_recipe_scores_batch(self, inventory_features: Dict, matches: Tuple[Dict, Dict] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        全レシピのスコアを一括で計算する（calculate_recipe_score_with_ml と同じ値）
+        
+        在庫の必須食材を使うレシピを逆引き索引で候補に絞り（candidate_rows）、候補の行だけを計算する。
+        在庫のTF-IDF変換は1回だけ行い、類似度は候補の特徴量行列との疎行列積で求める。
+        必須・オプション食材のマッチ数と期限スコアは接続行列を使ってまとめて集計する。
+        
+        Args:
+            inventory_features: 在庫の特徴量
+            matches: IngredientMatcher.resolve の結果（省略時はここで求める）
+        
+        Returns:
+            (スコア配列, TF-IDF類似度配列) いずれも self.recipe_ids の順
+            （候補にならなかったレシピのスコアは0。類似度は候補だけを計算した場合は0）
+        """
+        if matches is None:
+            matches = self.ingredient_matcher.resolve(inventory_features['ingredient_scores'])
+        vocab_matches = self._match_vocabulary(matches)
+        
+        # 在庫にある必須食材を使うレシピだけを計算する（それ以外は必須食材のマッチ率が0なのでスコアも0）
+        rows = self.candidate_rows(vocab_matches[0])
+        final_scores = np.zeros(len(self.recipe_ids))
+        similarities = np.zeros(len(self.recipe_ids))
+        if len(rows) == 0:
+            return final_scores, similarities
+        preference = self.preference_factors()
         
-        # スコアでソート（降順）
-        recipe_scores.sort(key=lambda x: x['score'], reverse=True)
+        if len(rows) > self._dense_candidate_ratio * len(self.recipe_ids):
+            # 在庫が多く候補がカタログの大半を占める場合は全レシピを計算する
+            # （候補以外は必須食材のマッチ率が0なので、スコアは同じく0になる）
+            similarities = self.tfidf_similarities(inventory_features['ingredient_text'])
+            expiry_scores, essential_match_rates = self._slot_totals(vocab_matches)
+            final_scores = self._combine_scores(similarities, expiry_scores, essential_match_rates,
+                                                self._has_ingredients, preference, self.min_essential_coverage)
+            return final_scores, similarities
         
-        return recipe_scores[:top_n]
+        # 特徴量1: 食材のTF-IDF類似度（候補の行だけを1回の疎行列積で計算）
+        similarities[rows] = self.tfidf_similarities(inventory_features['ingredient_text'], rows)
+        
+        # 特徴量2・3: 語彙ごとのマッチ結果をスロットに展開して期限スコアとマッチ率を集計
+        expiry_scores, essential_match_rates = self._slot_totals(vocab_matches, rows)
+        
+        final_scores[rows] = self._combine_scores(
+            similarities[rows], expiry_scores, essential_match_rates, self._has_ingredients[rows],
+            preference[rows] if preference is not None else None, self.min_essential_coverage
+        )
+        
+        return final_scores, similarities
+    
+    def tfidf_similarities(self, inventory_text: str, rows: np.ndarray = None) -> np.ndarray:
+        """
+        在庫テキストと全レシピ（rows 指定時はその行だけ）のTF-IDFコサイン類似度
+        
+        cosine_similarity と同じ計算（行を正規化してから内積）で、
+        レシピ側の正規化済み行列は特徴量が変わるまで使い回す。
+        """
+        cached = self._normalized_features
+        if cached is None or cached[0] is not self.ingredient_features:
+            cached = (self.ingredient_features, normalize(self.ingredient_features, copy=True))
+            self._normalized_features = cached
+        
+        normalized = cached[1] if rows is None else cached[1][rows]
+        inventory_tfidf = normalize(self.tfidf_vectorizer.transform([inventory_text]), copy=True)
+        return (normalized @ inventory_tfidf.T).toarray()[:, 0]
+    
+    def _slot_totals(self, vocab_matches: Tuple[np.ndarray, ...], rows: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        接続行列から期限スコアと必須食材のマッチ率を求める
+        
+        Args:
+            vocab_matches: _match_vocabulary の結果
+            rows: 計算するレシピの行（省略時は全レシピ）
+        
+        Returns:
+            (期限スコア配列, 必須食材マッチ率配列)
+        """
+        essential_matched, essential_scores, optional_matched, optional_scores = vocab_matches
+        if rows is None:
+            slot_vocab, slot_essential, slot_optional = self._slot_vocab, self._slot_essential, self._slot_optional
+            essential_counts = self._essential_counts
+        else:
+            slot_vocab, slot_essential, slot_optional = self._slot_vocab[rows], self._slot_essential[rows], self._slot_optional[rows]
+            essential_counts = self._essential_counts[rows]
+        
+        slot_essential_matched = slot_essential & essential_matched[slot_vocab]
+        contributions = np.where(
+            slot_essential,
+            np.where(essential_matched[slot_vocab], essential_scores[slot_vocab] * 2.0, -50.0),
+            np.where(slot_optional & optional_matched[slot_vocab], optional_scores[slot_vocab] * 0.5, 0.0)
+        )
+        
+        # 逐次計算と同じ順序で列ごとに加算する（浮動小数点の丸めを一致させるため）
+        expiry_scores = np.zeros(len(slot_vocab))
+        for col in range(contributions.shape[1]):
+            expiry_scores = expiry_scores + contributions[:, col]
+        
+        # 特徴量3: 必須食材のマッチ率
+        essential_match_rates = slot_essential_matched.sum(axis=1) / np.maximum(essential_counts, 1)
+        
+        return expiry_scores, essential_match_rates
+    
+    @staticmethod
+    def _combine_scores(similarities: np.ndarray, expiry_scores: np.ndarray,
+                        essential_match_rates: np.ndarray, has_ingredients: np.ndarray,
+                        preference: np.ndarray = None, min_coverage: float = 0.0) -> np.ndarray:
+        """
+        特徴量を重み付けして総合スコアにする（calculate_recipe_score_with_ml と同じ式）
+        
+        preference: preference_factors() の倍率（None なら補正なし）
+        min_coverage: 必須食材のマッチ率がこれ未満のレシピは0にする
+        """
+        # TF-IDF類似度: 40%、期限スコア: 50%、マッチ率: 10%
+        final_scores = (
+            similarities * 100 * 0.4 +
+            expiry_scores * 0.5 +
+            essential_match_rates * 100 * 0.1
+        )
+        # マッチ率で最終調整
+        final_scores *= essential_match_rates
+        if preference is not None:
+            final_scores *= preference
+        final_scores[~has_ingredients] = 0.0
+        if min_coverage > 0:
+            final_scores[essential_match_rates < min_coverage] = 0.0
+        return final_scores
+    
+    @staticmethod
+    def rank_scores(scores: np.ndarray, top_n: int) -> np.ndarray:
+        """
+        スコアが正の行をスコア降順に最大top_n件返す（同点はレシピの並び順を維持）
+        
+        全件を並べ替えず、上位top_n件の境界値以上の行だけを安定ソートする。
+        """
+        positive = np.flatnonzero(scores > 0)
+        if len(positive) > top_n:
+            boundary = len(positive) - top_n
+            threshold = np.partition(scores[positive], boundary)[boundary]
+            positive = positive[scores[positive] >= threshold]
+        return positive[np.argsort(-scores[positive], kind='stable')][:top_n]
+    
+    def vocab_recipe_index(self) -> sp.csr_matrix:
+        """
+        材料語彙 → レシピ行の逆引き索引（語彙数+1 × レシピ数、末尾は番兵）
+        
+        接続行列から必要になった時点で作り、レシピの追加・削除で作り直す。
+        """
+        if self._reverse_index is None:
+            rows, cols = np.nonzero(self._slot_essential | self._slot_optional)
+            vocab_ids = self._slot_vocab[rows, cols]
+            self._reverse_index = sp.csr_matrix(
+                (np.ones(len(rows), dtype=bool), (vocab_ids, rows)),
+                shape=(len(self.ingredient_vocabulary) + 1, len(self.recipe_ids))
+            )
+        return self._reverse_index
+    
+    def essential_recipe_index(self) -> sp.csr_matrix:
+        """
+        必須食材の語彙 → レシピ行の逆引き索引（語彙数+1 × レシピ数、値はそのレシピの必須スロット数）
+        
+        モデルの構築・読み込み時に作り、レシピの追加・削除の後は次に必要になった時点で作り直す。
+        """
+        if self._essential_index is None:
+            rows, cols = np.nonzero(self._slot_essential)
+            vocab_ids = self._slot_vocab[rows, cols]
+            # 同じ語彙の重複するスロットは合計される
+            self._essential_index = sp.csr_matrix(
+                (np.ones(len(rows), dtype=np.int64), (vocab_ids, rows)),
+                shape=(len(self.ingredient_vocabulary) + 1, len(self.recipe_ids))
+            )
+        return self._essential_index
+    
+    def candidate_rows(self, essential_matched: np.ndarray) -> np.ndarray:
+        """
+        スコアを計算する候補のレシピ行（昇順）
+        
+        在庫にマッチした必須食材の語彙から逆引き索引で引くため、計算量はカタログの大きさではなく
+        在庫の食材を使うレシピの数で決まる。候補以外は必須食材のマッチ率が0（または
+        min_essential_coverage 未満）なので総合スコアは0になる。
+        
+        Args:
+            essential_matched: _match_vocabulary の必須マッチ有無（語彙ごと）
+        """
+        matched = self.essential_recipe_index()[np.flatnonzero(essential_matched)]
+        if self.min_essential_coverage > 0:
+            matched_slots = np.bincount(matched.indices, weights=matched.data, minlength=len(self.recipe_ids))
+            rates = matched_slots / np.maximum(self._essential_counts, 1)
+            return np.flatnonzero((matched_slots > 0) & (rates >= self.min_essential_coverage))
+        hit = np.zeros(len(self.recipe_ids), dtype=bool)
+        hit[matched.indices] = True
+        return np.flatnonzero(hit)
+    
+    def _match_vocabulary(self, matches: Tuple[Dict, Dict]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        語彙ごとのマッチ結果を接続行列で引ける配列に変換する
+        
+        Returns:
+            (必須マッチ有無, 必須スコア, オプションマッチ有無, オプションスコア)
+            いずれも語彙数+1（末尾は番兵）の配列
+        """
+        size = len(self.ingredient_vocabulary) + 1
+        essential_matched = np.zeros(size, dtype=bool)
+        essential_scores = np.zeros(size)
+        optional_matched = np.zeros(size, dtype=bool)
+        optional_scores = np.zeros(size)
+        
+        essential_matches, optional_matches = matches
+        for vocab_id, (_, inv_score) in essential_matches.items():
+            essential_matched[vocab_id] = True
+            essential_scores[vocab_id] = inv_score
+        for vocab_id, (_, inv_score) in optional_matches.items():
+            optional_matched[vocab_id] = True
+            optional_scores[vocab_id] = inv_score
+        
+        return essential_matched, essential_scores, optional_matched, optional_scores
+    
+    def _build_recipe_result(self, recipe_id, score: float, details: Dict) -> Dict:
+        """索引からテンプレート表示用のレシピ情報を組み立てる"""
+        recipe = self.recipe_index[recipe_id]
+        recipe_info = recipe['info']
+        
+        return {
+            'recipe_id': int(recipe_id),
+            'title': recipe_info.get('Title', ''),
+            'genre': recipe_info.get('Genre', ''),
+            'prep_time': recipe_info.get('Prep_Time_Min', ''),
+            'cook_time': recipe_info.get('Cook_Time_Min', ''),
+            'total_time': recipe_info.get('Total_Time_Min', ''),
+            'servings': recipe_info.get('Servings', ''),
+            'calorie': recipe_info.get('Calorie', ''),
+            'method': recipe_info.get('Method_Main', ''),
+            'score': score,
+            'match_details': details,
+            'steps': [dict(step) for step in recipe['steps']],
+            'ingredients': [dict(ing) for ing in recipe['ingredients']]
+        }
 
-    def recommend_daily_menu(self, inventory_items: List[Dict], days: int = 5) -> List[Dict]:
+    @_synchronized
+    @timed('menu_plan')
+    def recommend_daily_menu(self, inventory_items: List[Dict], days: int = 5,
+                             strategy: str = 'greedy', time_budget_ms: float = None) -> List[Dict]:
         """
         5日分の献立を提案する。
         各日の料理で使用した食材を在庫から減算し、翌日の提案に反映させる。
         
+        strategy='greedy': 日ごとにその時点で最もスコアの高い料理を選ぶ
+            （カタログ全体のスコア計算は1回だけ行い、翌日以降は在庫の変化に関係する
+            レシピだけを再計算する。menu_planner.GreedyMenuPlanner）
+        strategy='beam': 期間全体で期限の近い食材を使い切るようにビームサーチで選ぶ
+            （menu_planner.BeamMenuPlanner）
+        
         Args:
             inventory_items: 初期の在庫アイテムリスト
             days: 提案する日数
+            strategy: 'greedy' または 'beam'
+            time_budget_ms: beam の探索時間の上限（ミリ秒、省略時は既定値）
             
         Returns:
             各日の献立リスト（日ごとの辞書リスト）
         """
-        import copy
-        
-        # 在庫のシミュレーション用コピーを作成
-        current_inventory = copy.deepcopy(inventory_items)
-        daily_menus = []
-        used_recipe_ids = set()
-        
-        for day in range(1, days + 1):
-            # 現在の在庫でレシピを推薦
-            # 候補を多めに取得して、選ばれていないものを探す
-            recommendations = self.recommend_recipes(current_inventory, top_n=50)
-            
-            # 既に選ばれたレシピを除外
-            candidates = [r for r in recommendations if r['recipe_id'] not in used_recipe_ids]
-            
-            day_menu = {
-                'day': day,
-                'main_dish': None,
-                'side_dish': None
-            }
-            
-            # 主菜と副菜を選ぶ
-            # 注: recommend_recipesの結果には 'genre' が含まれている前提
-            # ExcelのGenre値: '主菜', '副菜' など
-            
-            # 主菜の選定
-            for r in candidates:
-                genre = str(r.get('genre', '')).strip()
-                if (genre.startswith('主') or genre == 'Main') and r['recipe_id'] not in used_recipe_ids:
-                    day_menu['main_dish'] = r
-                    used_recipe_ids.add(r['recipe_id'])
-                    break
-            
-            # 副菜の選定
-            for r in candidates:
-                genre = str(r.get('genre', '')).strip()
-                if (genre.startswith('副') or genre == 'Side') and r['recipe_id'] not in used_recipe_ids:
-                    day_menu['side_dish'] = r
-                    used_recipe_ids.add(r['recipe_id'])
-                    break
-            
-            # メニューが決まらなかった場合のフォールバック（ジャンル不問でスコア高いもの）
-            if not day_menu['main_dish'] and candidates:
-                 for r in candidates:
-                    if r['recipe_id'] not in used_recipe_ids:
-                        day_menu['main_dish'] = r
-                        used_recipe_ids.add(r['recipe_id'])
-                        break
-                        
-            # それでも決まらなければこの日はスキップ（ありえないはずだが）
-            if not day_menu['main_dish']:
-                continue
-                
-            daily_menus.append(day_menu)
-            
-            # 食材の消費シミュレーション
-            dishes_to_cook = []
-            if day_menu['main_dish']: dishes_to_cook.append(day_menu['main_dish'])
-            if day_menu['side_dish']: dishes_to_cook.append(day_menu['side_dish'])
-            
-            for dish in dishes_to_cook:
-                # レシピに必要な食材を取得（recommend_recipesの戻り値に含まれている）
-                ingredients = dish.get('ingredients', [])
-                
-                for ing in ingredients:
-                    ing_name = self.normalize_ingredient_name(ing['name'])
-                    
-                    # 在庫から該当する食材を探して減らす
-                    # 簡易的に、名前がマッチする在庫を1つ減らす
-                    for item in current_inventory:
-                        inv_name = self.normalize_ingredient_name(item['name'])
-                        if ing_name == inv_name or ing_name in inv_name or inv_name in ing_name:
-                            # 数量を減らす（単位変換は難しいため、1単位減らすとする）
-                            # もし数量が数値でなければ無視
-                            try:
-                                qty = float(item['quantity'])
-                                if qty > 0:
-                                    item['quantity'] = qty - 1
-                            except (ValueError, TypeError):
-                                pass
-                            break
-            
-            # 数量が0以下になった在庫は、次の日の推薦計算では使われないようにする
-            # (extract_inventory_features で quantity <= 0 はスキップされるため、リストから削除しなくてもOKだが、
-            #  念のため削除しておくと計算が速い)
-            current_inventory = [item for item in current_inventory if item.get('quantity', 0) > 0]
-            
-        return daily_menus
-
+        if strategy == 'beam':
+            planner = BeamMenuPlanner(self) if time_budget_ms is None else BeamMenuPlanner(self, time_budget_ms=time_budget_ms)
+            return planner.plan(inventory_items, days)
+        if strategy != 'greedy':
+            raise ValueError(f"未知の献立作成方法です: {strategy}")
+        return GreedyMenuPlanner(self).plan(inventory_items, days)
@@ -0,0 +1,102 @@
+import hashlib
+import io
+import socket
+import threading
+import time
+
+import qrcode
+
+
+def get_local_ip():
+    """ローカルネットワークのIPアドレスを取得"""
+    try:
+        # 外部サーバーに接続せずにローカルIPを取得（実際には接続しない）
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.connect(("8.8.8.8", 80))  # 実際には接続しない、ローカルIPを取得するため
+        ip = s.getsockname()[0]
+        s.close()
+        return ip
+    except Exception:
+        try:
+            # フォールバック: ホスト名から取得
+            hostname = socket.gethostname()
+            ip = socket.gethostbyname(hostname)
+            return ip
+        except Exception:
+            return "127.0.0.1"
+
+
+def generate_qr_png(data):
+    """QRコードを生成してPNGのバイト列として返す"""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+
+    buffered = io.BytesIO()
+    img.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+class AccessQRCode:
+    """
+    スマートフォンからのアクセス用URLとQRコード画像のキャッシュ
+
+    ローカルIPの確認は refresh_seconds ごとに1回だけ行い、
+    QRコード画像は (IP, ポート) が変わったときだけ作り直す。
+    """
+
+    def __init__(self, port: int, refresh_seconds: float = 60):
+        """
+        Args:
+            port: アプリの待ち受けポート
+            refresh_seconds: ローカルIPを確認し直す間隔（秒）
+        """
+        self.port = port
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._ip = None
+        self._checked_at = None
+        # (IP, ポート) → (PNG, ETag)
+        self._image_key = None
+        self._image = None
+
+    def _current_ip(self) -> str:
+        now = time.monotonic()
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.refresh_seconds:
+                return self._ip
+        ip = get_local_ip()
+        with self._lock:
+            self._ip = ip
+            self._checked_at = now
+        return ip
+
+    @property
+    def access_url(self) -> str:
+        """アクセス用URL"""
+        return f"http://{self._current_ip()}:{self.port}"
+
+    def image(self):
+        """
+        QRコード画像
+
+        Returns:
+            (PNGのバイト列, ETag)
+        """
+        key = (self._current_ip(), self.port)
+        with self._lock:
+            if self._image_key == key:
+                return self._image
+
+        png = generate_qr_png(f"http://{key[0]}:{key[1]}")
+        image = (png, hashlib.sha1(png).hexdigest()[:16])
+        with self._lock:
+            self._image_key = key
+            self._image = image
+        return image
@@ -0,0 +1,90 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# recipes テーブルの編集できる列
+RECIPE_FIELDS = ('title', 'genre', 'prep_time', 'cook_time', 'servings', 'calorie')
+
+
+def insert_recipe(conn, recipe: Dict, ingredients: List[Dict], steps: List[str]) -> int:
+    """
+    レシピを材料・手順と一緒に登録する（コミットは呼び出し側で行う）
+
+    Args:
+        conn: DB接続
+        recipe: RECIPE_FIELDS の値
+        ingredients: 材料 {'name', 'quantity', 'unit', 'is_essential'} のリスト（名前が空のものは無視）
+        steps: 手順の説明のリスト（空のものは無視）
+
+    Returns:
+        登録したレシピのID
+    """
+    cursor = conn.execute(
+        "INSERT INTO recipes (title, genre, prep_time, cook_time, servings, calorie, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        tuple(recipe.get(field) for field in RECIPE_FIELDS) + (datetime.now(),)
+    )
+    recipe_id = cursor.lastrowid
+    _insert_children(conn, recipe_id, ingredients, steps)
+    return recipe_id
+
+
+def update_recipe(conn, recipe_id: int, recipe: Dict, ingredients: List[Dict], steps: List[str]) -> bool:
+    """
+    レシピを更新する（材料・手順は一度削除して登録し直す。コミットは呼び出し側で行う）
+
+    Returns:
+        レシピが存在したか
+    """
+    cursor = conn.execute(
+        """UPDATE recipes SET title=?, genre=?, prep_time=?, cook_time=?, servings=?, calorie=?
+           WHERE id=?""",
+        tuple(recipe.get(field) for field in RECIPE_FIELDS) + (recipe_id,)
+    )
+    if cursor.rowcount == 0:
+        return False
+    conn.execute("DELETE FROM recipe_ingredients WHERE recipe_id = ?", (recipe_id,))
+    conn.execute("DELETE FROM recipe_steps WHERE recipe_id = ?", (recipe_id,))
+    _insert_children(conn, recipe_id, ingredients, steps)
+    return True
+
+
+def delete_recipe(conn, recipe_id: int) -> bool:
+    """
+    レシピと関連データを削除する（コミットは呼び出し側で行う）
+
+    Returns:
+        レシピが存在したか
+    """
+    # カスケード削除が設定されていれば親だけで消えるが、念のため関連データも削除
+    # (SQLiteのデフォルト設定に依存しないように明示的に削除)
+    conn.execute("DELETE FROM recipe_ingredients WHERE recipe_id = ?", (recipe_id,))
+    conn.execute("DELETE FROM recipe_steps WHERE recipe_id = ?", (recipe_id,))
+    conn.execute("DELETE FROM recipe_feedback WHERE recipe_id = ?", (recipe_id,))
+    return conn.execute("DELETE FROM recipes WHERE id = ?", (recipe_id,)).rowcount > 0
+
+
+def get_recipe(conn, recipe_id: int) -> Optional[Dict]:
+    """レシピを材料・手順と一緒に取得する（存在しなければNone）"""
+    recipe = conn.execute("SELECT * FROM recipes WHERE id = ?", (recipe_id,)).fetchone()
+    if not recipe:
+        return None
+    ingredients = conn.execute("SELECT * FROM recipe_ingredients WHERE recipe_id = ? ORDER BY id", (recipe_id,)).fetchall()
+    steps = conn.execute("SELECT * FROM recipe_steps WHERE recipe_id = ? ORDER BY step_number", (recipe_id,)).fetchall()
+    return {'recipe': recipe, 'ingredients': ingredients, 'steps': steps}
+
+
+def _insert_children(conn, recipe_id: int, ingredients: List[Dict], steps: List[str]):
+    conn.executemany(
+        "INSERT INTO recipe_ingredients (recipe_id, name, quantity, unit, is_essential) VALUES (?, ?, ?, ?, ?)",
+        [
+            (recipe_id, ing['name'], ing.get('quantity'), ing.get('unit'), 1 if ing.get('is_essential') else 0)
+            for ing in ingredients if ing.get('name')
+        ]
+    )
+    # 手順番号は空の手順を除く前の位置（フォームの並び順）
+    conn.executemany(
+        "INSERT INTO recipe_steps (recipe_id, step_number, description) VALUES (?, ?, ?)",
+        [
+            (recipe_id, index + 1, description)
+            for index, description in enumerate(steps) if description and description.strip()
+        ]
+    )
@@ -0,0 +1,118 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Callable, Dict, List
+
+# レシピ（材料・手順を含む）とフィードバックの更新回数（migrations.py のトリガーで更新される）
+RECIPES_VERSION_QUERY = """
+    SELECT (SELECT version FROM data_versions WHERE name = 'recipes'),
+           (SELECT version FROM data_versions WHERE name = 'feedback')
+"""
+
+
+def inventory_fingerprint(inventory_items: List[Dict]) -> str:
+    """在庫（名前・数量・賞味期限）の内容から作るキー（並び順には依存しない）"""
+    entries = sorted(
+        (str(item.get('name')), str(item.get('quantity')), str(item.get('expiry_date')))
+        for item in inventory_items
+    )
+    digest = hashlib.sha1()
+    for entry in entries:
+        digest.update('\x1f'.join(entry).encode('utf-8'))
+        digest.update(b'\x1e')
+    return digest.hexdigest()
+
+
+class RecommendationCache:
+    """
+    推薦結果（献立・おすすめレシピ）のキャッシュ
+
+    キーは (在庫の内容, レシピ・フィードバックの更新回数, 今日の日付, 推薦の条件)。
+    在庫が変われば内容のキーが変わるため古い結果は使われず、LRUと有効期限で消える。
+    賞味期限の段階は今日の日付で決まるため、日付が変わると別のキーになる。
+    レシピの変更・フィードバックは推薦モデルへの反映後に invalidate() で消す。
+    """
+
+    def __init__(self, max_entries: int = 32, ttl_seconds: float = 600):
+        """
+        Args:
+            max_entries: 保持する結果の最大数（古く使われていないものから消す）
+            ttl_seconds: 結果の有効期限（秒）
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # キー → (作成時刻, 結果)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # invalidate() の回数（計算中に消された場合、古いモデルの結果を保存しないため）
+        self._generation = 0
+
+    def make_key(self, conn, inventory_items: List[Dict], *params) -> tuple:
+        """
+        Args:
+            conn: DB接続（レシピ・フィードバックの更新回数を読む）
+            inventory_items: 推薦に使う在庫
+            params: 結果に影響するその他の条件（日数・献立の作成方法など）
+        """
+        recipes_version, feedback_version = conn.execute(RECIPES_VERSION_QUERY).fetchone()
+        return (inventory_fingerprint(inventory_items), recipes_version, feedback_version, date.today().isoformat()) + params
+
+    def get_or_compute(self, key: tuple, compute: Callable[[], object]):
+        """
+        キャッシュした結果を返す（なければ compute() の結果を保存して返す）
+
+        返した結果は他のリクエストと共有するため、呼び出し側で変更しないこと。
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            generation = self._generation
+
+        result = compute()
+
+        # レシピの更新回数が取れない（マイグレーション前）場合は保存しない
+        if key[1] is not None:
+            with self._lock:
+                if generation != self._generation:
+                    return result
+                self._entries[key] = (time.monotonic(), result)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return result
+
+    def invalidate(self):
+        """すべての結果を消す（レシピの追加・編集・削除やフィードバックを推薦モデルに反映した後に呼ぶ）"""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+            self._generation += 1
+
+    def stats(self) -> Dict:
+        """ヒット・ミスの回数など"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,253 @@
+import sqlite3
+import threading
+import time
+import traceback
+from typing import Dict
+
+# 推薦モデルに関係するデータの更新回数（migrations.py のトリガーで更新される）
+VERSIONS_QUERY = "SELECT name, version FROM data_versions WHERE name IN ('recipes', 'feedback')"
+
+
+class RecommenderLoader:
+    """
+    レシピ推薦システムをバックグラウンドで初期化し、準備状態を管理する
+
+    pandas / scikit-learn の読み込みとモデル構築はここで別スレッドに回すため、
+    在庫一覧などモデルを使わないページは起動直後から応答できる。
+    """
+
+    LOADING = 'loading'
+    READY = 'ready'
+    FAILED = 'failed'
+    NOT_STARTED = 'not_started'
+
+    def __init__(self, db_path: str, sync_versions: bool = False, on_reload=None, recommender_options: Dict = None):
+        """
+        Args:
+            db_path: データベース(inventory.db)のパス
+            sync_versions: Trueなら sync() で他のプロセスによるレシピ・フィードバックの変更を反映する
+                           （gunicorn などで複数のワーカープロセスから同じDBを使う場合）
+            on_reload: sync() でモデルを入れ替えた後に呼ぶ関数（推薦結果のキャッシュを消すなど）
+            recommender_options: MLRecipeRecommender に渡す引数（min_essential_coverage など）
+        """
+        self.db_path = db_path
+        self.sync_versions = sync_versions
+        self.on_reload = on_reload
+        self.recommender_options = recommender_options or {}
+        self.state = self.NOT_STARTED
+        self.error = None
+        self._recommender = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        # 読み込み中に発生したレシピ変更（読み込み完了後に適用する）
+        self._pending = []
+        # 公開中のモデルが反映しているデータの更新回数 {'recipes', 'feedback'}（data_versions）
+        self._versions = {}
+        self._reloading = False
+
+    def start(self):
+        """バックグラウンドで読み込みを開始する（開始済みなら何もしない）"""
+        with self._lock:
+            if self.state != self.NOT_STARTED:
+                return
+            self.state = self.LOADING
+        thread = threading.Thread(target=self._load, name='recommender-loader', daemon=True)
+        thread.start()
+
+    def load(self):
+        """
+        呼び出したスレッドで読み込む（開始済みなら何もしない）
+
+        gunicorn の preload_app ではワーカーを fork する前にマスタープロセスで呼び、
+        読み込んだモデルを全ワーカーでコピーオンライトにより共有する。
+        """
+        with self._lock:
+            if self.state != self.NOT_STARTED:
+                return
+            self.state = self.LOADING
+        self._load()
+
+    def _read_versions(self, conn=None) -> dict:
+        """レシピ・フィードバックの更新回数（migrations.py の data_versions）"""
+        own_conn = conn is None
+        if own_conn:
+            conn = sqlite3.connect(self.db_path)
+        try:
+            return dict(conn.execute(VERSIONS_QUERY).fetchall())
+        except sqlite3.OperationalError:
+            return {}
+        finally:
+            if own_conn:
+                conn.close()
+
+    def versioned(self, work):
+        """
+        レシピを書き込む関数を包み、書き込みの前後のレシピの更新回数も返すようにする（run_write に渡す）
+
+        書き込みと同じトランザクションで読むため、他のプロセスの変更が間に入ることはない。
+
+        Returns:
+            接続を受け取り (work の戻り値, (書き込み前, 書き込み後の更新回数)) を返す関数
+        """
+        def wrapped(conn):
+            before = self._read_versions(conn).get('recipes')
+            result = work(conn)
+            return result, (before, self._read_versions(conn).get('recipes'))
+        return wrapped
+
+    def applied(self, versions):
+        """
+        このプロセスでモデルに反映したレシピの変更を記録する（sync() で読み込み直さないように）
+
+        反映前のモデルが書き込み前の更新回数のものだった場合だけ進める
+        （間に他のプロセスの変更があれば、次の sync() で読み込み直す）。
+
+        Args:
+            versions: versioned() が返した (書き込み前, 書き込み後) の更新回数
+        """
+        if versions is None:
+            return
+        before, after = versions
+        with self._lock:
+            if before is not None and self._versions.get('recipes') == before:
+                self._versions = dict(self._versions, recipes=after)
+
+    def _build(self):
+        """推薦システムを作る（スナップショットが有効ならそこから）"""
+        # 重いライブラリはここで初めてimportする
+        from ml_recipe_recommender import MLRecipeRecommender
+        # 構築中の変更を取りこぼさないよう、更新回数はデータより先に読む
+        versions = self._read_versions()
+        return MLRecipeRecommender(self.db_path, **self.recommender_options), versions
+
+    @staticmethod
+    def _report(recommender, started: float):
+        load_stats = recommender.load_stats
+        if load_stats['source'] == 'snapshot':
+            build_seconds = load_stats['build_seconds']
+            print(f"機械学習レシピ推薦システムを初期化しました（スナップショットから {load_stats['seconds']:.2f}秒"
+                  + (f"、DBから構築した場合 {build_seconds:.2f}秒" if build_seconds is not None else "") + "）")
+        else:
+            print(f"機械学習レシピ推薦システムを初期化しました（DBから構築 {load_stats['seconds']:.2f}秒）")
+        print(f"  ライブラリ読み込みを含む準備時間: {time.perf_counter() - started:.2f}秒")
+
+    def _load(self):
+        started = time.perf_counter()
+        try:
+            recommender, versions = self._build()
+        except Exception as e:
+            print(f"レシピデータの読み込みエラー: {e}")
+            traceback.print_exc()
+            with self._lock:
+                self.error = e
+                self.state = self.FAILED
+            self._ready.set()
+            return
+
+        self._report(recommender, started)
+
+        # 読み込み中に溜まった変更を反映してから公開する
+        while True:
+            with self._lock:
+                pending, self._pending = self._pending, []
+                if not pending:
+                    self._recommender = recommender
+                    self._versions = versions
+                    self.state = self.READY
+                    break
+            for update in pending:
+                self._apply(recommender, update)
+        self._ready.set()
+
+    def sync(self, conn):
+        """
+        他のプロセスによるレシピ・フィードバックの変更を反映する（sync_versions=True の場合のみ、推薦の前に呼ぶ）
+
+        レシピが変わっていればモデルをバックグラウンドで読み込み直し、終わるまでは今のモデルで応答する。
+        読み込み直しは、最初のワーカーが構築して保存したスナップショットを他のワーカーがメモリマップで
+        読む（MLRecipeRecommender がスナップショットの構築をファイルロックで直列化する）。
+        このプロセスで反映済みの変更（applied()）では読み込み直さない。
+        フィードバックだけが変わっていれば集計を読み直す。
+
+        Args:
+            conn: リクエスト中のDB接続
+        """
+        if not self.sync_versions or self.state != self.READY:
+            return
+        versions = self._read_versions(conn)
+        if not versions:
+            return
+        if versions.get('recipes') != self._versions.get('recipes'):
+            with self._lock:
+                if self._reloading:
+                    return
+                self._reloading = True
+            threading.Thread(target=self._reload, name='recommender-reloader', daemon=True).start()
+        elif versions.get('feedback') != self._versions.get('feedback'):
+            self._apply(self._recommender, lambda recommender: recommender.refresh_feedback())
+            self._versions = dict(self._versions, feedback=versions.get('feedback'))
+            self._notify_reload()
+
+    def _reload(self):
+        started = time.perf_counter()
+        try:
+            recommender, versions = self._build()
+        except Exception as e:
+            # 今のモデルのまま応答を続け、次の sync() で再試行する
+            print(f"推薦モデルの再読み込みエラー: {e}")
+            traceback.print_exc()
+            with self._lock:
+                self._reloading = False
+            return
+
+        self._report(recommender, started)
+        with self._lock:
+            self._recommender = recommender
+            self._versions = versions
+            self._reloading = False
+        self._notify_reload()
+
+    def _notify_reload(self):
+        if self.on_reload is not None:
+            self.on_reload()
+
+    def get(self, timeout: float = 0):
+        """
+        推薦システムを返す
+
+        Args:
+            timeout: 準備中の場合に待つ最大秒数
+
+        Returns:
+            準備できていれば MLRecipeRecommender、準備中・失敗時は None
+        """
+        self.start()
+        self._ready.wait(timeout)
+        return self._recommender
+
+    @property
+    def ready(self) -> bool:
+        return self.state == self.READY
+
+    def when_ready(self, update):
+        """
+        推薦システムへの更新処理を実行する（準備中なら読み込み完了後に実行）
+
+        Args:
+            update: MLRecipeRecommender を受け取る関数
+        """
+        with self._lock:
+            if self.state == self.LOADING:
+                self._pending.append(update)
+                return
+            recommender = self._recommender
+        if recommender is not None:
+            self._apply(recommender, update)
+
+    @staticmethod
+    def _apply(recommender, update):
+        try:
+            update(recommender)
+        except Exception as e:
+            print(f"推薦モデルの更新エラー: {e}")
+            traceback.print_exc()
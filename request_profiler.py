@@ -0,0 +1,253 @@
+"""
+推薦処理のプロファイル（任意のリクエストだけ）
+
+次のどちらかの場合に、そのリクエストの推薦計算（recommend_daily_menu / recommend_recipes）をプロファイルする:
+    - ローカルホストからのリクエストで ?profile=cprofile|sample、またはヘッダー X-Fridgemate-Profile: cprofile|sample
+      （?profile=1 は cprofile）
+    - sample_every=N を指定した場合、N 件に1件（sample）
+
+    cprofile: cProfile による関数ごとの集計。<名前>.prof（pstats、snakeviz などで開ける）と
+              <名前>.txt（累積時間の上位）を保存する
+    sample:   別スレッドが interval 秒ごとにリクエストのスレッドのスタックを記録する統計的プロファイル。
+              オーバーヘッドが小さいため本番の抽出にも使える。
+              <名前>.collapsed（flamegraph.pl / speedscope でそのまま読める "関数;関数;... 回数" 形式）を保存する
+
+プロファイルしたリクエストは推薦結果のキャッシュを使わずに計算する。
+保存先のファイルは新しいものから max_profiles 件だけ残す（リングバッファ）。
+/profiles（一覧）と /profiles/<ファイル名>（ダウンロード）はローカルホストからのみ使える。
+"""
+import cProfile
+import io
+import itertools
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+PROFILE_MODES = ('cprofile', 'sample')
+PROFILE_HEADER = 'X-Fridgemate-Profile'
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+# 保存するファイル名（<日時>-<プロセスID>-<連番>-<ラベル>.<拡張子>）
+_FILE_NAME = re.compile(r'^[0-9]{8}T[0-9]{6}-[0-9]+-[0-9]+-[a-z_]+\.(prof|txt|collapsed)$')
+
+
+class _StackSampler:
+    """指定したスレッドのスタックを一定間隔で記録する"""
+
+    def __init__(self, thread_id: int, skip_frames: int, interval: float):
+        """
+        Args:
+            thread_id: 記録するスレッド
+            skip_frames: スタックの根元から省くフレーム数（プロファイル対象の呼び出しより外側）
+            interval: 記録の間隔（秒）
+        """
+        self.thread_id = thread_id
+        self.skip_frames = skip_frames
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            names.reverse()
+            stack = names[self.skip_frames:]
+            if stack:
+                self.stacks[';'.join(stack)] += 1
+                self.samples += 1
+
+
+class RequestProfiler:
+    """推薦処理のプロファイルを取り、保存先のディレクトリにリングバッファとして保存する"""
+
+    def __init__(self, directory: str, max_profiles: int = 20, sample_every: int = 0,
+                 interval_ms: float = 5, top_functions: int = 40):
+        """
+        Args:
+            directory: プロファイルの保存先
+            max_profiles: 残すプロファイルの数（古いものから消す）
+            sample_every: N 件に1件のリクエストを sample でプロファイルする（0 なら指定時のみ）
+            interval_ms: sample の記録間隔（ミリ秒）
+            top_functions: cprofile の .txt に書く関数の数
+        """
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self.sample_every = sample_every
+        self.interval = interval_ms / 1000
+        self.top_functions = top_functions
+        self._requests = itertools.count(1)
+        self._sequence = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def requested_mode(self, request) -> Optional[str]:
+        """
+        このリクエストをプロファイルするか
+
+        Returns:
+            'cprofile' / 'sample'（プロファイルしない場合は None）
+        """
+        flag = request.args.get('profile') or request.headers.get(PROFILE_HEADER)
+        if flag and request.remote_addr in LOCAL_ADDRESSES:
+            flag = flag.strip().lower()
+            return 'cprofile' if flag in ('1', 'true', 'yes') else flag if flag in PROFILE_MODES else None
+        if self.sample_every > 0 and next(self._requests) % self.sample_every == 0:
+            return 'sample'
+        return None
+
+    def run(self, mode: str, label: str, function: Callable[[], object]):
+        """
+        function() をプロファイルしながら実行し、結果を保存する
+
+        Returns:
+            (function の戻り値, 保存したプロファイルの名前)
+        """
+        if mode == 'cprofile':
+            profile = cProfile.Profile()
+            started = time.perf_counter()
+            result = profile.runcall(function)
+            elapsed = time.perf_counter() - started
+            return result, self._save_cprofile(label, profile, elapsed)
+
+        sampler = _StackSampler(threading.get_ident(), self._depth(), self.interval)
+        sampler.start()
+        started = time.perf_counter()
+        try:
+            result = function()
+        finally:
+            elapsed = time.perf_counter() - started
+            stacks = sampler.stop()
+        return result, self._save_collapsed(label, stacks, elapsed)
+
+    @staticmethod
+    def _depth() -> int:
+        """呼び出し元（run）までのフレーム数。サンプルはそれより内側（function 以降）だけを残す"""
+        depth = 0
+        frame = sys._getframe(1)
+        while frame is not None:
+            depth += 1
+            frame = frame.f_back
+        # run のフレームも省く
+        return depth
+
+    def _new_name(self, label: str) -> str:
+        label = re.sub(r'[^a-z_]', '_', label.lower()) or 'profile'
+        return f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{next(self._sequence)}-{label}"
+
+    def _save_cprofile(self, label: str, profile: cProfile.Profile, elapsed: float) -> str:
+        name = self._new_name(label)
+        os.makedirs(self.directory, exist_ok=True)
+        profile.dump_stats(os.path.join(self.directory, name + '.prof'))
+        summary = io.StringIO()
+        summary.write(f"{label}: {elapsed * 1000:.1f}ms\n\n")
+        pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(self.top_functions)
+        with open(os.path.join(self.directory, name + '.txt'), 'w', encoding='utf-8') as f:
+            f.write(summary.getvalue())
+        self._trim()
+        return name
+
+    def _save_collapsed(self, label: str, stacks: Counter, elapsed: float) -> str:
+        name = self._new_name(label)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, name + '.collapsed'), 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self._trim()
+        return name
+
+    def _trim(self):
+        """新しいものから max_profiles 件を残して消す"""
+        with self._lock:
+            profiles = {}
+            for entry in os.scandir(self.directory):
+                if _FILE_NAME.match(entry.name):
+                    base = entry.name.rsplit('.', 1)[0]
+                    profiles.setdefault(base, []).append(entry)
+            ordered = sorted(profiles.values(), key=lambda entries: max(e.stat().st_mtime for e in entries),
+                             reverse=True)
+            for entries in ordered[self.max_profiles:]:
+                for entry in entries:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+
+    def list_profiles(self) -> List[Dict]:
+        """保存されているプロファイルのファイル（新しい順）"""
+        if not os.path.isdir(self.directory):
+            return []
+        files = []
+        for entry in os.scandir(self.directory):
+            if _FILE_NAME.match(entry.name):
+                stat = entry.stat()
+                files.append({
+                    'file': entry.name,
+                    'bytes': stat.st_size,
+                    'created_at': datetime.fromtimestamp(stat.st_mtime).isoformat(timespec='seconds'),
+                })
+        files.sort(key=lambda f: (f['created_at'], f['file']), reverse=True)
+        return files
+
+    def file_path(self, file_name: str) -> Optional[str]:
+        """ダウンロードするファイルのパス（保存したプロファイル以外は None）"""
+        if not _FILE_NAME.match(file_name):
+            return None
+        path = os.path.join(self.directory, file_name)
+        return path if os.path.isfile(path) else None
+
+
+def init_app(app, profiler: RequestProfiler):
+    """
+    Flask アプリに /profiles（一覧）と /profiles/<ファイル名> を追加する（ローカルホストからのみ）
+
+    プロファイルしたリクエストの応答には X-Fridgemate-Profile ヘッダーで保存した名前を付ける
+    （g.profile_name を設定した場合）。
+    """
+    from flask import abort, g, jsonify, request, send_file
+
+    def local_only():
+        if request.remote_addr not in LOCAL_ADDRESSES:
+            abort(403)
+
+    @app.after_request
+    def add_profile_header(response):
+        name = g.pop('profile_name', None)
+        if name:
+            response.headers[PROFILE_HEADER] = name
+        return response
+
+    @app.route('/profiles')
+    def list_profiles():
+        local_only()
+        return jsonify({'profiles': profiler.list_profiles()})
+
+    @app.route('/profiles/<file_name>')
+    def download_profile(file_name):
+        local_only()
+        path = profiler.file_path(file_name)
+        if path is None:
+            abort(404)
+        mimetype = 'application/octet-stream' if file_name.endswith('.prof') else 'text/plain'
+        return send_file(path, mimetype=mimetype, as_attachment=file_name.endswith('.prof'))
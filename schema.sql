@@ -34,4 +34,22 @@ CREATE TABLE IF NOT EXISTS recipe_steps (
     step_number INTEGER NOT NULL,
     description TEXT NOT NULL,
     FOREIGN KEY (recipe_id) REFERENCES recipes (id) ON DELETE CASCADE
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS recipe_feedback (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recipe_id TEXT NOT NULL,
+    recipe_title TEXT NOT NULL,
+    feedback_type TEXT NOT NULL, -- 'made' または 'rating'
+    rating INTEGER, -- 1-5の星評価
+    feedback_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- インデックス（既存のDBには migrations.py で追加される）
+CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_recipe_id ON recipe_ingredients (recipe_id);
+CREATE INDEX IF NOT EXISTS idx_recipe_steps_recipe_step ON recipe_steps (recipe_id, step_number);
+CREATE INDEX IF NOT EXISTS idx_recipe_feedback_recipe_id ON recipe_feedback (recipe_id);
+CREATE INDEX IF NOT EXISTS idx_recipes_created_at ON recipes (created_at);
+CREATE INDEX IF NOT EXISTS idx_items_expiry_date ON items (expiry_date);
+CREATE INDEX IF NOT EXISTS idx_items_quantity ON items (quantity);
+CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_norm_name ON recipe_ingredients (lower(trim(name)));
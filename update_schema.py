@@ -1,5 +1,6 @@
 import sqlite3
 import os
+from migrations import apply_migrations
 
 # Define path to DB and schema
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -18,7 +19,8 @@ def update_db():
         conn.executescript(schema_sql)
     conn.commit()
     conn.close()
-    print("Database schema updated successfully.")
+    version = apply_migrations(DB_PATH)
+    print(f"Database schema updated successfully (version {version}).")
 
 if __name__ == "__main__":
     update_db()
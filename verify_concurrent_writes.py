@@ -0,0 +1,138 @@
+"""
+在庫の増減ボタンが同時に押されたときの負荷試験
+
+一時ファイルのデータベースに対してアプリをスレッド付きのHTTPサーバーで起動し、
+複数のスレッドから /increase と /decrease を同時に送る（同時に / も読み込む）。
+終了後に数量が「初期値 + 増やした回数 - 減らした回数」と一致すること（更新が失われていないこと）、
+"database is locked" などのエラーが1件もないことを確認する。
+
+使い方:
+    python verify_concurrent_writes.py [--threads 8] [--requests 50] [--journal-mode WAL]
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在庫更新エンドポイントの同時書き込み試験")
+    parser.add_argument("--threads", type=int, default=8, help="同時に書き込むスレッド数")
+    parser.add_argument("--requests", type=int, default=50, help="スレッドごとのリクエスト数")
+    parser.add_argument("--readers", type=int, default=2, help="同時に在庫一覧を読むスレッド数")
+    parser.add_argument("--journal-mode", default="WAL", help="WAL または DELETE（従来のジャーナル）")
+    parser.add_argument("--busy-timeout-ms", type=int, default=5000)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="fridgemate_load_")
+    db_path = os.path.join(work_dir, "inventory.db")
+
+    # app2 の読み込み前に一時DBと設定を指定する
+    os.environ["FRIDGEMATE_DATABASE"] = db_path
+    os.environ["FRIDGEMATE_RECOMMENDER_LOAD"] = "lazy"
+    os.environ["FRIDGEMATE_DB_JOURNAL_MODE"] = args.journal_mode
+    os.environ["FRIDGEMATE_DB_BUSY_TIMEOUT_MS"] = str(args.busy_timeout_ms)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    conn = sqlite3.connect(db_path)
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql"), encoding="utf-8") as f:
+        conn.executescript(f.read())
+    initial_quantity = 1000
+    conn.execute(
+        "INSERT INTO items (name, quantity, category, expiry_date) VALUES (?, ?, ?, date('now', '+5 days'))",
+        ("負荷試験用の卵", initial_quantity, "卵")
+    )
+    item_id = conn.execute("SELECT MAX(id) FROM items").fetchone()[0]
+    conn.commit()
+    conn.close()
+
+    import logging
+    from werkzeug.serving import make_server
+    import app2
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app2.app, threaded=True)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    counts = {"increase": 0, "decrease": 0, "read": 0}
+    errors = []
+    lock = threading.Lock()
+    writers_done = threading.Event()
+
+    def request(path, method="GET"):
+        req = urllib.request.Request(base_url + path, method=method, data=b"" if method == "POST" else None)
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                body = response.read().decode("utf-8", "replace")
+                return response.status, body
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode("utf-8", "replace")
+
+    def writer(seed):
+        rng = random.Random(seed)
+        for _ in range(args.requests):
+            action = rng.choice(("increase", "decrease"))
+            status, body = request(f"/{action}/{item_id}", method="POST")
+            with lock:
+                if status == 200:
+                    counts[action] += 1
+                else:
+                    errors.append(f"{action}: {status} {body[:200]}")
+
+    def reader():
+        while not writers_done.is_set():
+            status, body = request("/")
+            with lock:
+                if status == 200:
+                    counts["read"] += 1
+                else:
+                    errors.append(f"read: {status} {body[:200]}")
+
+    print(f"ジャーナルモード: {args.journal_mode} / 書き込み {args.threads}スレッド x {args.requests}回 / 読み込み {args.readers}スレッド")
+    started = time.perf_counter()
+    readers = [threading.Thread(target=reader) for _ in range(args.readers)]
+    writers = [threading.Thread(target=writer, args=(seed,)) for seed in range(args.threads)]
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    writers_done.set()
+    for thread in readers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    conn = sqlite3.connect(db_path)
+    final_quantity = conn.execute("SELECT quantity FROM items WHERE id = ?", (item_id,)).fetchone()[0]
+    conn.close()
+    app2.db_pool.close_all()
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    expected = initial_quantity + counts["increase"] - counts["decrease"]
+    total_writes = counts["increase"] + counts["decrease"]
+    print(f"書き込み {total_writes}件 / 読み込み {counts['read']}件 / {elapsed:.2f}秒 ({total_writes / elapsed:.0f} 書き込み/秒)")
+    print(f"数量: 期待値 {expected} / 実際 {final_quantity}")
+
+    locked = [error for error in errors if "locked" in error.lower() or "busy" in error.lower()]
+    if errors:
+        print(f"FAILURE: エラー {len(errors)}件（うちロック関連 {len(locked)}件）")
+        for error in errors[:5]:
+            print("  " + error)
+    if final_quantity != expected:
+        print("FAILURE: 更新が失われています。")
+    if not errors and final_quantity == expected:
+        print("SUCCESS: 更新の欠落・ロックエラーはありません。")
+        return 0
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
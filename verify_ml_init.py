@@ -9,14 +9,17 @@ sys.argv = ["app2.py"]
 
 try:
     print("Importing app2...")
-    # Import app2, which should run the initialization code at module level
+    # Import app2, which starts loading the recommender in the background
     import app2
     
-    if app2.recommender is not None:
-        print("SUCCESS: app2.recommender initialized successfully.")
-        print(f"Recommender type: {type(app2.recommender)}")
+    # Wait for the background initialization to finish
+    recommender = app2.recommender_loader.get(timeout=300)
+    
+    if recommender is not None:
+        print("SUCCESS: recommender initialized successfully.")
+        print(f"Recommender type: {type(recommender)}")
     else:
-        print("FAILURE: app2.recommender is None.")
+        print(f"FAILURE: recommender is not ready (state: {app2.recommender_loader.state}).")
         
 except Exception as e:
     import traceback
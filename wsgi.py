@@ -0,0 +1,36 @@
+"""
+本番用のWSGIエントリポイント（複数のワーカープロセスで動かす場合）
+
+    pip install -r requirements.txt   # gunicorn は Windows 以外で入る
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+app2.py を直接実行すると Flask の開発用サーバー（1プロセス）で動く。こちらは次のように動かす:
+
+- 推薦モデルはマスタープロセスで import 時に読み込み（FRIDGEMATE_RECOMMENDER_LOAD=preload）、
+  その後ワーカーを fork する。読み込んだオブジェクトはコピーオンライトで全ワーカーに共有される。
+- スナップショット（inventory_model/）から読み込んだ場合、特徴量行列と接続行列はメモリマップなので、
+  ワーカーが読み込み直した後もOSのページキャッシュで共有される。
+
+レシピが変わったときの再読み込み（FRIDGEMATE_RECOMMENDER_SYNC=1）:
+
+1. レシピの追加・編集・削除、catalog_io.py / migrate_excel_to_db.py での読み込みは
+   data_versions の 'recipes' を上げる（migrations.py のトリガー）。
+2. 各ワーカーは推薦の前にその値を確認し、モデルが読み込んだ時点の値と違えば
+   新しいモデルをバックグラウンドで読み込む。終わるまでは今のモデルで応答し、
+   入れ替えた後に推薦結果のキャッシュを消す。
+3. フィードバック（'feedback'）だけが変わった場合は集計を読み直す。
+
+サーバーを再起動する必要はない。マスタープロセスのモデルは古いまま残るため、
+大量のレシピを入れ替えた後は gunicorn に HUP を送ると、新しいワーカーも最新のモデルから始まる。
+"""
+import os
+
+os.environ.setdefault('FRIDGEMATE_RECOMMENDER_LOAD', 'preload')
+os.environ.setdefault('FRIDGEMATE_RECOMMENDER_SYNC', '1')
+
+from app2 import app  # noqa: E402
+
+
+def create_app():
+    """WSGIアプリケーションを返す（gunicorn 'wsgi:create_app()' 用）"""
+    return app